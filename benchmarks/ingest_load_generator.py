@@ -0,0 +1,165 @@
+"""
+Load an ingest server ("python main.py ingest") with concurrent client streams, to measure how many streams it keeps up
+with. Each client streams the same audio in buffers, at real-time pace or faster, and reads its results as they arrive.
+Start the server, then run from the repository root:
+
+    python -m benchmarks.ingest_load_generator [--clients 8] [--input recording.wav] [--speed 1]
+        [--host 127.0.0.1] [--port 8766] [--output results.json]
+
+The input is a 16-bit mono WAV file; without one, a few seconds of a tone with syllable-like bursts are streamed.
+
+Reported metrics, per client:
+- first_result_ms: time from the start of the stream to its first result.
+- finish_ms: time from the end of the stream to its last result, how far transcription fell behind.
+- send_stall_ms: time spent waiting to send audio, when the server's flow control slows the client down.
+- stream_rtf: time from the start of the stream to its last result, divided by the audio duration. At real-time pace,
+  it stays close to 1 while the server keeps up.
+And for all clients together:
+- throughput: audio seconds transcribed per wall-clock second.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import wave
+
+import numpy as np
+
+from benchmarks.pipeline_benchmark import git_commit, percentiles
+from src.config import FRAMES_PER_BUFFER, INGEST_HOST, INGEST_PORT
+from src.ingest_server import read_message, write_message
+
+
+def synthetic_audio(duration, sample_rate):
+    """
+    :return: A tone interrupted four times a second, as 16-bit PCM bytes, so that voice activity detection keeps it.
+    """
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    envelope = (np.sin(2 * np.pi * 4 * t) > 0).astype(np.float32)
+    return (0.3 * 32767 * envelope * np.sin(2 * np.pi * 220 * t)).astype(np.int16).tobytes()
+
+
+def load_audio(path):
+    """
+    :return: A tuple of the PCM bytes and the sample rate of a 16-bit mono WAV file.
+    """
+    with wave.open(path, "rb") as wave_file:
+        if wave_file.getsampwidth() != 2 or wave_file.getnchannels() != 1:
+            raise ValueError("The input must be a 16-bit mono WAV file.")
+        return wave_file.readframes(wave_file.getnframes()), wave_file.getframerate()
+
+
+async def stream_client(host, port, session_id, pcm_data, sample_rate, speed):
+    """
+    Stream audio to the ingest server, paced at speed times real time (0 for no pacing), and read its results.
+    :return: A dictionary of the client's timings and result count.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    write_message(writer, {"session_id": session_id, "sample_rate": sample_rate})
+    timings = {"results": 0, "first_result_s": None}
+    start_time = time.perf_counter()
+
+    async def receive():
+        while True:
+            header, _ = await read_message(reader)
+            if header["type"] == "result":
+                timings["results"] += 1
+                if timings["first_result_s"] is None:
+                    timings["first_result_s"] = time.perf_counter() - start_time
+            elif header["type"] == "error":
+                raise RuntimeError(header["error"])
+            else:
+                return time.perf_counter()
+
+    receiver = asyncio.create_task(receive())
+    buffer_size = FRAMES_PER_BUFFER * 2
+    stall_time = 0.0
+    for start in range(0, len(pcm_data), buffer_size):
+        end = start + buffer_size
+        write_message(writer, {"type": "audio"}, pcm_data[start:end])
+        drain_start = time.perf_counter()
+        await writer.drain()
+        stall_time += time.perf_counter() - drain_start
+        if speed > 0:
+            due_time = start_time + end / 2 / sample_rate / speed
+            await asyncio.sleep(max(0.0, due_time - time.perf_counter()))
+    write_message(writer, {"type": "end"})
+    await writer.drain()
+    end_time = time.perf_counter()
+    done_time = await receiver
+    writer.close()
+    await writer.wait_closed()
+    return {
+        **timings,
+        "finish_s": done_time - end_time,
+        "stream_seconds": done_time - start_time,
+        "send_stall_s": stall_time,
+    }
+
+
+async def run_clients(args, pcm_data, sample_rate):
+    """
+    :return: A tuple of the timings of every client and the wall-clock duration of the run.
+    """
+    start_time = time.perf_counter()
+    timings = await asyncio.gather(
+        *(
+            stream_client(args.host, args.port, f"load-{i}", pcm_data, sample_rate, args.speed)
+            for i in range(args.clients)
+        )
+    )
+    return timings, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=8, help="Number of concurrent streams")
+    parser.add_argument("--input", help="16-bit mono WAV file to stream, a synthetic tone if not given")
+    parser.add_argument("--duration", type=float, default=10, help="Duration of the synthetic tone in seconds")
+    parser.add_argument("--speed", type=float, default=1, help="Streaming speed, 1 for real time, 0 for no pacing")
+    parser.add_argument("--host", default=INGEST_HOST, help="Address of the ingest server")
+    parser.add_argument("--port", type=int, default=INGEST_PORT, help="Port of the ingest server")
+    parser.add_argument("--output", help="Write the results as JSON to this file, or to stdout with -")
+    args = parser.parse_args()
+
+    if args.input:
+        pcm_data, sample_rate = load_audio(args.input)
+    else:
+        sample_rate = 16000
+        pcm_data = synthetic_audio(args.duration, sample_rate)
+    audio_seconds = len(pcm_data) / 2 / sample_rate
+    timings, wall_seconds = asyncio.run(run_clients(args, pcm_data, sample_rate))
+
+    results = {
+        "first_result_ms": percentiles(
+            [timing["first_result_s"] for timing in timings if timing["first_result_s"] is not None]
+        ),
+        "finish_ms": percentiles([timing["finish_s"] for timing in timings]),
+        "send_stall_ms": percentiles([timing["send_stall_s"] for timing in timings]),
+        "stream_rtf": max(timing["stream_seconds"] for timing in timings) / audio_seconds,
+        "results": sum(timing["results"] for timing in timings),
+        "throughput": audio_seconds * args.clients / wall_seconds,
+    }
+    report = {
+        "commit": git_commit(),
+        "settings": {key: getattr(args, key) for key in ("clients", "input", "duration", "speed")},
+        "audio_seconds": audio_seconds,
+        **results,
+    }
+
+    print(f"{args.clients} clients streaming {audio_seconds:.1f} s of audio at speed {args.speed}")
+    for name in ("first_result_ms", "finish_ms", "send_stall_ms"):
+        if results[name] is not None:
+            print(f"{name}: " + ", ".join(f"{key} {value:.0f}" for key, value in results[name].items()))
+    print(f"max stream RTF {results['stream_rtf']:.2f}, {results['results']} results")
+    print(f"throughput: {results['throughput']:.2f} audio seconds per wall-clock second")
+    if args.output == "-":
+        print(json.dumps(report, indent=4))
+    elif args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
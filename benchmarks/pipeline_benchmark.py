@@ -0,0 +1,350 @@
+"""
+Benchmark the capture-to-transcript pipeline: PCM audio is fed to AudioProcessor.audio_callback in buffers of
+FRAMES_PER_BUFFER frames, at real-time pace or faster, and transcribed by a stub or a real Whisper model.
+
+The stub model sleeps for a fixed time per call plus a fixed time per second of audio, which isolates the overhead of
+the pipeline (buffering, resampling, voice activity detection, queuing and threading) from the model. Real models are
+loaded with whisper.load_model and run on the CPU. Run from the repository root:
+
+    python -m benchmarks.pipeline_benchmark [--model stub|tiny|base] [--input recording.wav] [--speed 1]
+        [--spool on] [--output results.json]
+
+With --spool on, queued chunks are also written to an AudioSpool (see SPOOL_PATH), to measure its cost on the
+capture path in callback_ms.
+
+Reported metrics:
+- wall_rtf: time from the first buffer to the last result, divided by the audio duration.
+- transcription_rtf: time spent in transcription calls, divided by the audio duration.
+- latency_ms: time from the callback that completes a chunk to the chunk's result, per chunk.
+- callback_ms: execution time of audio_callback, per buffer.
+- late_callbacks: number of audio_callback calls that took longer than the duration of their buffer, which makes a
+  real audio stream overrun.
+- queue_depth: number of chunks waiting in the processing queue, sampled every --sample-interval seconds.
+- peak_rss_mb: peak resident memory of this process and of its child processes (transcription workers).
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+import src.audio_processor
+import src.cpu_topology
+import src.whisper_service
+from src.audio_processor import AudioProcessor
+from src.audio_spool import AudioSpool
+from src.audio_utils import WHISPER_SAMPLE_RATE
+from src.config import (
+    CAPTURE_CORES,
+    CPU_AFFINITY,
+    FRAMES_PER_BUFFER,
+    TORCH_INTER_OP_THREADS,
+    TORCH_INTRA_OP_THREADS,
+    TRANSCRIPTION_BATCH_SIZE,
+    TRANSCRIPTION_WORKERS,
+    VAD_ENABLED,
+)
+from src.cpu_topology import capture_affinity, configure_torch_threads, torch_thread_counts, transcription_affinity
+from src.whisper_service import WhisperService
+
+
+class StubModel:
+    def __init__(self, call_time, time_per_second):
+        """
+        Initialize a deterministic stand-in for a Whisper model.
+        :param call_time: The time each transcribe call takes regardless of its audio, in seconds.
+        :param time_per_second: The time each call takes per second of audio, in seconds.
+        """
+        self.call_time = call_time
+        self.time_per_second = time_per_second
+
+    def transcribe(self, audio, **options):
+        return self.transcribe_batch([audio], **options)[0]
+
+    def transcribe_batch(self, audios, **options):
+        audio_seconds = sum(len(audio) for audio in audios) / WHISPER_SAMPLE_RATE
+        time.sleep(self.call_time + self.time_per_second * audio_seconds)
+        return [{"text": " stub", "segments": []} for _ in audios]
+
+
+def make_speech_like_audio(sample_rate, duration):
+    """
+    Generate 16-bit PCM utterances of 1 to 4 seconds separated by 0.6 to 1.5 second pauses, so that voice activity
+    detection finds segments like in real speech.
+    """
+    rng = np.random.default_rng(0)
+    length = int(sample_rate * duration)
+    audio = 0.002 * rng.standard_normal(length)
+    position = 0
+    while position < length:
+        position += int(sample_rate * rng.uniform(0.6, 1.5))
+        utterance_end = min(length, position + int(sample_rate * rng.uniform(1.0, 4.0)))
+        t = np.arange(utterance_end - position) / sample_rate
+        audio[position:utterance_end] += 0.3 * np.sin(2 * np.pi * 180 * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t))
+        position = utterance_end
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes()
+
+
+def read_wav(path):
+    """
+    Read a 16-bit PCM WAV file, keeping its first channel.
+    :return: A tuple of the PCM data and the sample rate.
+    """
+    with wave.open(path) as wave_file:
+        if wave_file.getsampwidth() != 2:
+            raise ValueError(f"{path} is not a 16-bit PCM WAV file.")
+        samples = np.frombuffer(wave_file.readframes(wave_file.getnframes()), dtype=np.int16)
+        channel_count = wave_file.getnchannels()
+        first_channel = samples[::channel_count]
+        return first_channel.tobytes(), wave_file.getframerate()
+
+
+def load_model(name, workers, call_time, time_per_second):
+    if name == "stub":
+        return StubModel(call_time, time_per_second)
+    if workers > 1:
+        from src.transcription_pool import TranscriptionPool
+
+        return TranscriptionPool(name, workers)
+    import whisper
+
+    configure_torch_threads(*torch_thread_counts(1))
+    return whisper.load_model(name, device="cpu")
+
+
+def thread_count(value):
+    """
+    Parse a torch thread count setting: a number, "auto", or "none" for torch's default.
+    """
+    if value in ("auto", "none"):
+        return None if value == "none" else value
+    return int(value)
+
+
+def percentiles(values):
+    """
+    :return: The 50th, 90th and 99th percentiles and the maximum of values, in milliseconds, or None if empty.
+    """
+    if len(values) == 0:
+        return None
+    milliseconds = np.asarray(values) * 1000
+    return {
+        "p50": float(np.percentile(milliseconds, 50)),
+        "p90": float(np.percentile(milliseconds, 90)),
+        "p99": float(np.percentile(milliseconds, 99)),
+        "max": float(milliseconds.max()),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(pcm_data, sample_rate, model, speed, sample_interval, spool=False):
+    """
+    Feed PCM audio through the pipeline and measure it.
+    :param pcm_data: The 16-bit mono PCM audio data.
+    :param sample_rate: The sample rate of the audio.
+    :param model: The model, or the TranscriptionPool used in its place.
+    :param speed: The feeding pace relative to real time, or 0 to feed as fast as possible.
+    :param sample_interval: The time between queue depth samples in seconds.
+    :param spool: Whether to write the queued chunks to an AudioSpool.
+    :return: A dictionary of the measurements.
+    """
+    with tempfile.TemporaryDirectory() as output_directory:
+        whisper_transcription = WhisperService(
+            model,
+            output_file_path=f"{output_directory}/results.json",
+            spool=AudioSpool(f"{output_directory}/spool") if spool else None,
+        )
+        processor = AudioProcessor(sample_rate, whisper_transcription)
+
+        queued_times = {}
+        result_times = {}
+        transcription_times = []
+        queue_audio = processor.queue_audio
+        append_transcription_result = whisper_transcription.append_transcription_result
+        transcribe_audio_chunk = whisper_transcription.transcribe_audio_chunk
+        transcribe_audio_batch = whisper_transcription.transcribe_audio_batch
+
+        def timed_queue_audio(audio):
+            queued_times[processor.next_sequence] = time.perf_counter()
+            queue_audio(audio)
+
+        def timed_append_transcription_result(result, volume, sequence=None, timings=None):
+            result_times[sequence] = time.perf_counter()
+            append_transcription_result(result, volume, sequence, timings)
+
+        def timed(function):
+            def timed_function(*args):
+                start = time.perf_counter()
+                try:
+                    return function(*args)
+                finally:
+                    transcription_times.append(time.perf_counter() - start)
+
+            return timed_function
+
+        processor.queue_audio = timed_queue_audio
+        whisper_transcription.append_transcription_result = timed_append_transcription_result
+        whisper_transcription.transcribe_audio_chunk = timed(transcribe_audio_chunk)
+        whisper_transcription.transcribe_audio_batch = timed(transcribe_audio_batch)
+
+        queue_depths = []
+        sampling = threading.Event()
+        start_time = time.perf_counter()
+
+        def sample_queue_depth():
+            while not sampling.wait(sample_interval):
+                queue_depths.append((time.perf_counter() - start_time, processor.processing_queue.qsize()))
+
+        sampler = threading.Thread(target=sample_queue_depth, daemon=True)
+        sampler.start()
+
+        buffer_size = FRAMES_PER_BUFFER * 2
+        callback_times = []
+
+        # Call audio_callback from its own thread, like the audio stream does, as it pins that thread with CPU_AFFINITY
+        def feed_audio():
+            for start in range(0, len(pcm_data), buffer_size):
+                if speed > 0:
+                    delay = start_time + start / 2 / sample_rate / speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                end = start + buffer_size
+                callback_start = time.perf_counter()
+                processor.audio_callback(pcm_data[start:end], FRAMES_PER_BUFFER, None, 0)
+                callback_times.append(time.perf_counter() - callback_start)
+
+        feeder = threading.Thread(target=feed_audio)
+        feeder.start()
+        feeder.join()
+        processor.finalize_recording()
+        processor.wait_for_processing()
+        elapsed_time = time.perf_counter() - start_time
+        sampling.set()
+        processor.stop_processing(output_results=False)
+        whisper_transcription.transcript_writer.remove()
+
+    audio_seconds = len(pcm_data) / 2 / sample_rate
+    latencies = [result_times[sequence] - queued_times[sequence] for sequence in result_times if sequence in queued_times]
+    depths = [depth for _, depth in queue_depths]
+    return {
+        "audio_seconds": audio_seconds,
+        "elapsed_seconds": elapsed_time,
+        "wall_rtf": elapsed_time / audio_seconds,
+        "transcription_rtf": sum(transcription_times) / audio_seconds,
+        "chunks": len(queued_times),
+        "latency_ms": percentiles(latencies),
+        "callback_ms": percentiles(callback_times),
+        "late_callbacks": sum(callback_time > FRAMES_PER_BUFFER / sample_rate for callback_time in callback_times),
+        "queue_depth": {
+            "max": max(depths, default=0),
+            "mean": float(np.mean(depths)) if depths else 0.0,
+            "samples": [[round(t, 3), depth] for t, depth in queue_depths],
+        },
+        "peak_rss_mb": {
+            "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="stub", help="stub, or the size of a Whisper model such as tiny or base")
+    parser.add_argument("--input", help="16-bit PCM WAV file to feed instead of synthetic speech-like audio")
+    parser.add_argument("--sample-rate", type=int, default=48000, help="Sample rate of the synthetic audio")
+    parser.add_argument("--duration", type=float, default=60, help="Duration of the synthetic audio in seconds")
+    parser.add_argument("--speed", type=float, default=1.0, help="Feeding pace relative to real time, 0 for no pacing")
+    parser.add_argument("--workers", type=int, default=TRANSCRIPTION_WORKERS, help="TRANSCRIPTION_WORKERS to use")
+    parser.add_argument("--batch-size", type=int, default=TRANSCRIPTION_BATCH_SIZE, help="TRANSCRIPTION_BATCH_SIZE to use")
+    parser.add_argument("--vad", choices=["on", "off"], default="on" if VAD_ENABLED else "off", help="VAD_ENABLED to use")
+    parser.add_argument(
+        "--intra-op-threads", type=thread_count, default=TORCH_INTRA_OP_THREADS, help="TORCH_INTRA_OP_THREADS to use"
+    )
+    parser.add_argument(
+        "--inter-op-threads", type=thread_count, default=TORCH_INTER_OP_THREADS, help="TORCH_INTER_OP_THREADS to use"
+    )
+    parser.add_argument("--capture-cores", type=int, default=CAPTURE_CORES, help="CAPTURE_CORES to use")
+    parser.add_argument("--affinity", choices=["on", "off"], default="on" if CPU_AFFINITY else "off", help="CPU_AFFINITY")
+    parser.add_argument("--spool", choices=["on", "off"], default="off", help="Write the queued chunks to a spool")
+    parser.add_argument("--stub-call-time", type=float, default=0.05, help="Stub model time per call in seconds")
+    parser.add_argument("--stub-rtf", type=float, default=0.1, help="Stub model time per second of audio in seconds")
+    parser.add_argument("--sample-interval", type=float, default=0.1, help="Time between queue depth samples in seconds")
+    parser.add_argument("--output", help="Write the results as JSON to this file, or to stdout with -")
+    parser.add_argument("--verbose", action="store_true", help="Show the pipeline's own output")
+    args = parser.parse_args()
+
+    # The pipeline reads its settings when it is created, so the benchmark settings replace the configured ones
+    src.audio_processor.TRANSCRIPTION_WORKERS = args.workers
+    src.audio_processor.TRANSCRIPTION_BATCH_SIZE = args.batch_size
+    src.audio_processor.VAD_ENABLED = args.vad == "on"
+    src.whisper_service.TRANSCRIPTION_WORKERS = args.workers
+    src.cpu_topology.TORCH_INTRA_OP_THREADS = args.intra_op_threads
+    src.cpu_topology.TORCH_INTER_OP_THREADS = args.inter_op_threads
+    src.cpu_topology.CAPTURE_CORES = args.capture_cores
+    src.cpu_topology.CPU_AFFINITY = args.affinity == "on"
+    if args.input:
+        pcm_data, sample_rate = read_wav(args.input)
+    else:
+        pcm_data, sample_rate = make_speech_like_audio(args.sample_rate, args.duration), args.sample_rate
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+        model = load_model(args.model, args.workers, args.stub_call_time, args.stub_rtf)
+        try:
+            results = run_benchmark(
+                pcm_data, sample_rate, model, args.speed, args.sample_interval, args.spool == "on"
+            )
+        finally:
+            if hasattr(model, "shutdown"):
+                model.shutdown()
+    report = {
+        "commit": git_commit(),
+        "settings": {
+            "model": args.model,
+            "input": args.input,
+            "sample_rate": sample_rate,
+            "speed": args.speed,
+            "workers": args.workers,
+            "batch_size": args.batch_size,
+            "vad": args.vad == "on",
+            "spool": args.spool == "on",
+            "frames_per_buffer": FRAMES_PER_BUFFER,
+            "torch_threads": torch_thread_counts(args.workers) if args.model != "stub" else None,
+            "capture_cores": capture_affinity(),
+            "transcription_cores": transcription_affinity(),
+        },
+        **results,
+    }
+
+    print(f"audio: {results['audio_seconds']:.1f} s in {results['chunks']} chunks, model: {args.model}")
+    print(f"wall RTF: {results['wall_rtf']:.3f}, transcription RTF: {results['transcription_rtf']:.3f}")
+    for name in ("latency_ms", "callback_ms"):
+        if results[name] is not None:
+            print(f"{name}: " + ", ".join(f"{key} {value:.2f}" for key, value in results[name].items()))
+    print(f"late callbacks: {results['late_callbacks']} of {len(pcm_data) // (FRAMES_PER_BUFFER * 2)}")
+    print(f"queue depth: max {results['queue_depth']['max']}, mean {results['queue_depth']['mean']:.2f}")
+    print(f"peak RSS: {results['peak_rss_mb']['self']:.0f} MB, children {results['peak_rss_mb']['children']:.0f} MB")
+    if args.output == "-":
+        print(json.dumps(report, indent=4))
+    elif args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
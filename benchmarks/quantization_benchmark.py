@@ -0,0 +1,176 @@
+"""
+Compare the Whisper model quantized to int8 (QUANTIZE_INT8) with the float32 model on the CPU, on a fixed set of
+local audio samples: load time, transcription speed and word error rate. Run from the repository root:
+
+    python -m benchmarks.quantization_benchmark --samples samples/ [--model base] [--language en]
+        [--output results.json]
+
+The samples directory holds audio files in any format ffmpeg decodes, each with an optional reference transcript in a
+text file of the same name with the .txt extension. Keep the same samples between runs, so that results compare.
+
+Reported metrics, per model:
+- load_seconds: time to load the model. For int8, the first load quantizes the model and saves it to a temporary
+  cache, and cached_load_seconds is the time of a later load from that cache.
+- rtf: transcription time divided by the audio duration, after a warm-up transcription of the first sample.
+- wer: word error rate against the reference transcripts, over the samples that have one.
+- wer_vs_fp32 (int8 only): word error rate against the float32 transcripts, over all samples, which measures the
+  accuracy lost to quantization when there are no references.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import whisper
+from whisper.normalizers import BasicTextNormalizer, EnglishTextNormalizer
+
+from benchmarks.pipeline_benchmark import git_commit
+from src.audio_utils import WHISPER_SAMPLE_RATE, decode_audio_file, pcm16_to_float32
+from src.file_transcriber import find_audio_files
+from src.quantization import load_quantized_model
+
+# Size of the blocks in which the samples are decoded (in bytes)
+DECODE_BLOCK_SIZE = 1 << 20
+
+
+def load_samples(samples_dir):
+    """
+    Decode the audio samples and read their reference transcripts.
+    :return: A list of (path, audio, reference) tuples, the reference being None for samples without one.
+    """
+    samples = []
+    for path in find_audio_files([samples_dir]):
+        audio = pcm16_to_float32(b"".join(decode_audio_file(path, DECODE_BLOCK_SIZE)))
+        reference_path = os.path.splitext(path)[0] + ".txt"
+        reference = None
+        if os.path.exists(reference_path):
+            with open(reference_path) as file:
+                reference = file.read()
+        samples.append((path, audio, reference))
+    return samples
+
+
+def transcribe_samples(model, samples, options):
+    """
+    Transcribe every sample, after a warm-up transcription of the first one.
+    :return: A tuple of the transcripts and the total transcription time in seconds.
+    """
+    model.transcribe(samples[0][1], **options)
+    texts = []
+    start_time = time.perf_counter()
+    for _, audio, _ in samples:
+        texts.append(model.transcribe(audio, **options)["text"])
+    return texts, time.perf_counter() - start_time
+
+
+def word_errors(reference, hypothesis):
+    """
+    :return: The minimum number of word substitutions, deletions and insertions turning reference into hypothesis,
+        both lists of words.
+    """
+    previous_row = list(range(len(hypothesis) + 1))
+    for i, reference_word in enumerate(reference, 1):
+        row = [i]
+        for j, hypothesis_word in enumerate(hypothesis, 1):
+            substitution = previous_row[j - 1] + (reference_word != hypothesis_word)
+            row.append(min(substitution, previous_row[j] + 1, row[j - 1] + 1))
+        previous_row = row
+    return previous_row[-1]
+
+
+def word_error_rate(references, hypotheses, normalizer):
+    """
+    :return: The total word errors divided by the total number of reference words, after normalizing the texts, or
+        None if there are no reference words.
+    """
+    errors = 0
+    reference_words = 0
+    for reference, hypothesis in zip(references, hypotheses):
+        reference = normalizer(reference).split()
+        errors += word_errors(reference, normalizer(hypothesis).split())
+        reference_words += len(reference)
+    return errors / reference_words if reference_words > 0 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", required=True, help="Directory of audio samples and their .txt references")
+    parser.add_argument("--model", default="base", help="Size of the Whisper model, such as tiny or base")
+    parser.add_argument("--language", help="Language code of the samples, detected for each sample if not given")
+    parser.add_argument("--output", help="Write the results as JSON to this file, or to stdout with -")
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples)
+    if not samples:
+        parser.error(f"No audio files found in {args.samples}")
+    audio_seconds = sum(len(audio) for _, audio, _ in samples) / WHISPER_SAMPLE_RATE
+    # Greedy decoding without fallback, so that both models decode the same way and the results are reproducible
+    options = {"language": args.language, "fp16": False, "temperature": 0.0}
+    normalizer = EnglishTextNormalizer() if args.language == "en" else BasicTextNormalizer()
+    referenced = [i for i, (_, _, reference) in enumerate(samples) if reference is not None]
+    references = [samples[i][2] for i in referenced]
+
+    start_time = time.perf_counter()
+    model = whisper.load_model(args.model, device="cpu")
+    fp32_load_seconds = time.perf_counter() - start_time
+    fp32_texts, fp32_seconds = transcribe_samples(model, samples, options)
+    del model
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start_time = time.perf_counter()
+        model = load_quantized_model(args.model, cache_dir)
+        int8_load_seconds = time.perf_counter() - start_time
+        del model
+        start_time = time.perf_counter()
+        model = load_quantized_model(args.model, cache_dir)
+        int8_cached_load_seconds = time.perf_counter() - start_time
+    int8_texts, int8_seconds = transcribe_samples(model, samples, options)
+
+    results = {
+        "fp32": {
+            "load_seconds": fp32_load_seconds,
+            "rtf": fp32_seconds / audio_seconds,
+            "wer": word_error_rate(references, [fp32_texts[i] for i in referenced], normalizer),
+        },
+        "int8": {
+            "load_seconds": int8_load_seconds,
+            "cached_load_seconds": int8_cached_load_seconds,
+            "rtf": int8_seconds / audio_seconds,
+            "wer": word_error_rate(references, [int8_texts[i] for i in referenced], normalizer),
+            "wer_vs_fp32": word_error_rate(fp32_texts, int8_texts, normalizer),
+        },
+    }
+    report = {
+        "commit": git_commit(),
+        "settings": {"model": args.model, "samples": args.samples, "language": args.language},
+        "audio_seconds": audio_seconds,
+        **results,
+        "transcripts": [
+            {"path": path, "reference": reference, "fp32": fp32_text, "int8": int8_text}
+            for (path, _, reference), fp32_text, int8_text in zip(samples, fp32_texts, int8_texts)
+        ],
+    }
+
+    print(f"audio: {audio_seconds:.1f} s in {len(samples)} samples, {len(referenced)} with references")
+    for name, model_results in results.items():
+        line = f"{name}: load {model_results['load_seconds']:.2f} s"
+        if "cached_load_seconds" in model_results:
+            line += f" (cached {model_results['cached_load_seconds']:.2f} s)"
+        line += f", RTF {model_results['rtf']:.3f}"
+        if model_results["wer"] is not None:
+            line += f", WER {model_results['wer']:.2%}"
+        if model_results.get("wer_vs_fp32") is not None:
+            line += f", WER vs fp32 {model_results['wer_vs_fp32']:.2%}"
+        print(line)
+    print(f"int8 speedup: {fp32_seconds / int8_seconds:.2f}x")
+    if args.output == "-":
+        print(json.dumps(report, indent=4))
+    elif args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Compare the in-process polyphase resampler with the ffmpeg path it replaced.
+
+The ffmpeg path writes each chunk to a WAV file and decodes it with whisper.audio.load_audio, which starts an ffmpeg
+subprocess that resamples to 16 kHz. Run from the repository root:
+
+    python -m benchmarks.resampler_benchmark [--rates 44100 48000] [--chunks 20]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+from src.audio_utils import WHISPER_SAMPLE_RATE, pcm16_to_float32
+from src.config import CHUNK_DURATION
+from src.resampler import PolyphaseResampler
+
+
+def make_chunks(sample_rate, chunk_count):
+    """
+    Generate chunks of 16-bit PCM noise mixed with a tone, CHUNK_DURATION seconds each.
+    """
+    rng = np.random.default_rng(0)
+    length = int(sample_rate * CHUNK_DURATION)
+    t = np.arange(length) / sample_rate
+    tone = 0.3 * np.sin(2 * np.pi * 440 * t)
+    return [
+        (np.clip(tone + 0.05 * rng.standard_normal(length), -1, 1) * 32767).astype(np.int16).tobytes()
+        for _ in range(chunk_count)
+    ]
+
+
+def benchmark_polyphase(sample_rate, chunks):
+    resampler = PolyphaseResampler(sample_rate, WHISPER_SAMPLE_RATE)
+    start = time.perf_counter()
+    for chunk in chunks:
+        resampler.process(pcm16_to_float32(chunk))
+    return time.perf_counter() - start
+
+
+def benchmark_ffmpeg(sample_rate, chunks):
+    from whisper.audio import load_audio
+
+    start = time.perf_counter()
+    for chunk in chunks:
+        temp_file, temp_file_path = tempfile.mkstemp(suffix=".wav")
+        os.close(temp_file)
+        try:
+            with wave.open(temp_file_path, "wb") as wave_file:
+                wave_file.setnchannels(1)
+                wave_file.setsampwidth(2)
+                wave_file.setframerate(sample_rate)
+                wave_file.writeframes(chunk)
+            load_audio(temp_file_path, sr=WHISPER_SAMPLE_RATE)
+        finally:
+            os.remove(temp_file_path)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rates", type=int, nargs="+", default=[44100, 48000], help="Input sample rates to test")
+    parser.add_argument("--chunks", type=int, default=20, help="Number of chunks per sample rate")
+    args = parser.parse_args()
+
+    print(f"{'rate':>8} {'method':>10} {'ms/chunk':>10} {'x realtime':>11}")
+    for sample_rate in args.rates:
+        chunks = make_chunks(sample_rate, args.chunks)
+        audio_seconds = args.chunks * CHUNK_DURATION
+        for method, benchmark in (("polyphase", benchmark_polyphase), ("ffmpeg", benchmark_ffmpeg)):
+            try:
+                elapsed = benchmark(sample_rate, chunks)
+            except (FileNotFoundError, ImportError, RuntimeError) as e:
+                print(f"{sample_rate:>8} {method:>10} {'skipped':>10}  ({e.__class__.__name__}: {e})")
+                continue
+            print(f"{sample_rate:>8} {method:>10} {elapsed / args.chunks * 1000:>10.2f} {audio_seconds / elapsed:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,132 @@
+import argparse
+import json
+import signal
+import sys
 import warnings
 
-from src.audio_service import AudioService
+from src.cli_interface import CliInterface
+from src.config import CONTROL_SOCKET_PATH, INGEST_HOST, INGEST_PORT, MODEL_SERVER_SOCKET_PATH
+from src.control_server import ControlClient, ControlServer
+from src.file_transcriber import FileTranscriber
+from src.ingest_server import IngestServer
+from src.model_server import ModelServer
 
 
-def main():
+def parse_arguments():
+    """
+    :return: The arguments of the command line, with the subcommand as command, or None to record interactively.
+    """
+    parser = argparse.ArgumentParser(description="Transcribe audio with OpenAI's Whisper model.")
+    subparsers = parser.add_subparsers(dest="command")
+    transcribe_parser = subparsers.add_parser("transcribe", help="transcribe audio files instead of recording")
+    transcribe_parser.add_argument("paths", nargs="+", help="audio files, or directories searched for audio files")
+    subparsers.add_parser("serve", help="keep Whisper models loaded for the next sessions, until interrupted")
+    headless_parser = subparsers.add_parser("headless", help="record without a keyboard, controlled by the control command")
+    headless_parser.add_argument("--record", action="store_true", help="start recording right away")
+    control_parser = subparsers.add_parser("control", help="control a headless session, or get its status")
+    control_parser.add_argument("action", choices=["start", "pause", "flush", "stop", "status"])
+    subparsers.add_parser("ingest", help="transcribe audio streamed by remote clients over TCP, until interrupted")
+    return parser.parse_args()
+
+
+def run_ingest(arguments):
+    """
+    Transcribe audio streamed by remote clients, until interrupted.
+    """
+    try:
+        IngestServer(INGEST_HOST, INGEST_PORT).serve_forever()
+    except KeyboardInterrupt:
+        CliInterface.print_exit()
+
+
+def run_control(arguments):
+    """
+    Send the action of the arguments to the headless session and print its response, exiting with 1 if it failed.
+    """
+    try:
+        status_code, response = ControlClient(CONTROL_SOCKET_PATH).request(arguments.action)
+    except (OSError, ConnectionError) as e:
+        CliInterface.print_error(f"No headless session answered on {CONTROL_SOCKET_PATH}: {e}")
+        sys.exit(1)
+    print(json.dumps(response, indent=4))
+    if status_code != 200:
+        sys.exit(1)
+
+
+def run_serve(arguments):
+    """
+    Keep Whisper models loaded for the next sessions, until interrupted.
+    """
+    try:
+        ModelServer(MODEL_SERVER_SOCKET_PATH).serve_forever()
+    except KeyboardInterrupt:
+        CliInterface.print_exit()
+
+
+def run_transcribe(arguments):
     """
-    Main function to create an instance of the AudioTranscriber and start it.
+    Transcribe the audio files of the arguments, exiting with 1 if any could not be transcribed.
     """
+    if not FileTranscriber().run(arguments.paths):
+        sys.exit(1)
+
+
+def run_headless(arguments):
+    """
+    Record without a keyboard, controlled by the control command, until interrupted or terminated.
+    """
+    # Imported here, as it loads PortAudio, which the other commands do not need
+    from src.audio_service import AudioService
+
+    # Stop cleanly on SIGTERM too, e.g. from a process supervisor, so that the results are output
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    service = AudioService(interactive=False)
+    if arguments.record:
+        service.start_recording()
+    try:
+        ControlServer(service, CONTROL_SOCKET_PATH).serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+
+
+def run_interactive(arguments):
+    """
+    Record, controlled by the keyboard.
+    """
+    from src.audio_service import AudioService
+
     transcriber = AudioService()
     transcriber.run()
 
 
+# Function running each subcommand, None being no subcommand
+COMMANDS = {
+    "ingest": run_ingest,
+    "control": run_control,
+    "serve": run_serve,
+    "transcribe": run_transcribe,
+    "headless": run_headless,
+    None: run_interactive,
+}
+
+
+def main():
+    """
+    Main function to create an instance of the AudioTranscriber and start it, or to transcribe audio files when run
+    with the transcribe command, or to run the model server when run with the serve command.
+    With the headless command, the session is controlled with the control command instead of the keyboard. With the
+    ingest command, audio streamed by remote clients is transcribed instead.
+    """
+    arguments = parse_arguments()
+    COMMANDS[arguments.command](arguments)
+
+
 if __name__ == "__main__":
     # Suppress the FP16 warning
     warnings.filterwarnings("ignore", message="FP16 is not supported on CPU; using FP32 instead")
+    # Suppress the deprecation warnings of torch's quantized tensors and of the storages of the cached quantized models
+    warnings.filterwarnings("ignore", message="torch.quantize_per_tensor, torch.quantize_per_channel")
+    warnings.filterwarnings("ignore", message="TypedStorage is deprecated")
     main()
@@ -2,21 +2,74 @@ from src.audio_utils import (
     choose_audio_device,
     choose_sample_rate,
     find_supported_sample_rates,
+    get_device_infos,
+    preferred_sample_rate,
 )
 from src.cli_interface import CliInterface
+from src.config import DEVICE_CACHE_PATH, USE_CACHED_AUDIO_DEVICE
+from src.device_cache import DeviceCache
 
 
 class AudioDeviceManager:
-    def __init__(self, pyaudio_instance):
+    def __init__(self, pyaudio_instance, interactive=True):
+        """
+        Initialize the AudioDeviceManager, which chooses the audio device and sample rate to record with.
+        :param pyaudio_instance: The PyAudio instance.
+        :param interactive: Whether the user can be prompted for the device and sample rate. If not, the cached last
+            choice is used even if USE_CACHED_AUDIO_DEVICE is not set, or else the system's default input device.
+        """
         self.pyaudio_instance = pyaudio_instance
+        self.interactive = interactive
+        self.device_infos = get_device_infos(pyaudio_instance)
+        self.device_cache = DeviceCache(DEVICE_CACHE_PATH, pyaudio_instance, self.device_infos)
         self.device_index, self.chosen_sample_rate = self.setup_audio_device()
 
     def setup_audio_device(self):
-        device_index = choose_audio_device(self.pyaudio_instance)
-        supported_rates = find_supported_sample_rates(self.pyaudio_instance, device_index)
+        """
+        Choose the audio device and sample rate to record with: the cached last choice if USE_CACHED_AUDIO_DEVICE is set
+        and the device list is unchanged, otherwise the user's choice. The supported sample rates of each device are
+        probed once and cached.
+        Without a user to ask, the default input device is used, at the rate picked by preferred_sample_rate.
+        :return: A tuple of the device index and the sample rate.
+        """
+        default = self.device_cache.get_default() if USE_CACHED_AUDIO_DEVICE or not self.interactive else None
+        if default is not None:
+            device_index, chosen_sample_rate = default
+            CliInterface.print_info(
+                "Using audio device "
+                + CliInterface.colorize(self.device_infos[device_index].get("name"), bold=True)
+                + f" at {chosen_sample_rate} Hz. Set USE_CACHED_AUDIO_DEVICE to False to choose another one."
+            )
+            return device_index, chosen_sample_rate
+
+        if self.interactive:
+            device_index = choose_audio_device(self.pyaudio_instance, self.device_infos)
+        else:
+            try:
+                device_index = self.pyaudio_instance.get_default_input_device_info()["index"]
+            except IOError:
+                CliInterface.print_error("No default input device found, choose one with: python main.py")
+                self.pyaudio_instance.terminate()
+                exit(1)
+        supported_rates = self.device_cache.get_sample_rates(device_index)
+        if supported_rates is None:
+            supported_rates = find_supported_sample_rates(self.pyaudio_instance, device_index)
         if not supported_rates:
             CliInterface.print_error("No supported sample rates found for the device.")
             self.pyaudio_instance.terminate()
             exit(1)
-        chosen_sample_rate = choose_sample_rate(supported_rates)
+        if self.interactive:
+            chosen_sample_rate = choose_sample_rate(supported_rates)
+        else:
+            chosen_sample_rate = preferred_sample_rate(supported_rates)
+            CliInterface.print_info(
+                "Using the default audio device "
+                + CliInterface.colorize(self.device_infos[device_index].get("name"), bold=True)
+                + f" at {chosen_sample_rate} Hz."
+            )
+        self.device_cache.set_sample_rates(device_index, supported_rates)
+        if self.interactive:
+            # Only the user's choices are remembered, not the defaults used in their absence
+            self.device_cache.set_default(device_index, chosen_sample_rate)
+        self.device_cache.save()
         return device_index, chosen_sample_rate
@@ -1,114 +1,377 @@
-import audioop
-import math
 import os
 import tempfile
 import time
 import wave
-from queue import Queue
-from threading import Thread
+from queue import Empty, Full, Queue
+from threading import Lock, Thread, get_ident
 
-import pyaudio
+import numpy as np
 
+from src.audio_ring_buffer import AudioRingBuffer
+from src.audio_utils import WHISPER_SAMPLE_RATE, float32_to_pcm16, pcm16_to_float32
 from src.cli_interface import CliInterface
-from src.config import CHUNK_DURATION
+from src.config import (
+    CHUNK_DURATION,
+    DEBUG_SAVE_AUDIO_FILES,
+    TRANSCRIPTION_BATCH_SIZE,
+    TRANSCRIPTION_WORKERS,
+    VAD_BLOCK_DURATION,
+    VAD_ENABLED,
+    VAD_ENERGY_THRESHOLD_DB,
+    VAD_HANGOVER_DURATION,
+    VAD_MAX_SEGMENT_DURATION,
+    VAD_MAX_ZERO_CROSSING_RATE,
+    VAD_MIN_SEGMENT_DURATION,
+)
+from src.cpu_topology import capture_affinity, pin_current_thread, transcription_affinity
+from src.metrics import ChunkTimings
+from src.resampler import PolyphaseResampler
+from src.vad_segmenter import VadSegmenter
+from src.volume_envelope import VolumeEnvelope
 from src.whisper_service import WhisperService
 
 
+# Overload policies of the processing queue, see QUEUE_OVERLOAD_POLICY
+OVERLOAD_POLICIES = ("block", "drop_oldest", "merge", "downgrade")
+
+# Maximum duration of a chunk made by merging queued chunks (in seconds), the length of Whisper's decoding window
+MAX_MERGED_CHUNK_DURATION = 30
+
+
 class AudioProcessor:
-    def __init__(self, chosen_sample_rate):
-        self.processing_queue = Queue()
-        self.audio_buffer = bytes()
-        self.desired_length = chosen_sample_rate * 2 * CHUNK_DURATION
+    def __init__(self, chosen_sample_rate, whisper_transcription=None, max_queued_chunks=0, overload_policy="block"):
+        """
+        Initialize the AudioProcessor, which splits captured audio into chunks and transcribes them in the background.
+        :param chosen_sample_rate: The sample rate of the audio data.
+        :param whisper_transcription: The WhisperService transcribing the chunks. If not given, one is created.
+        :param max_queued_chunks: The number of chunks that can wait for transcription, or 0 for no limit.
+        :param overload_policy: What to do with a new chunk when max_queued_chunks are waiting, one of
+            OVERLOAD_POLICIES (see QUEUE_OVERLOAD_POLICY). Blocking stalls the audio callback during live capture, but
+            it keeps memory bounded without losing audio when audio is decoded faster than it is transcribed.
+        """
+        if overload_policy not in OVERLOAD_POLICIES:
+            raise ValueError(f"Unknown queue overload policy: {overload_policy}")
+        self.processing_queue = Queue(maxsize=max_queued_chunks)
+        self.overload_policy = overload_policy
+        # With voice activity detection, short blocks are analysed and the segmenter decides where chunks end
+        self.desired_length = int(chosen_sample_rate * 2 * (VAD_BLOCK_DURATION if VAD_ENABLED else CHUNK_DURATION))
+        self.audio_buffer = AudioRingBuffer(self.desired_length)
         self.chosen_sample_rate = chosen_sample_rate
-        self.whisper_transcription = WhisperService()
+        self.resampler = PolyphaseResampler(chosen_sample_rate, WHISPER_SAMPLE_RATE)
+        self.vad_segmenter = (
+            VadSegmenter(
+                WHISPER_SAMPLE_RATE,
+                energy_threshold_db=VAD_ENERGY_THRESHOLD_DB,
+                max_zero_crossing_rate=VAD_MAX_ZERO_CROSSING_RATE,
+                min_segment_duration=VAD_MIN_SEGMENT_DURATION,
+                max_segment_duration=VAD_MAX_SEGMENT_DURATION,
+                hangover_duration=VAD_HANGOVER_DURATION,
+            )
+            if VAD_ENABLED
+            else None
+        )
+        self.next_sequence = 0  # Sequence number of the next queued chunk, used to keep results in capture order
+        self.segment_lock = Lock()  # Held while segmenting, so open_segment sees segments and sequences consistently
+        self.capture_time = time.monotonic()  # When the audio being processed was captured, from time.monotonic
+        self.callback_thread = None  # Identifier of the thread running audio_callback, pinned on its first call
+        self.whisper_transcription = WhisperService() if whisper_transcription is None else whisper_transcription
+        self.metrics = self.whisper_transcription.metrics
+        self.spool = self.whisper_transcription.spool  # AudioSpool keeping the queued chunks until they are transcribed
         self.is_processing = True
-        self.processing_thread = Thread(target=self.process_audio_chunks_queue)
-        self.processing_thread.start()
+        self.start_processing_threads()
 
-    def start_processing_thread(self):
+    def start_processing_threads(self):
         """
-        Start a new thread for processing audio chunks.
+        Start one thread for processing audio chunks per transcription worker.
         """
-        self.processing_thread = Thread(target=self.process_audio_chunks_queue)
-        self.processing_thread.start()
+        self.processing_threads = [
+            Thread(target=self.process_audio_chunks_queue) for _ in range(TRANSCRIPTION_WORKERS)
+        ]
+        for processing_thread in self.processing_threads:
+            processing_thread.start()
 
     def process_audio_chunks_queue(self):
         """
-        Continuously process audio chunks from the queue until the processing is stopped.
+        Process audio chunks from the queue as they arrive, until the None sentinel put by stop_processing is reached.
+        When several chunks are waiting, up to TRANSCRIPTION_BATCH_SIZE of them are transcribed together in one batch.
+        Every item is marked as done only once it has been transcribed, so wait_for_processing can rely on the queue.
+        Runs in each processing thread, so chunks may finish out of order; WhisperService reorders their results.
         """
-        while self.is_processing or not self.processing_queue.empty():
-            if not self.processing_queue.empty():
-                (
-                    audio_chunk,
-                    temp_file_path,
-                    volume_db,
-                ) = self.processing_queue.get()  # Adjusted to include volume_db
-                self.whisper_transcription.transcribe_audio_chunk(temp_file_path, volume_db)  # Pass volume_db to the method
-                CliInterface.print_success(
-                    "Processed audio chunk with volume {:.2f} dB and size {} bytes.".format(volume_db, len(audio_chunk))
-                )
-            else:
-                time.sleep(0.1)  # Sleep briefly to avoid busy waiting
+        pin_current_thread(transcription_affinity())
+        while True:
+            item = self.processing_queue.get()
+            if item is None:
+                self.processing_queue.task_done()
+                return
+            chunks = [item]
+            while len(chunks) < TRANSCRIPTION_BATCH_SIZE:
+                try:
+                    item = self.processing_queue.get_nowait()
+                except Empty:
+                    break
+                if item is None:
+                    # Leave the sentinel for the next get, which may be another processing thread's
+                    self.processing_queue.put(None)
+                    self.processing_queue.task_done()
+                    break
+                chunks.append(item)
+            for _, _, _, _, timings in chunks:
+                self.metrics.chunk_dequeued(timings)
+            if self.overload_policy == "downgrade" and self.whisper_transcription.downgraded:
+                self.restore_model()
+            try:
+                self.transcribe_chunks(chunks)
+            finally:
+                for _ in chunks:
+                    self.processing_queue.task_done()
 
-    def stop_processing(self):
+    def transcribe_chunks(self, chunks):
         """
-        Stop the processing of audio chunks and wait for the processing thread to finish.
+        Transcribe audio chunks taken from the queue, in one batch if there are several of them.
+        :param chunks: A list of (sequence, duration, audio, volume, timings) queue items.
+        """
+        if len(chunks) > 1 and not DEBUG_SAVE_AUDIO_FILES:
+            self.whisper_transcription.transcribe_audio_batch(
+                [(audio, volume, sequence, timings) for sequence, _, audio, volume, timings in chunks]
+            )
+        else:
+            for sequence, _, audio, volume, timings in chunks:
+                self.whisper_transcription.transcribe_audio_chunk(audio, volume, sequence, timings)
+        for _, duration, _, volume, _ in chunks:
+            CliInterface.print_success(
+                "Processed audio chunk with volume {:.2f} dB and duration {:.2f} s.".format(volume.volume_db, duration)
+            )
+
+    def stop_processing(self, output_results=True):
+        """
+        Stop the processing of audio chunks once the queued chunks are processed, and wait for the processing threads
+        to finish.
+        :param output_results: Whether to output the transcription results.
         """
         self.is_processing = False
-        self.processing_thread.join()
-        self.whisper_transcription.output_transcription_results()
+        for _ in self.processing_threads:
+            self.processing_queue.put(None)
+        for processing_thread in self.processing_threads:
+            processing_thread.join()
+        if self.spool is not None:
+            self.spool.close()
+        self.whisper_transcription.shutdown()
+        if output_results:
+            self.whisper_transcription.output_transcription_results()
+
+    def wait_for_processing(self):
+        """
+        Block until every audio chunk queued so far has been transcribed.
+        """
+        self.processing_queue.join()
 
     def is_processing_completed(self):
         """
-        Check if the processing of audio chunks is completed.
+        Check if the processing of audio chunks is completed, without blocking.
 
-        :return: True if the processing queue is empty and there are no active tasks in the transcription service.
+        :return: True if every audio chunk queued so far has been transcribed.
         """
-        return self.processing_queue.empty() and self.whisper_transcription.active_tasks == 0
+        return self.processing_queue.unfinished_tasks == 0
 
-    def process_audio_chunk_volume(self, in_data):
+    def process_audio_chunk_volume(self, samples):
         """
-        Calculate the volume of an audio chunk in decibels.
-        :param in_data: The audio data.
-        :return: The volume of the audio data in decibels.
+        Calculate the volume envelope of an audio chunk, from which the volume of the chunk and of each of its words
+        is calculated in decibels, on the scale of 16-bit sample values.
+        :param samples: The audio samples as a float32 NumPy array sampled at 16 kHz.
+        :return: The VolumeEnvelope of the audio chunk.
         """
-        rms = audioop.rms(in_data, 2)  # Assuming 16-bit audio
-        return 20 * math.log10(rms) if rms > 0 else -float("inf")
+        return VolumeEnvelope(samples, WHISPER_SAMPLE_RATE)
 
     def audio_callback(self, in_data, _frame_count, _time_info, _status):
         """
-        Callback function for the audio stream.
-        Adds the incoming audio data to the buffer and processes it when it reaches the desired length.
+        Callback function for the audio stream, adding the incoming audio data with add_audio.
         :param in_data: The incoming audio data.
         :param _frame_count: The number of frames in the audio data.
         :param _time_info: Information about the timing of the audio data.
         :param _status: The status of the audio stream.
         :return: A tuple containing None and pyaudio.paContinue, indicating that the stream should continue.
         """
-        self.audio_buffer += in_data
-        if len(self.audio_buffer) >= self.desired_length:
-            self.process_and_queue_chunk()
+        # Imported here, so that transcribing files or streams does not need PortAudio; it is already loaded by the
+        # stream calling back
+        import pyaudio
+
+        if self.callback_thread != get_ident():
+            # The audio stream's callback thread is only known once it calls, and keeps the same thread afterwards
+            self.callback_thread = get_ident()
+            pin_current_thread(capture_affinity())
+        self.add_audio(in_data)
         return (None, pyaudio.paContinue)
 
-    def process_and_queue_chunk(self):
+    def add_audio(self, audio_data):
+        """
+        Copy audio data into the ring buffer and process every chunk that reaches the desired length.
+        :param audio_data: The 16-bit PCM audio data, captured or decoded from a file (any bytes-like object).
+        """
+        self.capture_time = time.monotonic()
+        audio_data = memoryview(audio_data).cast("B")
+        overruns = self.audio_buffer.overruns
+        # Write at most one chunk at a time, so a large buffer cannot overrun the ring buffer
+        for start in range(0, len(audio_data), self.desired_length):
+            end = start + self.desired_length
+            self.audio_buffer.write(audio_data[start:end])
+            while (audio_chunk := self.audio_buffer.pop_chunk()) is not None:
+                self.process_and_queue_chunk(audio_chunk)
+        if self.audio_buffer.overruns > overruns:
+            self.metrics.chunks_dropped("overrun", self.audio_buffer.overruns - overruns)
+
+    def process_and_queue_chunk(self, audio_chunk, is_last=False):
+        """
+        Process an audio chunk taken from the buffer and add the resulting audio to the queue for transcription.
+        The chunk is resampled to 16 kHz, then split at pauses in speech if voice activity detection is enabled, in
+        which case silence is dropped and only complete segments are queued. Its data is not referenced after this
+        call, so the ring buffer is free to reuse its memory.
+        :param audio_chunk: The 16-bit PCM audio data of the chunk (a memoryview into the ring buffer).
+        :param is_last: Whether this is the last chunk of the recording, in which case the resampler and the
+            segmenter are flushed.
+        """
+        audio = self.resampler.process(pcm16_to_float32(audio_chunk))
+        if is_last:
+            audio = np.concatenate((audio, self.resampler.flush()))
+        if self.vad_segmenter is None:
+            self.queue_audio(audio)
+            return
+        with self.segment_lock:
+            dropped_segments = self.vad_segmenter.dropped_segments
+            segments = self.vad_segmenter.process(audio)
+            if is_last:
+                segments += self.vad_segmenter.flush()
+            if self.vad_segmenter.dropped_segments > dropped_segments:
+                self.metrics.chunks_dropped("no_speech", self.vad_segmenter.dropped_segments - dropped_segments)
+            for segment in segments:
+                self.queue_audio(segment)
+
+    def open_segment(self):
+        """
+        Copy the audio of the speech segment being captured, which has not been queued yet.
+        :return: A tuple of the sequence number the segment will be queued with and of its audio as a float32 NumPy
+            array, or None if voice activity detection is disabled or no segment is open.
+        """
+        if self.vad_segmenter is None:
+            return None
+        with self.segment_lock:
+            audio = self.vad_segmenter.current_segment()
+            if len(audio) == 0:
+                return None
+            return self.next_sequence, audio.copy()
+
+    def queue_audio(self, audio):
+        """
+        Calculate the volume envelope of 16 kHz audio and add it to the queue for transcription, with the timings that
+        follow it through the pipeline.
+        The audio is queued as a float32 NumPy array, or as the path to a temporary WAV file if DEBUG_SAVE_AUDIO_FILES
+        is set, and appended to the spool if there is one.
+        :param audio: The audio samples as a float32 NumPy array.
         """
-        Process an audio chunk from the buffer, calculate its volume, and add it to the queue for transcription.
+        volume = self.process_audio_chunk_volume(audio)
+        duration = len(audio) / WHISPER_SAMPLE_RATE
+        timings = ChunkTimings(duration, self.capture_time)
+        if self.processing_queue.full() and self.overload_policy in ("merge", "downgrade"):
+            if self.overload_policy == "downgrade" and not self.whisper_transcription.downgraded:
+                self.whisper_transcription.downgraded = True
+                CliInterface.print_warning("Transcription is falling behind, switching to a faster model.")
+            if self.merge_into_queue(audio, timings):
+                return
+        if self.spool is not None:
+            self.spool.append(self.next_sequence, audio)
+        if DEBUG_SAVE_AUDIO_FILES:
+            audio = self.write_audio_chunk_to_file(audio)
+        self.metrics.chunk_queued(timings)
+        item = (self.next_sequence, duration, audio, volume, timings)
+        self.next_sequence += 1
+        # While downgraded, chunks that cannot be merged wait for the faster model to make room rather than being dropped
+        if self.overload_policy in ("block", "downgrade"):
+            self.processing_queue.put(item)
+            return
+        # Only this thread adds chunks, so once the oldest chunk is dropped there is room for the new one
+        try:
+            self.processing_queue.put_nowait(item)
+        except Full:
+            self.drop_oldest_chunk()
+            self.processing_queue.put_nowait(item)
+
+    def restore_model(self):
+        """
+        Switch transcription back from the faster model once the queue is at most half full.
+        """
+        if self.processing_queue.qsize() <= self.processing_queue.maxsize // 2:
+            self.whisper_transcription.downgraded = False
+            CliInterface.print_info("Transcription caught up, switching back to the configured model.")
+
+    def merge_into_queue(self, audio, timings):
+        """
+        Append audio to the newest chunk waiting in the queue, when the merged chunk is short enough to be transcribed
+        in one window. The merged chunk keeps its sequence number, and ends at the new audio's capture time.
+        :param audio: The audio samples as a float32 NumPy array.
+        :param timings: The ChunkTimings of the audio.
+        :return: True if the audio was merged, False if it has to be queued.
+        """
+        with self.processing_queue.mutex:
+            if len(self.processing_queue.queue) == 0:
+                return False
+            sequence, duration, queued_audio, _, queued_timings = self.processing_queue.queue[-1]
+            if isinstance(queued_audio, str) or duration + timings.duration > MAX_MERGED_CHUNK_DURATION:
+                return False
+            if self.spool is not None:
+                self.spool.append(sequence, audio)
+            merged_audio = np.concatenate((queued_audio, audio))
+            queued_timings.duration += timings.duration
+            queued_timings.capture_end = timings.capture_end
+            self.processing_queue.queue[-1] = (
+                sequence,
+                duration + timings.duration,
+                merged_audio,
+                self.process_audio_chunk_volume(merged_audio),
+                queued_timings,
+            )
+        self.metrics.count("chunks_merged")
+        return True
+
+    def drop_oldest_chunk(self):
+        """
+        Drop the oldest chunk waiting in the queue, recording the gap in the transcription results.
+        """
+        try:
+            sequence, duration, audio, _, timings = self.processing_queue.get_nowait()
+        except Empty:
+            return
+        self.metrics.chunk_dequeued(timings)
+        self.metrics.chunks_dropped("overload", 1)
+        if isinstance(audio, str):
+            os.remove(audio)
+        CliInterface.print_warning(f"Transcription is falling behind, dropped {duration:.2f} s of audio.")
+        try:
+            self.whisper_transcription.skip_audio_chunk(duration, sequence, timings)
+        finally:
+            self.processing_queue.task_done()
+
+    def write_audio_chunk_to_file(self, audio):
+        """
+        Write 16 kHz audio to a temporary 16-bit WAV file.
+        :param audio: The audio samples as a float32 NumPy array.
+        :return: The path to the temporary WAV file.
         """
         temp_file, temp_file_path = tempfile.mkstemp(suffix=".wav")
         os.close(temp_file)
         with wave.open(temp_file_path, "wb") as wave_file:
             wave_file.setnchannels(1)
-            wave_file.setsampwidth(pyaudio.get_sample_size(pyaudio.paInt16))
-            wave_file.setframerate(self.chosen_sample_rate)
-            wave_file.writeframes(self.audio_buffer)
-        volume_db = self.process_audio_chunk_volume(self.audio_buffer)
-        self.processing_queue.put((self.audio_buffer, temp_file_path, volume_db))  # Ensure this matches the expected unpacking
-
-        self.audio_buffer = bytes()  # Clear the buffer for the next chunk
+            wave_file.setsampwidth(2)  # 16-bit PCM
+            wave_file.setframerate(WHISPER_SAMPLE_RATE)
+            wave_file.writeframes(float32_to_pcm16(audio).tobytes())
+        return temp_file_path
 
     def finalize_recording(self):
         """
         Process the remaining audio data in the buffer when the recording is finalized.
         """
-        if len(self.audio_buffer) > 0:
-            self.process_and_queue_chunk()
+        self.capture_time = time.monotonic()
+        while (audio_chunk := self.audio_buffer.pop_chunk()) is not None:
+            self.process_and_queue_chunk(audio_chunk)
+        if len(self.audio_buffer) > 0 or self.vad_segmenter is not None:
+            self.process_and_queue_chunk(self.audio_buffer.flush(), is_last=True)
+        else:
+            self.resampler.reset()
@@ -1,5 +1,3 @@
-import time
-
 import pyaudio
 
 from src.cli_interface import CliInterface, start_pause_message
@@ -67,5 +65,4 @@ class AudioRecorder:
             self.audio_processor.finalize_recording()
             self.recording = False
 
-        while not self.audio_processor.is_processing_completed():
-            time.sleep(0.1)  # Adjust sleep time as necessary
+        self.audio_processor.wait_for_processing()
@@ -0,0 +1,88 @@
+class AudioRingBuffer:
+    def __init__(self, chunk_size, chunk_count=2):
+        """
+        Initialize a fixed-capacity ring buffer for PCM audio data, made of chunk_count slots of chunk_size bytes.
+        The whole capacity is allocated up front, so writing audio data never reallocates or copies previous data.
+        :param chunk_size: The size of a chunk in bytes.
+        :param chunk_count: The number of chunks the buffer can hold. A chunk returned by pop_chunk stays valid until
+            chunk_count - 1 more chunks have been written.
+        """
+        if chunk_count < 2:
+            raise ValueError("The ring buffer needs at least two chunks.")
+        self.chunk_size = chunk_size
+        self.chunk_count = chunk_count
+        self.buffer = bytearray(chunk_size * chunk_count)
+        self.view = memoryview(self.buffer)
+        self.write_chunk = 0  # Index of the chunk being filled
+        self.write_offset = 0  # Number of bytes written to the chunk being filled
+        self.read_chunk = 0  # Index of the oldest full chunk
+        self.full_chunks = 0  # Number of full chunks waiting to be read
+        self.overruns = 0  # Number of full chunks overwritten before being read
+
+    def __len__(self):
+        """
+        :return: The number of bytes written to the buffer and not read yet.
+        """
+        return self.full_chunks * self.chunk_size + self.write_offset
+
+    def write(self, data):
+        """
+        Copy audio data into the buffer. A chunk is complete when it holds chunk_size bytes; data that does not fit
+        into the current chunk continues into the next one. If the buffer is full, the oldest unread chunk is dropped.
+        :param data: The audio data (any bytes-like object).
+        """
+        data = memoryview(data).cast("B")
+        while len(data) > 0:
+            start = self.write_chunk * self.chunk_size + self.write_offset
+            count = min(len(data), self.chunk_size - self.write_offset)
+            end = start + count
+            self.view[start:end] = data[:count]
+            self.write_offset += count
+            data = data[count:]
+            if self.write_offset == self.chunk_size:
+                self.commit_chunk()
+
+    def commit_chunk(self):
+        """
+        Mark the chunk being filled as full and move on to the next chunk, dropping the oldest unread chunk if needed.
+        """
+        if self.full_chunks == self.chunk_count - 1:
+            self.read_chunk = (self.read_chunk + 1) % self.chunk_count
+            self.full_chunks -= 1
+            self.overruns += 1
+        self.full_chunks += 1
+        self.write_chunk = (self.write_chunk + 1) % self.chunk_count
+        self.write_offset = 0
+
+    def pop_chunk(self):
+        """
+        Take the oldest full chunk out of the buffer.
+        :return: A memoryview of the chunk's data, or None if there is no full chunk.
+        """
+        if self.full_chunks == 0:
+            return None
+        start = self.read_chunk * self.chunk_size
+        end = start + self.chunk_size
+        self.read_chunk = (self.read_chunk + 1) % self.chunk_count
+        self.full_chunks -= 1
+        return self.view[start:end]
+
+    def flush(self):
+        """
+        Take the partially filled chunk out of the buffer. Full chunks should be popped first.
+        :return: A memoryview of the data written to the chunk being filled. It stays valid until the next write.
+        """
+        start = self.write_chunk * self.chunk_size
+        end = start + self.write_offset
+        chunk = self.view[start:end]
+        self.write_offset = 0
+        return chunk
+
+    def clear(self):
+        """
+        Discard all the data in the buffer.
+        """
+        self.write_chunk = 0
+        self.write_offset = 0
+        self.read_chunk = 0
+        self.full_chunks = 0
@@ -2,24 +2,271 @@ import os
 import sys
 import termios
 import tty
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock, Thread
 
 import pyaudio
-from pynput import keyboard
 
 from src.audio_device_manager import AudioDeviceManager
 from src.audio_processor import AudioProcessor
 from src.audio_recorder import AudioRecorder
+from src.audio_spool import AudioSpool, replay_output_path
+from src.audio_utils import get_device_infos
 from src.cli_interface import CliInterface, start_pause_message
+from src.config import (
+    ADAPTIVE_MODEL_SIZES,
+    AUDIO_SOURCES,
+    DEVICE_CACHE_PATH,
+    MAX_QUEUED_CHUNKS,
+    METRICS_LOG_INTERVAL,
+    METRICS_PORT,
+    MODEL_SIZE,
+    OUTPUT_FILE_PATH,
+    OVERLOAD_MODEL_SIZE,
+    QUEUE_OVERLOAD_POLICY,
+    SPOOL_PATH,
+    STREAMING_PARTIALS,
+    TRANSCRIPTION_WORKERS,
+    VAD_ENABLED,
+)
+from src.device_cache import DeviceCache
+from src.metrics import MetricsReporter, PipelineMetrics
+from src.model_selector import check_model_sizes
+from src.multi_source_recorder import MultiSourceRecorder, resolve_audio_sources, source_output_path
+from src.partial_transcriber import PartialTranscriber
+from src.transcription_scheduler import TranscriptionScheduler
+from src.whisper_service import WhisperService, load_transcription_model
 
 
 class AudioService:
-    def __init__(self):
+    def __init__(self, interactive=True):
+        """
+        Initialize the AudioService, which records audio from a device, or from the AUDIO_SOURCES, and transcribes it.
+        It is controlled from the keyboard by run, or by calling start_recording, pause_recording, flush and stop, e.g.
+        from a ControlServer.
+        :param interactive: Whether a user is at the terminal, to choose the audio device and press keys.
+        """
         CliInterface.print_welcome()
+        self.shared_model_future = None  # Model shared by the AUDIO_SOURCES, which the service shuts down on stop
+        self.replay_threads = []  # Threads replaying the audio left in the spools by an earlier session
+        self.replay_stopped = Event()  # Set to stop the replays on stop
+        if AUDIO_SOURCES:
+            self.setup_audio_sources()
+        else:
+            self.setup_audio_device(interactive)
+        self.metrics_reporter = MetricsReporter(self.metrics, METRICS_PORT, METRICS_LOG_INTERVAL)
+        self.metrics_reporter.start()
+        self.partial_transcriber = None
+        if STREAMING_PARTIALS and not VAD_ENABLED:
+            CliInterface.print_warning("Partial results need voice activity detection, set VAD_ENABLED to show them.")
+        elif STREAMING_PARTIALS and len(self.audio_processors) > 1:
+            CliInterface.print_warning("Partial results are only shown when recording a single audio source.")
+        elif STREAMING_PARTIALS:
+            self.partial_transcriber = PartialTranscriber(self.audio_processors[0])
+            self.partial_transcriber.start()
+        # Held while a command changes the recording state, so that commands from several threads run one at a time
+        self.command_lock = Lock()
+        self.stopped = False
+        if interactive:
+            CliInterface.print_info(start_pause_message)
+
+    def setup_audio_device(self, interactive):
+        """
+        Set up the recording of one audio device, chosen by the user if interactive.
+        :param interactive: Whether a user is at the terminal, to choose the audio device.
+        """
+        if ADAPTIVE_MODEL_SIZES:
+            try:
+                check_model_sizes(ADAPTIVE_MODEL_SIZES, MODEL_SIZE)
+            except ValueError as e:
+                CliInterface.print_error(e)
+                exit(1)
+        # The model loads in the background while the user chooses the audio device and sample rate
+        # The faster model of the "downgrade" overload policy and the adaptive model sizes are loaded in the background too
+        spool = None if SPOOL_PATH is None else AudioSpool(SPOOL_PATH)
+        # The audio left in the spool is replayed while recording, taking turns with the session to use the model
+        scheduler = TranscriptionScheduler(TRANSCRIPTION_WORKERS) if spool is not None and spool.pending_chunks() else None
+        self.whisper_transcription = WhisperService(
+            model_lock=None if scheduler is None else scheduler.source_lock("session"),
+            fallback_model_size=OVERLOAD_MODEL_SIZE if QUEUE_OVERLOAD_POLICY == "downgrade" else None,
+            print_results=STREAMING_PARTIALS,
+            adaptive_model_sizes=ADAPTIVE_MODEL_SIZES,
+            spool=spool,
+        )
+        self.metrics = self.whisper_transcription.metrics
         self.pyaudio_instance = pyaudio.PyAudio()
-        self.audio_device_manager = AudioDeviceManager(self.pyaudio_instance)
-        self.audio_processor = AudioProcessor(self.audio_device_manager.chosen_sample_rate)
+        self.audio_device_manager = AudioDeviceManager(self.pyaudio_instance, interactive)
+        self.audio_processor = AudioProcessor(
+            self.audio_device_manager.chosen_sample_rate,
+            self.whisper_transcription,
+            MAX_QUEUED_CHUNKS,
+            QUEUE_OVERLOAD_POLICY,
+        )
+        self.audio_processors = [self.audio_processor]
         self.audio_recorder = AudioRecorder(self.audio_device_manager, self.pyaudio_instance, self.audio_processor)
-        CliInterface.print_info(start_pause_message)
+        if scheduler is not None:
+            self.start_replay(
+                spool, self.whisper_transcription.model_future, scheduler.source_lock("session"), OUTPUT_FILE_PATH
+            )
+
+    def setup_audio_sources(self):
+        """
+        Set up the recording of the AUDIO_SOURCES at the same time, each with its own AudioProcessor and WhisperService.
+        Rather than a model each, they share one model, which a TranscriptionScheduler hands to them in turn, and their
+        metrics are aggregated.
+        """
+        model_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        self.shared_model_future = model_loader.submit(load_transcription_model)
+        model_loader.shutdown(wait=False)
+        # Worker processes transcribe TRANSCRIPTION_WORKERS chunks at the same time, an in-process model one
+        scheduler = TranscriptionScheduler(TRANSCRIPTION_WORKERS)
+        self.metrics = PipelineMetrics()
+        self.pyaudio_instance = pyaudio.PyAudio()
+        device_infos = get_device_infos(self.pyaudio_instance)
+        device_cache = DeviceCache(DEVICE_CACHE_PATH, self.pyaudio_instance, device_infos)
+        try:
+            sources = resolve_audio_sources(self.pyaudio_instance, device_infos, device_cache, AUDIO_SOURCES)
+        except ValueError as e:
+            CliInterface.print_error(e)
+            self.pyaudio_instance.terminate()
+            exit(1)
+        # The faster model of the "downgrade" policy would be loaded for every source, so the oldest chunks are dropped
+        overload_policy = "drop_oldest" if QUEUE_OVERLOAD_POLICY == "downgrade" else QUEUE_OVERLOAD_POLICY
+        self.audio_processors = []
+        for source in sources:
+            device_name = device_infos[source.device_index].get("name")
+            CliInterface.print_info(
+                "Recording audio source "
+                + CliInterface.colorize(source.label, bold=True)
+                + f" from {device_name}, channel {source.channel}, at {source.sample_rate} Hz."
+            )
+            output_file_path = source_output_path(OUTPUT_FILE_PATH, source.label)
+            spool = None if SPOOL_PATH is None else AudioSpool(source_output_path(SPOOL_PATH, source.label))
+            whisper_transcription = WhisperService(
+                self.shared_model_future,
+                scheduler.source_lock(source.label),
+                output_file_path=output_file_path,
+                metrics=self.metrics,
+                print_results=STREAMING_PARTIALS,
+                source=source.label,
+                spool=spool,
+            )
+            self.audio_processors.append(
+                AudioProcessor(source.sample_rate, whisper_transcription, MAX_QUEUED_CHUNKS, overload_policy)
+            )
+            if spool is not None and spool.pending_chunks():
+                self.start_replay(
+                    spool, self.shared_model_future, scheduler.source_lock(source.label), output_file_path, source.label
+                )
+        self.audio_recorder = MultiSourceRecorder(self.pyaudio_instance, sources, self.audio_processors)
+
+    def start_replay(self, spool, model, model_lock, output_file_path, source=None):
+        """
+        Start transcribing the audio an earlier session left untranscribed in the spool of an audio source, in a
+        background thread, so that recording does not wait for it. The results are written to the source's output file
+        path with a .replay suffix. The replay stops on stop, keeping the audio not replayed yet in the spool.
+        :param spool: The AudioSpool of the source.
+        :param model: The model of the source's WhisperService, or a Future of it.
+        :param model_lock: The model lock of the source's WhisperService, which the replay takes turns with.
+        :param output_file_path: The path of the source's output file.
+        :param source: The label of the source, or None for a single source.
+        """
+        replay_transcription = WhisperService(
+            model,
+            model_lock,
+            output_file_path=replay_output_path(output_file_path),
+            source=source,
+            result_callback=spool.mark_replayed,
+        )
+        replay_thread = Thread(target=spool.replay, args=(replay_transcription, self.replay_stopped), name="spool-replay")
+        replay_thread.start()
+        self.replay_threads.append(replay_thread)
+
+    def toggle_recording(self):
+        """
+        Start recording if paused, or pause it if recording.
+        """
+        with self.command_lock:
+            if not self.stopped:
+                self.audio_recorder.toggle_recording()
+
+    def start_recording(self):
+        """
+        Start recording, if not recording already.
+        :return: False if the service is stopped, True otherwise.
+        """
+        with self.command_lock:
+            if self.stopped:
+                return False
+            self.audio_recorder.start_recording()
+            return True
+
+    def pause_recording(self):
+        """
+        Pause recording, and wait for the audio recorded so far to be transcribed.
+        :return: False if the service is stopped, True otherwise.
+        """
+        with self.command_lock:
+            if self.stopped:
+                return False
+            self.audio_recorder.pause_recording()
+            return True
+
+    def flush(self):
+        """
+        Wait for the audio chunks queued so far to be transcribed, and output the results so far, without ending the
+        session. While recording, the audio not cut into a chunk yet is left for the next chunk.
+        :return: False if the service is stopped, True otherwise.
+        """
+        with self.command_lock:
+            if self.stopped:
+                return False
+            for audio_processor in self.audio_processors:
+                audio_processor.wait_for_processing()
+                audio_processor.whisper_transcription.output_transcription_results(final=False)
+            return True
+
+    def stop(self):
+        """
+        Stop recording and processing, output the transcription results and terminate the PyAudio instance.
+        :return: False if the service was already stopped, True otherwise.
+        """
+        with self.command_lock:
+            if self.stopped:
+                return False
+            if self.audio_recorder.recording:
+                self.audio_recorder.pause_recording(stop=True)
+            if self.partial_transcriber is not None:
+                self.partial_transcriber.stop()
+            # The spools are closed once the replays are done with them
+            self.replay_stopped.set()
+            for replay_thread in self.replay_threads:
+                replay_thread.join()
+            for audio_processor in self.audio_processors:
+                audio_processor.stop_processing()
+            if TRANSCRIPTION_WORKERS > 1 and self.shared_model_future is not None:
+                if self.shared_model_future.exception() is None:
+                    self.shared_model_future.result().shutdown()
+            self.metrics_reporter.stop()
+            self.audio_recorder.pyaudio_instance.terminate()
+            self.stopped = True
+            CliInterface.print_exit()
+            return True
+
+    def status(self):
+        """
+        Get the state of the service without waiting for a command in progress, such as a pause waiting for the
+        recorded audio to be transcribed.
+        :return: A dictionary of the recording state ("recording", "paused" or "stopped"), the number of chunks
+            transcribed, and the pipeline's queue depth, transcription lag and real-time factor.
+        """
+        if self.stopped:
+            state = "stopped"
+        elif self.audio_recorder.recording:
+            state = "recording"
+        else:
+            state = "paused"
+        return {"state": state, "chunks_transcribed": self.metrics.counters["chunks_written"], **self.metrics.gauges()}
 
     def on_key_press(self, key):
         """
@@ -27,21 +274,22 @@ class AudioService:
         If the escape key is pressed, stop recording and processing, terminate the PyAudio instance, and exit the application.
         :param key: The key that was pressed.
         """
+        from pynput import keyboard
+
         if key == keyboard.Key.space:
-            self.audio_recorder.toggle_recording()
+            self.toggle_recording()
         elif key == keyboard.Key.esc:
-            if self.audio_recorder.recording:
-                self.audio_recorder.pause_recording(stop=True)
-            self.audio_processor.stop_processing()
-            self.audio_recorder.pyaudio_instance.terminate()
-            CliInterface.print_exit()
+            self.stop()
             return False
         return None
 
     def run(self):
         """
         Start the main loop of the application. Listens for key press events and handles them with the on_key_press function.
+        pynput is imported here rather than with this module, as it needs a display, which headless sessions may not have.
         """
+        from pynput import keyboard
+
         # Check if sys.stdin is a real file
         if os.isatty(sys.stdin.fileno()):
             # Save the current terminal settings
@@ -0,0 +1,464 @@
+import mmap
+import os
+import re
+import struct
+import time
+from threading import Lock
+
+from src.audio_utils import WHISPER_SAMPLE_RATE, float32_to_pcm16, pcm16_to_float32
+from src.cli_interface import CliInterface
+from src.config import SPOOL_SEGMENT_SIZE, TRANSCRIPT_FSYNC_INTERVAL
+from src.volume_envelope import VolumeEnvelope
+
+# Record of the index of a spool: offset and length in bytes of a chunk's audio in the PCM file, sequence number of
+# the chunk, and transcription status. Records are written in full before they are counted, and a record of zeros
+# ends the index
+INDEX_RECORD = struct.Struct("<QIIB7x")
+STATUS_OFFSET = 16  # Offset of the status in a record
+STATUS_EMPTY = 0
+STATUS_PENDING = 1
+STATUS_TRANSCRIBED = 2
+STATUS_KEPT = 3  # Not transcribed by the session, e.g. dropped by the overload policy, kept for the next replay
+
+# Name of the files of a segment of a spool: <name>.<generation>.<version>.pcm and .idx
+SEGMENT_FILE_NAME = re.compile(r"\.(\d+)\.(\d+)\.(pcm|idx|idx\.tmp)$")
+
+
+def replay_output_path(output_file_path):
+    """
+    :return: The path of the output file of audio replayed from a spool, e.g. "results.replay.json" for "results.json".
+    """
+    base, extension = os.path.splitext(output_file_path)
+    return f"{base}.replay{extension}"
+
+
+def fsync_directory(path):
+    """
+    Make the operating system write the entries of a directory to disk, e.g. after a file is renamed in it.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class MappedFile:
+    def __init__(self, path, extent_size):
+        """
+        Open or create a file mapped into memory, growing by extents that are mapped separately, so that growing it
+        never unmaps memory that another thread may be syncing.
+        :param path: The path of the file.
+        :param extent_size: The size of an extent in bytes, rounded up to the allocation granularity of mmap.
+        """
+        granularity = mmap.ALLOCATIONGRANULARITY
+        self.extent_size = -(-extent_size // granularity) * granularity
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        extent_count = -(-os.fstat(self.fd).st_size // self.extent_size)
+        if extent_count > 0:
+            os.ftruncate(self.fd, extent_count * self.extent_size)
+        self.extents = [self.map_extent(index) for index in range(extent_count)]
+
+    def map_extent(self, index):
+        """
+        :return: The memory map of the extent at index of the file.
+        """
+        return mmap.mmap(self.fd, self.extent_size, offset=index * self.extent_size)
+
+    def write(self, offset, data):
+        """
+        Copy data into the file at offset, growing the file if needed. Not thread-safe.
+        :param offset: The offset in bytes.
+        :param data: The data (any bytes-like object).
+        """
+        data = memoryview(data).cast("B")
+        end = offset + len(data)
+        if end > len(self.extents) * self.extent_size:
+            extent_count = -(-end // self.extent_size)
+            os.ftruncate(self.fd, extent_count * self.extent_size)
+            self.extents += [self.map_extent(index) for index in range(len(self.extents), extent_count)]
+        position = offset
+        while position < end:
+            extent, extent_offset = divmod(position, self.extent_size)
+            extent_end = min(self.extent_size, extent_offset + end - position)
+            data_start = position - offset
+            data_end = data_start + extent_end - extent_offset
+            self.extents[extent][extent_offset:extent_end] = data[data_start:data_end]
+            position += extent_end - extent_offset
+
+    def read(self, offset, length):
+        """
+        :return: The length bytes of the file at offset, as bytes.
+        """
+        parts = []
+        position = offset
+        end = offset + length
+        while position < end:
+            extent, extent_offset = divmod(position, self.extent_size)
+            extent_end = min(self.extent_size, extent_offset + end - position)
+            parts.append(self.extents[extent][extent_offset:extent_end])
+            position += extent_end - extent_offset
+        return b"".join(parts)
+
+    def size(self):
+        """
+        :return: The size of the file in bytes, a multiple of the extent size.
+        """
+        return len(self.extents) * self.extent_size
+
+    def sync(self):
+        """
+        Make the operating system write the file to disk. Can be called while another thread writes to the file.
+        """
+        for extent in list(self.extents):
+            extent.flush()
+
+    def close(self):
+        """
+        Unmap and close the file.
+        """
+        for extent in self.extents:
+            extent.close()
+        self.extents = []
+        os.close(self.fd)
+
+
+class SpoolSegment:
+    def __init__(self, path, generation, version, extent_size):
+        """
+        Open or create a segment of a spool: the audio of its chunks in <path>.<generation>.<version>.pcm, and their
+        index in .idx. The files of a segment are only appended to; its kept chunks are copied to the next version of
+        the segment instead of being moved (see AudioSpool.retire).
+        :param path: The path of the spool, without extension.
+        :param generation: The number of the segment in capture order.
+        :param version: The number of times the segment was rewritten.
+        :param extent_size: The size by which the PCM file grows in bytes.
+        """
+        self.path = path
+        self.generation = generation
+        self.version = version
+        self.pcm_path = self.file_path(version, ".pcm")
+        self.index_path = self.file_path(version, ".idx")
+        self.pcm_file = MappedFile(self.pcm_path, extent_size)
+        self.index_file = MappedFile(self.index_path, INDEX_RECORD.size * 1024)
+        self.records = []  # (offset, length, sequence, status) of each chunk in the index
+        max_records = self.index_file.size() // INDEX_RECORD.size
+        while len(self.records) < max_records:
+            record = INDEX_RECORD.unpack(self.index_file.read(len(self.records) * INDEX_RECORD.size, INDEX_RECORD.size))
+            if record[3] == STATUS_EMPTY:
+                break
+            self.records.append(record)
+        self.data_end = max((offset + length for offset, length, _, _ in self.records), default=0)
+        # Number of chunks waiting for their result, including those left by an earlier session until they are replayed
+        self.pending_count = sum(status != STATUS_TRANSCRIBED for _, _, _, status in self.records)
+
+    def file_path(self, version, extension):
+        """
+        :return: The path of a file of a version of the segment.
+        """
+        return f"{self.path}.{self.generation}.{version}{extension}"
+
+    def append(self, sequence, pcm_data):
+        """
+        Append the audio of a chunk, its audio before its record. Called with the spool's lock held.
+        :param sequence: The sequence number stored in the record.
+        :param pcm_data: The audio as a 16-bit PCM NumPy array.
+        :return: The index of the record.
+        """
+        self.pcm_file.write(self.data_end, pcm_data)
+        record_index = len(self.records)
+        record = (self.data_end, pcm_data.nbytes, sequence, STATUS_PENDING)
+        self.index_file.write(record_index * INDEX_RECORD.size, INDEX_RECORD.pack(*record))
+        self.records.append(record)
+        self.data_end += pcm_data.nbytes
+        self.pending_count += 1
+        return record_index
+
+    def set_status(self, record_index, status):
+        """
+        Set the status of a chunk waiting for its result. Called with the spool's lock held.
+        :param record_index: The index of the record of the chunk.
+        :param status: STATUS_TRANSCRIBED or STATUS_KEPT.
+        """
+        offset, length, sequence, _ = self.records[record_index]
+        self.records[record_index] = (offset, length, sequence, status)
+        self.index_file.write(record_index * INDEX_RECORD.size + STATUS_OFFSET, bytes([status]))
+        self.pending_count -= 1
+
+    def read(self, record_index):
+        """
+        :return: The audio of a record as 16-bit PCM bytes.
+        """
+        return self.pcm_file.read(*self.records[record_index][:2])
+
+    def rewrite(self):
+        """
+        Write the chunks left untranscribed to the next version of the segment, and remove this version. The index of
+        the next version is synced before it is renamed into place, so that a crash leaves one complete version.
+        """
+        records = []
+        with open(self.file_path(self.version + 1, ".pcm"), "wb") as pcm_file:
+            for record_index, (_, length, sequence, status) in enumerate(self.records):
+                if status != STATUS_TRANSCRIBED:
+                    records.append((pcm_file.tell(), length, sequence, status))
+                    pcm_file.write(self.read(record_index))
+            pcm_file.flush()
+            os.fsync(pcm_file.fileno())
+        temporary_index_path = self.file_path(self.version + 1, ".idx.tmp")
+        with open(temporary_index_path, "wb") as index_file:
+            index_file.write(b"".join(INDEX_RECORD.pack(*record) for record in records))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(temporary_index_path, self.file_path(self.version + 1, ".idx"))
+        fsync_directory(os.path.dirname(self.path) or ".")
+        self.remove()
+
+    def sync(self):
+        """
+        Make the operating system write the segment to disk, the audio before the index.
+        """
+        self.pcm_file.sync()
+        self.index_file.sync()
+
+    def close(self):
+        """
+        Unmap and close the files of the segment.
+        """
+        self.pcm_file.close()
+        self.index_file.close()
+
+    def remove(self):
+        """
+        Close and remove the files of the segment.
+        """
+        self.close()
+        os.remove(self.pcm_path)
+        os.remove(self.index_path)
+
+
+class AudioSpool:
+    def __init__(self, path, segment_size=SPOOL_SEGMENT_SIZE, sync_interval=TRANSCRIPT_FSYNC_INTERVAL):
+        """
+        Open the spool at path, keeping the audio of the chunks queued for transcription on disk until their results are
+        written, so that a crash of the application or a chunk that cannot be transcribed does not lose audio.
+        The audio is appended as 16 kHz 16-bit PCM to segments of segment_size bytes, each with an index of its chunks,
+        both mapped into memory: appending a chunk on the capture path copies it into memory shared with the operating
+        system, which survives a crash of the application, without a system call until the spool moves on to a new
+        segment. The files are synced to disk every sync_interval seconds from the threads marking the chunks.
+        The files are only appended to. Once the spool has moved on from a segment and none of its chunks is waiting for
+        its result, the segment is removed, or, if it holds chunks marked as kept, rewritten with only those chunks, by
+        the thread marking its last chunk. Chunks left untranscribed by an earlier session are kept, to be transcribed
+        by replay.
+        :param path: The path of the spool, without extension. "~" is expanded.
+        :param segment_size: The size of the audio file of a segment in bytes.
+        :param sync_interval: The minimum time between syncs in seconds, or None to leave syncing to the operating
+            system.
+        """
+        self.path = os.path.expanduser(path)
+        self.directory = os.path.dirname(self.path) or "."
+        os.makedirs(self.directory, exist_ok=True)
+        self.segment_size = segment_size
+        self.sync_interval = sync_interval
+        self.last_sync_time = time.monotonic()
+        self.lock = Lock()  # Held while the spool is written, by the capture thread and the transcription threads
+        self.files_lock = Lock()  # Held while the files of segments are synced or closed
+        self.segments = self.open_segments()  # Segments of the spool in capture order, the last one being appended to
+        # Chunks are stored with sequence_base added to their sequence numbers, so that the chunks of a session are not
+        # grouped with chunks an earlier session left untranscribed
+        sequences = [record[2] for segment in self.segments for record in segment.records]
+        self.sequence_base = max(sequences) + 1 if sequences else 0
+        self.earlier_segments = list(self.segments)  # Segments left by an earlier session, to be replayed
+        self.next_generation = self.segments[-1].generation + 1 if self.segments else 0
+        self.segment = self.new_segment()
+        self.chunk_records = {}  # (segment, record index) of the records of each chunk not marked yet, by sequence
+        self.replay_records = {}  # (segment, record index) of the records of each chunk being replayed, by sequence
+
+    def open_segments(self):
+        """
+        Open the segments left by an earlier session, the latest version of each, removing the other versions and
+        the files of versions that were not completely written.
+        :return: The list of the segments holding chunks, in capture order.
+        """
+        name = os.path.basename(self.path)
+        versions = {}  # Versions of each segment with an index, by generation
+        files = []
+        for file_name in os.listdir(self.directory):
+            match = SEGMENT_FILE_NAME.search(file_name)
+            if file_name.startswith(name) and match and match.start() == len(name):
+                generation, version, extension = int(match[1]), int(match[2]), match[3]
+                files.append((os.path.join(self.directory, file_name), generation, version))
+                if extension == "idx":
+                    versions[generation] = max(version, versions.get(generation, version))
+        for file_path, generation, version in files:
+            if versions.get(generation) != version:
+                os.remove(file_path)
+        segments = []
+        for generation, version in sorted(versions.items()):
+            segment = SpoolSegment(self.path, generation, version, self.segment_size)
+            if segment.records:
+                segments.append(segment)
+            else:
+                segment.remove()
+        return segments
+
+    def new_segment(self):
+        """
+        Create the segment the next chunks are appended to. Called with lock held, or before the spool is used.
+        :return: The SpoolSegment.
+        """
+        segment = SpoolSegment(self.path, self.next_generation, 0, self.segment_size)
+        self.next_generation += 1
+        self.segments.append(segment)
+        return segment
+
+    def append(self, sequence, audio):
+        """
+        Append the audio of a chunk queued for transcription. Audio appended with the sequence number of a chunk already
+        appended, e.g. when chunks are merged, is added to that chunk.
+        :param sequence: The sequence number of the chunk.
+        :param audio: The audio samples as a float32 NumPy array sampled at 16 kHz.
+        """
+        pcm_data = float32_to_pcm16(audio)
+        with self.lock:
+            if self.segment.data_end > 0 and self.segment.data_end + pcm_data.nbytes > self.segment_size:
+                self.segment = self.new_segment()
+            record_index = self.segment.append(self.sequence_base + sequence, pcm_data)
+            self.chunk_records.setdefault(sequence, []).append((self.segment, record_index))
+
+    def mark_transcribed(self, sequence):
+        """
+        Mark a chunk as transcribed, once its result is written, so that it is not replayed.
+        :param sequence: The sequence number the chunk was appended with. Unknown sequence numbers are ignored.
+        """
+        self.mark(self.chunk_records, sequence, STATUS_TRANSCRIBED)
+
+    def mark_kept(self, sequence):
+        """
+        Mark a chunk as kept for the next replay, once it is known that the session will not transcribe it, e.g.
+        because it was dropped by the overload policy or could not be transcribed, so that its segment can be retired.
+        :param sequence: The sequence number the chunk was appended with. Unknown sequence numbers are ignored.
+        """
+        self.mark(self.chunk_records, sequence, STATUS_KEPT)
+
+    def mark_replayed(self, result):
+        """
+        Mark a replayed chunk as transcribed. Passed as the result_callback of the WhisperService replaying the spool.
+        :param result: The result of the chunk, with the sequence number it was replayed with.
+        """
+        self.mark(self.replay_records, result["sequence"], STATUS_TRANSCRIBED)
+
+    def mark(self, chunk_records, sequence, status):
+        """
+        Set the status of the records of a chunk, and retire the segments no longer appended to in which no chunk is
+        waiting for its result. The segments are retired after the lock is released, so as not to hold up append.
+        :param chunk_records: The (segment, record index) of the records of each chunk not marked yet, by sequence.
+        :param sequence: The sequence number of the chunk in chunk_records.
+        :param status: STATUS_TRANSCRIBED or STATUS_KEPT.
+        """
+        with self.lock:
+            for segment, record_index in chunk_records.pop(sequence, []):
+                segment.set_status(record_index, status)
+            retired = [segment for segment in self.segments if segment is not self.segment and segment.pending_count == 0]
+            for segment in retired:
+                self.segments.remove(segment)
+        for segment in retired:
+            self.retire(segment)
+        if self.sync_interval is not None and time.monotonic() - self.last_sync_time >= self.sync_interval:
+            self.sync()
+
+    def retire(self, segment):
+        """
+        Remove a segment in which no chunk is waiting for its result if every chunk is transcribed, rewrite it with
+        only its kept chunks if some are transcribed, and close it otherwise. Called without lock held, once the
+        segment is removed from segments.
+        :param segment: The SpoolSegment.
+        """
+        kept_count = sum(status != STATUS_TRANSCRIBED for _, _, _, status in segment.records)
+        with self.files_lock:
+            if kept_count == 0:
+                segment.remove()
+            elif kept_count < len(segment.records):
+                segment.rewrite()
+            else:
+                segment.sync()
+                segment.close()
+
+    def pending_chunks(self):
+        """
+        :return: A list of the (segment, record index) of the records of each chunk an earlier session left
+            untranscribed, in capture order.
+        """
+        chunks = []
+        previous_sequence = None
+        with self.lock:
+            for segment in self.earlier_segments:
+                for record_index, (_, _, sequence, status) in enumerate(segment.records):
+                    if status == STATUS_TRANSCRIBED:
+                        continue
+                    if sequence == previous_sequence:
+                        chunks[-1].append((segment, record_index))
+                    else:
+                        chunks.append([(segment, record_index)])
+                    previous_sequence = sequence
+        return chunks
+
+    def replay(self, whisper_transcription, stopped=None):
+        """
+        Transcribe the chunks left untranscribed by an earlier session, e.g. because it crashed, in capture order, and
+        output their results. Can run while the session appends its own chunks, to other segments. Chunks that cannot
+        be transcribed again, or that are not replayed before stopped is set, are kept for the next replay.
+        :param whisper_transcription: The WhisperService transcribing the chunks, with mark_replayed as its
+            result_callback and its own output file.
+        :param stopped: An Event set to stop replaying after the chunk being transcribed, or None.
+        :return: The number of chunks replayed.
+        """
+        chunks = self.pending_chunks()
+        with self.lock:
+            # Replayed chunks are numbered from 0, like the chunks of a session
+            self.replay_records = dict(enumerate(chunks))
+            self.earlier_segments = []
+        if not chunks:
+            return 0
+        length = sum(segment.records[index][1] for records in chunks for segment, index in records)
+        duration = length / 2 / WHISPER_SAMPLE_RATE
+        CliInterface.print_info(f"Transcribing {duration:.2f} s of audio left untranscribed by an earlier session...")
+        replayed_count = 0
+        for sequence, records in enumerate(chunks):
+            if stopped is not None and stopped.is_set():
+                break
+            audio = pcm16_to_float32(b"".join(segment.read(index) for segment, index in records))
+            whisper_transcription.transcribe_audio_chunk(audio, VolumeEnvelope(audio, WHISPER_SAMPLE_RATE), sequence)
+            replayed_count += 1
+        whisper_transcription.output_transcription_results()
+        if self.replay_records:
+            CliInterface.print_warning(
+                f"{len(self.replay_records)} audio chunks could not be transcribed, they are kept in the spool."
+            )
+        for sequence in list(self.replay_records):
+            self.mark(self.replay_records, sequence, STATUS_KEPT)
+        return replayed_count
+
+    def sync(self):
+        """
+        Make the operating system write the spool to disk, the audio before the index.
+        """
+        self.last_sync_time = time.monotonic()
+        with self.files_lock:
+            for segment in list(self.segments):
+                segment.sync()
+
+    def close(self):
+        """
+        Sync and close the spool, once the session's chunks are transcribed. The segments in which no chunk is waiting
+        for its result are retired, and the others are kept for the next session's replay.
+        """
+        with self.lock:
+            segments = self.segments
+            self.segments = []
+        for segment in segments:
+            if segment.pending_count == 0:
+                self.retire(segment)
+            else:
+                with self.files_lock:
+                    segment.sync()
+                    segment.close()
@@ -1,28 +1,42 @@
-import pyaudio
+import subprocess
+
+import numpy as np
 
 from src.cli_interface import CliInterface
 from src.config import SAMPLE_RATES
 
+# Sample rate expected by the Whisper model (in Hz)
+WHISPER_SAMPLE_RATE = 16000
+
+
+def get_device_infos(pyaudio_instance):
+    """
+    Queries the information of every audio device, once per device.
+    :param pyaudio_instance: An instance of the PyAudio class.
+    :return: A list of device information dictionaries, by device index.
+    """
+    return [pyaudio_instance.get_device_info_by_index(i) for i in range(pyaudio_instance.get_device_count())]
+
 
-def get_audio_devices(pyaudio_instance):
+def get_audio_devices(pyaudio_instance, device_infos=None):
     """
     Lists the available audio devices.
     :param pyaudio_instance: An instance of the PyAudio class.
+    :param device_infos: The information of every audio device, if already queried with get_device_infos.
     """
-    return [
-        (i, pyaudio_instance.get_device_info_by_index(i).get("name"))
-        for i in range(pyaudio_instance.get_device_count())
-        if pyaudio_instance.get_device_info_by_index(i).get("maxInputChannels") > 0
-    ]
+    if device_infos is None:
+        device_infos = get_device_infos(pyaudio_instance)
+    return [(i, info.get("name")) for i, info in enumerate(device_infos) if info.get("maxInputChannels") > 0]
 
 
-def choose_audio_device(pyaudio_instance):
+def choose_audio_device(pyaudio_instance, device_infos=None):
     """
     Prompts the user to choose an audio device from the list of available devices.
     :param pyaudio_instance: An instance of the PyAudio class.
+    :param device_infos: The information of every audio device, if already queried with get_device_infos.
     :return: The index of the chosen audio device.
     """
-    devices = get_audio_devices(pyaudio_instance)
+    devices = get_audio_devices(pyaudio_instance, device_infos)
     CliInterface.print_info("Available audio devices:\n")
     for i, name in enumerate(devices, start=1):
         print(CliInterface.colorize(f"{i})", bold=True) + f" {name[1]}")
@@ -33,32 +47,60 @@ def choose_audio_device(pyaudio_instance):
 def find_supported_sample_rates(pyaudio_instance, device_index):
     """
     Finds the sample rates supported by the chosen audio device.
+    Each rate is checked with is_format_supported, which queries the host API without opening the device. A test
+    stream is only opened if the host API cannot answer the query, as opening streams is slow and makes some USB and
+    Bluetooth devices glitch.
     :param pyaudio_instance: An instance of the PyAudio class.
     :param device_index: The index of the chosen audio device.
     :return: A list of supported sample rates.
     """
+    # Imported here, so that the modules transcribing files or streams do not need PortAudio
+    import pyaudio
+
     sample_rates = SAMPLE_RATES
     supported_rates = []
     for rate in sample_rates:
         try:
-            stream = pyaudio_instance.open(
-                format=pyaudio.paInt16,
-                channels=1,
-                rate=rate,
-                input=True,
-                input_device_index=device_index,
-                frames_per_buffer=4096,
+            pyaudio_instance.is_format_supported(
+                rate, input_device=device_index, input_channels=1, input_format=pyaudio.paInt16
             )
-            stream.close()
             supported_rates.append(rate)
+        except ValueError:
+            continue  # The host API reported the format as unsupported
         except Exception:
-            continue
+            if is_sample_rate_openable(pyaudio_instance, device_index, rate):
+                supported_rates.append(rate)
     CliInterface.print_info("Supported sample rates for the device:")
     for rate in supported_rates:
         CliInterface.print_success(f"Supported: {rate} Hz")
     return supported_rates
 
 
+def is_sample_rate_openable(pyaudio_instance, device_index, rate):
+    """
+    Checks a sample rate by opening and closing a test input stream.
+    :param pyaudio_instance: An instance of the PyAudio class.
+    :param device_index: The index of the audio device.
+    :param rate: The sample rate to check.
+    :return: True if the stream could be opened.
+    """
+    import pyaudio
+
+    try:
+        stream = pyaudio_instance.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=rate,
+            input=True,
+            input_device_index=device_index,
+            frames_per_buffer=4096,
+        )
+        stream.close()
+        return True
+    except Exception:
+        return False
+
+
 def choose_sample_rate(supported_rates):
     """
     Prompts the user to choose a sample rate from the list of supported rates.
@@ -78,3 +120,58 @@ def choose_sample_rate(supported_rates):
     except ValueError as e:
         CliInterface.print_error(e)
         return choose_sample_rate(supported_rates)
+
+
+def preferred_sample_rate(supported_rates):
+    """
+    Pick a sample rate without asking the user: Whisper's sample rate if supported, as it needs no resampling, or
+    else the highest supported rate.
+    :param supported_rates: A non-empty list of supported sample rates.
+    :return: The sample rate.
+    """
+    return WHISPER_SAMPLE_RATE if WHISPER_SAMPLE_RATE in supported_rates else max(supported_rates)
+
+
+def pcm16_to_float32(pcm_data):
+    """
+    Converts 16-bit PCM audio data to a float32 NumPy array.
+    The PCM data is read in place and only the float32 output array is allocated.
+    :param pcm_data: The 16-bit PCM audio data (any bytes-like object).
+    :return: A float32 NumPy array with values in [-1.0, 1.0).
+    """
+    return np.multiply(np.frombuffer(pcm_data, dtype=np.int16), 1 / 32768.0, dtype=np.float32)
+
+
+def float32_to_pcm16(audio):
+    """
+    Converts float32 audio samples to 16-bit PCM, clipping samples outside [-1.0, 1.0).
+    :param audio: The audio samples as a float32 NumPy array.
+    :return: An int16 NumPy array.
+    """
+    return np.clip(audio * 32768, -32768, 32767).astype(np.int16)
+
+
+def decode_audio_file(path, block_size):
+    """
+    Decodes an audio file with ffmpeg, streaming it as 16 kHz mono 16-bit PCM audio data.
+    Only one block is held in memory at a time, so files of any length can be decoded.
+    :param path: The path to the audio file, in any format supported by ffmpeg.
+    :param block_size: The size of the blocks of audio data in bytes.
+    :return: A generator of blocks of audio data. Every block but the last holds block_size bytes.
+    """
+    command = ["ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0", "-i", path]
+    command += ["-f", "s16le", "-ac", "1", "-acodec", "pcm_s16le", "-ar", str(WHISPER_SAMPLE_RATE), "-"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        while data := process.stdout.read(block_size):
+            yield data
+        error = process.stderr.read().decode(errors="replace").strip()
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode {path}: {error}")
+    finally:
+        # Stop ffmpeg if the generator is closed before the end of the file
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        process.stderr.close()
@@ -0,0 +1,193 @@
+import importlib
+import inspect
+from contextlib import contextmanager
+from threading import Lock
+
+import torch
+import whisper
+from whisper.audio import N_FRAMES, N_SAMPLES, log_mel_spectrogram, pad_or_trim
+from whisper.decoding import DecodingOptions
+from whisper.decoding import decode as decode_function
+
+# Module of whisper.transcribe, whose name the whisper package rebinds to the function
+# precomputed relies on how transcribe calls into the model, as of the openai-whisper commit pinned in requirements.txt:
+# it computes the mel spectrogram with log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES), looked up in
+# this module, and runs the model through model.encoder.forward and model.decode. Check them when upgrading whisper
+transcribe_module = importlib.import_module("whisper.transcribe")
+
+# Held by precomputed, as it replaces a function of transcribe_module shared by every model in the process
+precomputed_lock = Lock()
+
+# Keyword arguments of whisper.transcribe that are not passed on to DecodingOptions
+TRANSCRIBE_PARAMETERS = {
+    name
+    for name, parameter in inspect.signature(whisper.transcribe).parameters.items()
+    if parameter.kind == inspect.Parameter.KEYWORD_ONLY
+}
+
+
+def transcribe_batch(model, audios, **options):
+    """
+    Transcribe several audio chunks with one encoder forward pass and one batched greedy decode.
+    The mel spectrogram of each chunk is computed once, the encoder output and the greedy decode of each chunk's first
+    30-second window are computed for the whole batch, then every chunk goes through model.transcribe with those
+    results precomputed. The mel spectrograms are computed per chunk rather than stacked, as each is normalized by its
+    own maximum. transcribe only gets a precomputed result when it asks for exactly the same computation, and runs
+    everything else itself (temperature fallback, later windows, word timestamps), so each result is the same as when
+    the chunk is transcribed alone.
+    The caller must have the model to itself for the whole call, e.g. by holding WhisperService's model_lock, see
+    precomputed.
+    :param model: The Whisper model.
+    :param audios: The audio chunks as float32 NumPy arrays sampled at 16 kHz.
+    :param options: The keyword arguments passed to model.transcribe for every chunk.
+    :return: The list of transcription results, one per audio chunk.
+    """
+    # Mirror how transcribe picks the data type and computes the mel spectrogram of the first window
+    dtype = torch.float16 if options.get("fp16", True) else torch.float32
+    if model.device == torch.device("cpu"):
+        dtype = torch.float32
+    mels = [log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES) for audio in audios]
+    windows = [pad_or_trim(first_window(mel), N_FRAMES).to(model.device).to(dtype) for mel in mels]
+    language = options.get("language")
+    if language is None and not model.is_multilingual:
+        language = "en"
+    # Language detection runs on the padded spectrogram rather than the first window, so encode both when needed
+    detection_mels = (
+        [pad_or_trim(mel, N_FRAMES).to(model.device).to(dtype) for mel in mels] if language is None else []
+    )
+
+    with torch.no_grad():
+        window_features, detection_features = model.encoder(torch.stack(windows + detection_mels)).split(
+            [len(windows), len(detection_mels)]
+        )
+        if language is None:
+            _, probabilities = model.detect_language(detection_features)
+            languages = [max(chunk_probabilities, key=chunk_probabilities.get) for chunk_probabilities in probabilities]
+        else:
+            languages = [language] * len(audios)
+        decoded = decode_first_windows(model, windows, window_features, languages, dtype, options)
+
+    encoded = list(zip(windows, window_features)) + list(zip(detection_mels, detection_features))
+    with precomputed(model, encoded, decoded, list(zip(audios, mels))):
+        return [model.transcribe(audio, **options) for audio in audios]
+
+
+def first_window(mel):
+    """
+    :return: The frames of the first 30-second window of a mel spectrogram padded with 30 seconds of silence.
+    """
+    content_frames = mel.shape[-1] - N_FRAMES
+    window_frames = min(N_FRAMES, content_frames)
+    return mel[:, :window_frames]
+
+
+def decode_first_windows(model, windows, window_features, languages, dtype, options):
+    """
+    Decode the first window of every chunk, batching together the chunks that share a language.
+    The decoding options are built the same way transcribe builds them for its first window at the first temperature.
+    :return: A list of (window, options, result) tuples, for the chunks whose first decode could be precomputed.
+    """
+    temperature = options.get("temperature", (0.0, 0.2, 0.4, 0.6, 0.8, 1.0))
+    first_temperature = temperature if isinstance(temperature, (int, float)) else temperature[0]
+    # Sampling is not reproducible, and a prompt or clips change the first window's decode, so only greedy decoding
+    # or beam search of the whole chunk without a prompt is precomputed
+    if first_temperature > 0 or options.get("initial_prompt") is not None or options.get("clip_timestamps", "0") != "0":
+        return []
+    decode_options = {name: value for name, value in options.items() if name not in TRANSCRIBE_PARAMETERS}
+    decode_options.pop("best_of", None)
+    if dtype == torch.float32:
+        decode_options["fp16"] = False
+    decode_options["prompt"] = []
+
+    decoded = []
+    for language in dict.fromkeys(languages):
+        indices = [i for i, chunk_language in enumerate(languages) if chunk_language == language]
+        language_options = DecodingOptions(**{**decode_options, "language": language}, temperature=first_temperature)
+        results = model.decode(window_features[indices], language_options)
+        decoded += [(windows[i], language_options, result) for i, result in zip(indices, results)]
+    return decoded
+
+
+def cached_encoder_forward(encoder_forward, encoded):
+    """
+    :return: The encoder forward method returning the precomputed outputs of encoded, see precomputed.
+    """
+
+    def forward(x):
+        if x.shape[0] == 1:
+            for mel, features in encoded:
+                if x.shape[1:] == mel.shape and torch.equal(x[0], mel):
+                    return features.unsqueeze(0)
+        return encoder_forward(x)
+
+    return forward
+
+
+def cached_decode(model, decoded):
+    """
+    :return: The decode method of model returning the precomputed results of decoded once each, see precomputed.
+    """
+
+    def decode(mel, options=DecodingOptions(), **kwargs):
+        for i, (window, window_options, result) in enumerate(decoded):
+            if options == window_options and mel.shape == window.shape and torch.equal(mel, window):
+                del decoded[i]
+                return result
+        return decode_function(model, mel, options, **kwargs)
+
+    return decode
+
+
+def cached_log_mel_spectrogram(log_mel_spectrogram, model_n_mels, mels):
+    """
+    :return: The log_mel_spectrogram function returning the precomputed mel spectrograms of mels, see precomputed.
+    """
+
+    def cached(audio, n_mels=80, padding=0, **kwargs):
+        if n_mels == model_n_mels and padding == N_SAMPLES and not kwargs:
+            for mel_audio, mel in mels:
+                if audio is mel_audio:
+                    return mel
+        return log_mel_spectrogram(audio, n_mels, padding, **kwargs)
+
+    return cached
+
+
+@contextmanager
+def precomputed(model, encoded, decoded, mels=()):
+    """
+    Temporarily make the model return precomputed encoder outputs and decoding results, and transcribe use precomputed
+    mel spectrograms. Any other input is computed as usual, and each decoding result is returned only once.
+    Not thread-safe: the model's encoder forward and decode methods, and transcribe's log_mel_spectrogram, are replaced
+    for the whole block, so the caller must have the model to itself, e.g. by holding WhisperService's model_lock.
+    Blocks on different models are run one at a time, as transcribe's function is shared by every model. A transcribe
+    running meanwhile in the same process, e.g. of PartialTranscriber's model, also calls the replaced function, which
+    only returns a precomputed mel spectrogram for the very audio arrays in mels and computes any other one as usual.
+    Everything replaced is put back when the block exits, even by an exception.
+    :param model: The Whisper model.
+    :param encoded: A list of (mel, features) tuples of encoder inputs and outputs.
+    :param decoded: A list of (mel, options, result) tuples of decode inputs and results.
+    :param mels: A list of (audio, mel) tuples of audio arrays, matched by identity, and their mel spectrograms padded
+        with 30 seconds of silence, as transcribe computes them.
+    """
+    decoded = list(decoded)
+    encoder_forward = model.encoder.forward
+    transcribe_log_mel_spectrogram = transcribe_module.log_mel_spectrogram
+    # Instance attributes that are replaced, so that an existing override (e.g. a profiler's) is put back afterwards
+    replaced = [(owner, name, vars(owner).get(name)) for owner, name in ((model.encoder, "forward"), (model, "decode"))]
+
+    with precomputed_lock:
+        model.encoder.forward = cached_encoder_forward(encoder_forward, encoded)
+        model.decode = cached_decode(model, decoded)
+        transcribe_module.log_mel_spectrogram = cached_log_mel_spectrogram(
+            transcribe_log_mel_spectrogram, model.dims.n_mels, mels
+        )
+        try:
+            yield
+        finally:
+            transcribe_module.log_mel_spectrogram = transcribe_log_mel_spectrogram
+            for owner, name, value in replaced:
+                if value is None:
+                    delattr(owner, name)
+                else:
+                    setattr(owner, name, value)
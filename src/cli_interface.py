@@ -49,6 +49,13 @@ class CliInterface:
     def print_info(message):
         print("\n" + CliInterface.colorize("i", cyan=True) + f" {message}")
 
+    @staticmethod
+    def print_transcript(text, partial=False, source=None):
+        marker = CliInterface.colorize("…", cyan=True) if partial else CliInterface.colorize("»", bold=True)
+        if source is not None:
+            marker += " " + CliInterface.colorize(f"[{source}]", bold=True)
+        print("\n" + marker + f" {text.strip()}")
+
     @staticmethod
     def format_question(question):
         return CliInterface.colorize("?", bold=True) + f" {question}"
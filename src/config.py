@@ -1,10 +1,109 @@
 # Model size to use for Whisper service. Options: "tiny", "base", "small", "medium", "large"
 MODEL_SIZE = "base"
 
+# Number of audio chunks transcribed in parallel
+# With more than one, each worker is a separate process holding its own copy of the model
+TRANSCRIPTION_WORKERS = 1
+
+# Number of threads torch uses to run each operation in parallel (intra-op), per process transcribing
+# "auto" splits the cores left after CAPTURE_CORES between the transcription workers, None uses every core
+TORCH_INTRA_OP_THREADS = "auto"
+
+# Number of threads torch uses to run independent operations in parallel (inter-op), per process transcribing
+# "auto" uses 1, as Whisper runs one operation at a time, None uses torch's default of one per core
+TORCH_INTER_OP_THREADS = "auto"
+
+# Number of CPU cores kept for the audio capture path (audio callback, resampling, voice activity detection)
+# Torch threads are sized to leave them free, so that heavy transcriptions do not delay the audio callback
+CAPTURE_CORES = 1
+
+# Pin the audio callback thread to the CAPTURE_CORES first cores, and transcription threads and worker processes to the
+# other cores, so that they never run on the same cores. Only supported on Linux
+CPU_AFFINITY = False
+
+# Use the model server started with "python main.py serve" when it is running, instead of loading the model in process
+# The server keeps models loaded between sessions, which saves the model load time at every launch
+USE_MODEL_SERVER = True
+
+# Path of the UNIX socket the model server listens on
+MODEL_SERVER_SOCKET_PATH = "~/.cache/audio-transcriber/model-server.sock"
+
+# Path of the UNIX socket through which a session started with "python main.py headless" is controlled over HTTP
+CONTROL_SOCKET_PATH = "~/.cache/audio-transcriber/control.sock"
+
+# Address on which "python main.py ingest" accepts audio streams from remote clients over TCP
+# The ingest server has no authentication: only listen on another address than 127.0.0.1 on a trusted network
+INGEST_HOST = "127.0.0.1"
+INGEST_PORT = 8766
+
+# Maximum number of audio streams the ingest server transcribes at the same time; further connections are refused
+INGEST_MAX_SESSIONS = 16
+
+# Number of chunks of a stream that can wait for transcription before the ingest server stops reading the stream, which
+# makes its client wait rather than buffering its audio without bound
+INGEST_MAX_QUEUED_CHUNKS = 4
+
+# Directory of the results of the streams transcribed by the ingest server, written to <session id>.json
+INGEST_OUTPUT_DIR = "ingest_results"
+
+# Quantize the linear layers of the Whisper model to int8 when loading it, for faster transcription on the CPU
+# Costs some accuracy, which "python -m benchmarks.quantization_benchmark" measures. Quantized models run on the CPU
+QUANTIZE_INT8 = False
+
+# Directory where quantized models are saved the first time, so that later launches load them without quantizing again
+QUANTIZED_MODEL_CACHE_DIR = "~/.cache/audio-transcriber/quantized"
+
+# Maximum number of audio chunks waiting for transcription during live capture, or 0 for no limit
+# Without a limit, the queue and the latency grow for as long as transcription is slower than capture
+MAX_QUEUED_CHUNKS = 6
+
+# What to do with a new audio chunk when MAX_QUEUED_CHUNKS are already waiting:
+# "block": wait for room in the queue; the audio callback stalls meanwhile, so captured audio is lost silently
+# "drop_oldest": drop the oldest waiting chunk, recording the gap in the transcription results
+# "merge": append the new chunk to the newest waiting one, up to 30 seconds, then drop the oldest chunk
+# "downgrade": transcribe with OVERLOAD_MODEL_SIZE until the queue is half empty, merging the new chunk into the newest
+# waiting one meanwhile, or blocking like "block" when it cannot be merged, so no audio is dropped
+QUEUE_OVERLOAD_POLICY = "drop_oldest"
+
+# Faster model size used in place of MODEL_SIZE while the queue is full, with the "downgrade" policy
+OVERLOAD_MODEL_SIZE = "tiny"
+
+# Model sizes to switch between during live capture, from the smallest to the largest, including MODEL_SIZE
+# All of them are loaded at start; transcription starts with MODEL_SIZE, then steps down to the next smaller size when it
+# falls behind and up to the next larger size when there is headroom. Leave empty to always use MODEL_SIZE
+ADAPTIVE_MODEL_SIZES = []
+
+# Duration of the rolling window over which transcription speed is measured, and minimum time between switches (in
+# seconds)
+ADAPTIVE_WINDOW = 30
+
+# Real-time factor (transcription time per second of audio) above which the next smaller model size is used
+ADAPTIVE_STEP_DOWN_RTF = 0.8
+
+# Real-time factor below which the next larger model size is tried
+ADAPTIVE_STEP_UP_RTF = 0.3
+
+# Number of chunks the queue must grow by over the window for the next smaller model size to be used
+ADAPTIVE_QUEUE_GROWTH = 2
+
+# Maximum number of queued audio chunks transcribed together in one batch
+# Batches only form when chunks are queued faster than they are transcribed, e.g. while catching up after a burst
+TRANSCRIPTION_BATCH_SIZE = 4
+
 # Language code to use for Whisper service, i.e. the language of the audio to transcribe or translate
-# If not specified, the language will be automatically detected
+# If not specified (None or ""), the language is detected once per session and used for all of its audio chunks
 LANGUAGE_CODE = "en"
 
+# Duration of speech the session language is detected on, from its first chunks of at least a second (in seconds)
+LANGUAGE_DETECTION_DURATION = 10
+
+# Duration of transcribed audio after which the detected language is detected again (in seconds), or None for never
+LANGUAGE_RECHECK_INTERVAL = 600
+
+# Average log probability of the decoded tokens of a chunk below which the language is detected again, as audio
+# transcribed in the wrong language decodes with low confidence
+LANGUAGE_RECHECK_LOGPROB = -1.0
+
 # Whisper prompt to help guide the transcription or translation
 PROMPT = ""
 
@@ -14,12 +113,71 @@ TASK = "transcribe"
 # Sample rates to consider for testing device capabilities (in Hz)
 SAMPLE_RATES = [8000, 16000, 32000, 44100, 48000]
 
+# Path of the cache of audio device capabilities and of the last chosen device and sample rate
+# The cache is discarded when the list of audio devices changes
+DEVICE_CACHE_PATH = "~/.cache/audio-transcriber/devices.json"
+
+# Use the last chosen audio device and sample rate without asking, while the list of audio devices is unchanged
+# Set to False to choose them again
+USE_CACHED_AUDIO_DEVICE = True
+
+# Audio sources to record at the same time, sharing one model, instead of the one device chosen at startup
+# Each source is a dictionary of a "label" naming it, of the "device" to record, given by index or by a part of its name,
+# and of the "channel" of the device to record (0 for the first, the default). Sources can be channels of one device,
+# e.g. [{"label": "alice", "device": "Scarlett", "channel": 0}, {"label": "bob", "device": "Scarlett", "channel": 1}]
+# The results of each source are labelled with it and output to their own file, e.g. transcription_results.alice.json
+# The sources share one model; the "downgrade" overload policy drops the oldest chunks, and ADAPTIVE_MODEL_SIZES is unused
+AUDIO_SOURCES = None
+
 # Default frames per buffer for audio stream
 FRAMES_PER_BUFFER = 1024
 
-# Default recording chunk size in seconds
+# Default recording chunk size in seconds, used when voice activity detection is disabled
 CHUNK_DURATION = 5
 
+# Split the audio at pauses in speech using voice activity detection (VAD) instead of fixed CHUNK_DURATION chunks
+# Silent audio is dropped before it reaches the Whisper model
+VAD_ENABLED = True
+
+# Duration of audio analysed at a time by voice activity detection (in seconds)
+VAD_BLOCK_DURATION = 0.5
+
+# Frame energy above which a frame can hold speech (in dB relative to full scale)
+VAD_ENERGY_THRESHOLD_DB = -45
+
+# Fraction of zero crossings per sample below which a frame can hold speech
+VAD_MAX_ZERO_CROSSING_RATE = 0.4
+
+# Segments holding less speech than this are dropped as noise (in seconds)
+VAD_MIN_SEGMENT_DURATION = 0.3
+
+# Segments are cut when they reach this duration (in seconds)
+VAD_MAX_SEGMENT_DURATION = 15
+
+# Duration of silence after speech that ends a segment (in seconds)
+VAD_HANGOVER_DURATION = 0.5
+
+# Show fast partial transcriptions of the speech being captured, for live captioning (requires VAD_ENABLED)
+# Each partial is replaced by the MODEL_SIZE transcription of the segment once it ends, marked as final in the results
+STREAMING_PARTIALS = False
+
+# Model size transcribing the partial results, small enough to keep up with PARTIAL_INTERVAL
+PARTIAL_MODEL_SIZE = "tiny"
+
+# Time between partial transcriptions of the speech segment being captured (in seconds)
+PARTIAL_INTERVAL = 1.0
+
+# Write each audio chunk to a temporary WAV file and transcribe it from disk instead of passing it in memory
+# Only useful for debugging, as it adds a disk write and an ffmpeg decode to every chunk
+DEBUG_SAVE_AUDIO_FILES = False
+
+# Number of files decoded and transcribed at the same time by "main.py transcribe"
+# The files share one model, so this mostly overlaps decoding with transcription unless TRANSCRIPTION_WORKERS > 1
+FILE_TRANSCRIPTION_CONCURRENCY = 2
+
+# File extensions of the audio files transcribed when "main.py transcribe" is given a directory
+AUDIO_FILE_EXTENSIONS = [".wav", ".mp3", ".flac", ".ogg", ".opus", ".m4a", ".aac", ".wma", ".webm", ".mp4"]
+
 # Max retry attempts for the Whisper API
 MAX_RETRIES = 3
 
@@ -27,8 +185,33 @@ MAX_RETRIES = 3
 PRINT_TO_FILE = True
 
 # Path to the file to print the transcription results
+# During the session, each result is streamed as it arrives to a JSON Lines file of the same name with a .jsonl extension,
+# which is removed once the results have been output
 OUTPUT_FILE_PATH = "transcription_results.json"
 
+# Minimum time between syncs of the streamed results to disk (in seconds)
+# 0 syncs after every result, None leaves it to the operating system; results survive a crash of the application anyway
+TRANSCRIPT_FSYNC_INTERVAL = 5
+
+# Path of a spool keeping the audio of the chunks queued for transcription on disk until their results are written, so
+# that it is not lost if the application crashes or a chunk cannot be transcribed, or None to disable it
+# The audio is appended as 16 kHz 16-bit PCM to <path>.<n>.<version>.pcm files, indexed by .idx files. Audio left
+# untranscribed, including chunks dropped by QUEUE_OVERLOAD_POLICY, is transcribed in the background during the next
+# session, into the output file with a .replay suffix, e.g. transcription_results.replay.json. With AUDIO_SOURCES, each
+# source has its own spool
+SPOOL_PATH = None
+
+# Size of each of the audio files of the spool (in bytes): once one is full, the spool moves on to a new one, and removes
+# the earlier ones once their chunks are transcribed
+SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024
+
+# Port of a local HTTP endpoint serving the pipeline metrics (stage latencies, queue depth, retries, failures, dropped
+# chunks and real-time factor) in the Prometheus text format at http://127.0.0.1:<port>/metrics, or None to disable it
+METRICS_PORT = None
+
+# Time between summaries of the pipeline metrics printed to the console (in seconds), or None to disable them
+METRICS_LOG_INTERVAL = 60
+
 # Output raw transcription either to file or to the console
 # If True, the raw output from Whisper will be used for the transcription results
 OUTPUT_RAW_TRANSCRIPTION = False
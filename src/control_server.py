@@ -0,0 +1,162 @@
+import json
+import os
+import socket
+import socketserver
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler
+
+from src.cli_interface import CliInterface
+
+# Commands changing the recording state, sent as POST requests, by path
+COMMAND_PATHS = ("/start", "/pause", "/flush", "/stop")
+
+
+class ControlServer:
+    def __init__(self, audio_service, socket_path):
+        """
+        Initialize a server controlling an AudioService with HTTP requests over a UNIX socket, to record without a
+        keyboard, e.g. under a process supervisor. The socket is only accessible to the user running the server.
+        POST /start, /pause, /flush and /stop answer once the command is done, and GET /status answers right away, even
+        while a command is in progress. Every response is the JSON status of the service, or an error.
+        :param audio_service: The AudioService to control.
+        :param socket_path: The path of the UNIX socket to listen on.
+        """
+        self.audio_service = audio_service
+        self.socket_path = os.path.expanduser(socket_path)
+        self.commands = {
+            "/start": audio_service.start_recording,
+            "/pause": audio_service.pause_recording,
+            "/flush": audio_service.flush,
+            "/stop": audio_service.stop,
+        }
+        self.server = None
+
+    def handle_request(self, method, path):
+        """
+        Run a command, or get the status of the service.
+        :param method: The HTTP method of the request.
+        :param path: The path of the request.
+        :return: A tuple of the HTTP status code and the JSON-serializable response.
+        """
+        if path == "/status":
+            if method != "GET":
+                return 405, {"error": "Use GET for /status."}
+            return 200, self.audio_service.status()
+        if path not in self.commands:
+            return 404, {"error": f"Unknown command {path}, use one of {', '.join(COMMAND_PATHS)} or /status."}
+        if method != "POST":
+            return 405, {"error": f"Use POST for {path}."}
+        try:
+            if not self.commands[path]():
+                return 409, {"error": "The session is stopped."}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+        return 200, self.audio_service.status()
+
+    def create_handler(self):
+        """
+        :return: The request handler class of the HTTP server.
+        """
+        control_server = self
+
+        class ControlHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.respond(*control_server.handle_request("GET", self.path))
+
+            def do_POST(self):
+                status_code, response = control_server.handle_request("POST", self.path)
+                self.respond(status_code, response)
+                if self.path == "/stop" and status_code == 200:
+                    # The response is sent first, as the process exits once the server stops
+                    control_server.stop()
+
+            def respond(self, status_code, response):
+                body = (json.dumps(response) + "\n").encode()
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                self.wfile.flush()
+
+            def log_message(self, *_args):
+                pass  # Every status query would otherwise be printed to the console
+
+        return ControlHandler
+
+    def serve_forever(self):
+        """
+        Listen on the UNIX socket and answer requests, each connection in its own thread, until stop is called.
+        """
+        os.makedirs(os.path.dirname(self.socket_path), mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            if ControlClient(self.socket_path).is_running():
+                raise RuntimeError(f"A session is already controlled through {self.socket_path}.")
+            os.remove(self.socket_path)  # Left behind by a session that did not exit cleanly
+        old_umask = os.umask(0o177)  # Create the socket accessible to the current user only
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, self.create_handler())
+        finally:
+            os.umask(old_umask)
+        self.server.daemon_threads = True
+        CliInterface.print_info("Control API listening on: " + CliInterface.colorize(self.socket_path, bold=True))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.socket_path)
+
+    def stop(self):
+        """
+        Stop serve_forever, from another thread.
+        """
+        self.server.shutdown()
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        """
+        Initialize an HTTP connection over a UNIX socket.
+        :param socket_path: The path of the UNIX socket.
+        :param timeout: The timeout of socket operations in seconds, or None to wait indefinitely.
+        """
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class ControlClient:
+    def __init__(self, socket_path):
+        """
+        Initialize a client of a ControlServer.
+        :param socket_path: The path of the server's UNIX socket.
+        """
+        self.socket_path = os.path.expanduser(socket_path)
+
+    def is_running(self):
+        """
+        :return: True if a server answered on the socket.
+        """
+        try:
+            self.request("status")
+            return True
+        except (OSError, ConnectionError):
+            return False
+
+    def request(self, command):
+        """
+        Send a command, or a status query, and wait for the response.
+        :param command: "start", "pause", "flush", "stop" or "status".
+        :return: A tuple of the HTTP status code and the JSON response.
+        """
+        connection = UnixHTTPConnection(self.socket_path)
+        try:
+            connection.request("GET" if command == "status" else "POST", "/" + command)
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
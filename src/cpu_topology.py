@@ -0,0 +1,88 @@
+import os
+
+from src.cli_interface import CliInterface
+from src.config import CAPTURE_CORES, CPU_AFFINITY, TORCH_INTER_OP_THREADS, TORCH_INTRA_OP_THREADS
+
+
+def available_cores():
+    """
+    :return: The sorted list of the CPU cores this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        # The affinity of the main thread, whose ID is the process ID, as other threads may have been pinned
+        return sorted(os.sched_getaffinity(os.getpid()))
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores():
+    """
+    Split the available CPU cores between the audio capture path, which gets the first CAPTURE_CORES of them, and
+    transcription. When there are not more cores than CAPTURE_CORES, both share all of them.
+    :return: A tuple of the list of capture cores and the list of transcription cores.
+    """
+    cores = available_cores()
+    if CAPTURE_CORES <= 0 or len(cores) <= CAPTURE_CORES:
+        return cores, cores
+    return cores[:CAPTURE_CORES], cores[CAPTURE_CORES:]
+
+
+def torch_thread_counts(worker_count):
+    """
+    Resolve TORCH_INTRA_OP_THREADS and TORCH_INTER_OP_THREADS for each process transcribing.
+    :param worker_count: The number of processes transcribing at the same time.
+    :return: A tuple of the number of intra-op threads and the number of inter-op threads, None for torch's default.
+    """
+    intra_op_threads = TORCH_INTRA_OP_THREADS
+    inter_op_threads = TORCH_INTER_OP_THREADS
+    if intra_op_threads == "auto":
+        intra_op_threads = max(1, len(split_cores()[1]) // worker_count)
+    if inter_op_threads == "auto":
+        inter_op_threads = 1
+    return intra_op_threads, inter_op_threads
+
+
+def configure_torch_threads(intra_op_threads, inter_op_threads):
+    """
+    Set the sizes of torch's thread pools in the current process.
+    :param intra_op_threads: The number of intra-op threads, or None to keep torch's default.
+    :param inter_op_threads: The number of inter-op threads, or None to keep torch's default.
+    """
+    import torch
+
+    if intra_op_threads is not None:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads is not None and torch.get_num_interop_threads() != inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # The inter-op pool can only be sized before its first use, e.g. by a model loaded earlier in the process
+            pass
+
+
+def capture_affinity():
+    """
+    :return: The CPU cores to pin the audio capture path to, or None if CPU_AFFINITY is not set.
+    """
+    return split_cores()[0] if CPU_AFFINITY else None
+
+
+def transcription_affinity():
+    """
+    :return: The CPU cores to pin transcription threads and processes to, or None if CPU_AFFINITY is not set.
+    """
+    return split_cores()[1] if CPU_AFFINITY else None
+
+
+def pin_current_thread(cores):
+    """
+    Restrict the calling thread to a set of CPU cores. Threads it starts afterwards, such as torch's thread pool,
+    inherit the restriction. Does nothing on platforms without sched_setaffinity.
+    :param cores: The CPU cores to run on, or None to leave the thread unrestricted.
+    """
+    if cores is None or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        # On Linux, process ID 0 is the calling thread rather than the whole process
+        os.sched_setaffinity(0, cores)
+    except OSError as e:
+        CliInterface.print_warning(f"Could not pin the thread to CPU cores {cores}: {e}")
@@ -0,0 +1,81 @@
+import json
+import os
+
+from src.cli_interface import CliInterface
+
+
+class DeviceCache:
+    def __init__(self, path, pyaudio_instance, device_infos):
+        """
+        Initialize the on-disk cache of audio device capabilities and of the last chosen device and sample rate.
+        Devices are identified by host API and name, as their indexes can change between launches. The whole cache is
+        discarded when the device list changes, e.g. when a device is plugged in or unplugged.
+        :param path: The path of the cache file.
+        :param pyaudio_instance: An instance of the PyAudio class.
+        :param device_infos: The information of every audio device, by device index, see get_device_infos.
+        """
+        self.path = os.path.expanduser(path)
+        host_api_names = {}
+        for info in device_infos:
+            host_api = info.get("hostApi", 0)
+            if host_api not in host_api_names:
+                host_api_names[host_api] = pyaudio_instance.get_host_api_info_by_index(host_api).get("name")
+        self.device_keys = [f"{host_api_names[info.get('hostApi', 0)]}/{info.get('name')}" for info in device_infos]
+        self.device_list = [
+            [key, info.get("maxInputChannels"), info.get("defaultSampleRate")]
+            for key, info in zip(self.device_keys, device_infos)
+        ]
+        self.entries = self.load()
+
+    def load(self):
+        """
+        Read the cache file.
+        :return: The cached entries, or empty entries if the file is missing, unreadable or for another device list.
+        """
+        empty = {"device_list": self.device_list, "sample_rates": {}, "default": None}
+        try:
+            with open(self.path) as file:
+                entries = json.load(file)
+        except (OSError, ValueError):
+            return empty
+        if not isinstance(entries, dict) or entries.get("device_list") != self.device_list:
+            return empty
+        return {**empty, **entries}
+
+    def save(self):
+        """
+        Write the cache file. Failing to write it only costs probing the devices again at the next launch.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w") as file:
+                json.dump(self.entries, file, indent=4)
+        except OSError as e:
+            CliInterface.print_warning(f"Could not save the audio device cache: {e}")
+
+    def get_sample_rates(self, device_index):
+        """
+        :return: The cached supported sample rates of a device, or None if they are not cached.
+        """
+        return self.entries["sample_rates"].get(self.device_keys[device_index])
+
+    def set_sample_rates(self, device_index, sample_rates):
+        """
+        Cache the supported sample rates of a device.
+        """
+        self.entries["sample_rates"][self.device_keys[device_index]] = sample_rates
+
+    def get_default(self):
+        """
+        :return: The last chosen device index and sample rate, or None if there is no choice cached.
+        """
+        default = self.entries["default"]
+        if default is None or default["device"] not in self.device_keys:
+            return None
+        return self.device_keys.index(default["device"]), default["sample_rate"]
+
+    def set_default(self, device_index, sample_rate):
+        """
+        Cache the chosen device and sample rate, to use them without asking at the next launch.
+        """
+        self.entries["default"] = {"device": self.device_keys[device_index], "sample_rate": sample_rate}
@@ -0,0 +1,125 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from src.audio_processor import AudioProcessor
+from src.audio_utils import WHISPER_SAMPLE_RATE, decode_audio_file
+from src.cli_interface import CliInterface
+from src.config import (
+    AUDIO_FILE_EXTENSIONS,
+    FILE_TRANSCRIPTION_CONCURRENCY,
+    METRICS_LOG_INTERVAL,
+    METRICS_PORT,
+    TRANSCRIPTION_BATCH_SIZE,
+    TRANSCRIPTION_WORKERS,
+)
+from src.metrics import MetricsReporter, PipelineMetrics
+from src.whisper_service import WhisperService, load_transcription_model
+
+
+def find_audio_files(paths):
+    """
+    List the audio files to transcribe.
+    :param paths: Paths to audio files, or to directories searched recursively for files with an extension in
+        AUDIO_FILE_EXTENSIONS.
+    :return: The list of audio file paths, in the order given, with the files of each directory sorted.
+    """
+    extensions = {extension.lower() for extension in AUDIO_FILE_EXTENSIONS}
+    audio_files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            audio_files.append(path)
+            continue
+        directory_files = [
+            os.path.join(directory, name)
+            for directory, _, names in os.walk(path)
+            for name in names
+            if os.path.splitext(name)[1].lower() in extensions
+        ]
+        audio_files += sorted(directory_files)
+    return audio_files
+
+
+class FileTranscriber:
+    def __init__(self):
+        """
+        Initialize the FileTranscriber, which transcribes recorded audio files without user interaction.
+        The model is loaded once and shared by every file, which go through the same AudioProcessor and WhisperService
+        pipeline as captured audio.
+        """
+        self.model = load_transcription_model()
+        # An in-process model runs one transcription at a time, while worker processes each take their own
+        self.model_lock = Lock() if TRANSCRIPTION_WORKERS == 1 else None
+        # Enough queued chunks to fill a batch for every worker; decoding waits beyond that, to bound memory use
+        self.max_queued_chunks = TRANSCRIPTION_BATCH_SIZE * TRANSCRIPTION_WORKERS
+        # The metrics of every file are aggregated, as they go through the same model
+        self.metrics = PipelineMetrics()
+
+    def run(self, paths):
+        """
+        Transcribe audio files, FILE_TRANSCRIPTION_CONCURRENCY at a time, and print a throughput summary.
+        The results of each file are written next to it, to the file's path followed by ".json".
+        :param paths: Paths to audio files, or to directories searched recursively for audio files.
+        :return: True if every file was transcribed.
+        """
+        audio_files = find_audio_files(paths)
+        if len(audio_files) == 0:
+            CliInterface.print_warning("No audio files to transcribe.")
+            return False
+        CliInterface.print_info(f"Transcribing {len(audio_files)} audio files")
+        start_time = time.perf_counter()
+        metrics_reporter = MetricsReporter(self.metrics, METRICS_PORT, METRICS_LOG_INTERVAL)
+        metrics_reporter.start()
+        try:
+            with ThreadPoolExecutor(max_workers=FILE_TRANSCRIPTION_CONCURRENCY) as executor:
+                durations = list(executor.map(self.transcribe_file, audio_files))
+        finally:
+            metrics_reporter.stop()
+            if TRANSCRIPTION_WORKERS > 1:
+                self.model.shutdown()
+        elapsed_time = time.perf_counter() - start_time
+        self.print_summary(durations, elapsed_time)
+        return None not in durations
+
+    def transcribe_file(self, path):
+        """
+        Transcribe an audio file, decoding it in blocks as the transcription progresses.
+        :param path: The path to the audio file.
+        :return: The duration of the audio in seconds, or None if the file could not be decoded.
+        """
+        whisper_transcription = WhisperService(
+            self.model, self.model_lock, output_file_path=path + ".json", metrics=self.metrics
+        )
+        audio_processor = AudioProcessor(WHISPER_SAMPLE_RATE, whisper_transcription, self.max_queued_chunks)
+        byte_count = 0
+        try:
+            for audio_data in decode_audio_file(path, audio_processor.desired_length):
+                audio_processor.add_audio(audio_data)
+                byte_count += len(audio_data)
+            audio_processor.finalize_recording()
+        except Exception as e:
+            CliInterface.print_error(e)
+            audio_processor.stop_processing(output_results=False)
+            return None
+        audio_processor.stop_processing()
+        return byte_count / 2 / WHISPER_SAMPLE_RATE
+
+    def print_summary(self, durations, elapsed_time):
+        """
+        Print the number of files transcribed and the throughput, in hours of audio per hour of wall-clock time.
+        :param durations: The audio duration of each file in seconds, or None for the files that failed.
+        :param elapsed_time: The wall-clock duration of the whole job in seconds.
+        """
+        audio_duration = sum(duration for duration in durations if duration is not None)
+        failed_count = durations.count(None)
+        CliInterface.print_info(
+            "Transcribed {} files, {:.2f} hours of audio, in {:.2f} hours: {:.2f} audio hours per wall-clock hour.".format(
+                len(durations) - failed_count,
+                audio_duration / 3600,
+                elapsed_time / 3600,
+                audio_duration / elapsed_time if elapsed_time > 0 else 0,
+            )
+        )
+        if failed_count > 0:
+            CliInterface.print_warning(f"{failed_count} files could not be transcribed.")
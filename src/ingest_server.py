@@ -0,0 +1,245 @@
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import suppress
+from threading import Event
+
+from src.audio_processor import AudioProcessor
+from src.cli_interface import CliInterface
+from src.config import (
+    INGEST_MAX_QUEUED_CHUNKS,
+    INGEST_MAX_SESSIONS,
+    INGEST_OUTPUT_DIR,
+    METRICS_LOG_INTERVAL,
+    METRICS_PORT,
+    TRANSCRIPTION_WORKERS,
+)
+from src.metrics import MetricsReporter, PipelineMetrics
+from src.model_server import MESSAGE_PREFIX
+from src.transcription_scheduler import TranscriptionScheduler
+from src.whisper_service import WhisperService, load_transcription_model
+
+# Session IDs name the output files, so they are limited to characters that are safe in file names
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}")
+
+# Range of the sample rates accepted from clients (in Hz)
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 192000
+
+# Maximum sizes of the header and of the payload of a message from a client (in bytes), so that a client cannot make the
+# server allocate memory without bound
+MAX_HEADER_SIZE = 4096
+MAX_PAYLOAD_SIZE = 1 << 20
+
+
+def write_message(writer, header, payload=b""):
+    """
+    Write a message made of a JSON header and a binary payload to an asyncio stream, framed like the model server's
+    messages (see send_message). Await writer.drain() afterwards, to wait while the peer is not reading.
+    :param writer: The asyncio StreamWriter.
+    :param header: The JSON-serializable header. NumPy scalars are converted to Python numbers.
+    :param payload: The binary payload (any bytes-like object).
+    """
+    header_data = json.dumps(header, default=lambda value: value.item()).encode()
+    writer.write(MESSAGE_PREFIX.pack(len(header_data), len(payload)) + header_data)
+    writer.write(payload)
+
+
+async def read_message(reader, max_payload_size=None):
+    """
+    Read a message written with write_message or send_message from an asyncio stream.
+    Raises asyncio.IncompleteReadError if the stream ends first, and ValueError if the message is too large or its
+    header is not a JSON object.
+    :param reader: The asyncio StreamReader.
+    :param max_payload_size: The maximum size of the payload in bytes, or None for no limit.
+    :return: A tuple of the header and the payload.
+    """
+    header_length, payload_length = MESSAGE_PREFIX.unpack(await reader.readexactly(MESSAGE_PREFIX.size))
+    if max_payload_size is not None and (header_length > MAX_HEADER_SIZE or payload_length > max_payload_size):
+        raise ValueError(f"Message too large: {header_length} bytes of header, {payload_length} bytes of payload.")
+    header = json.loads(await reader.readexactly(header_length))
+    if not isinstance(header, dict):
+        raise ValueError("The message header must be a JSON object.")
+    return header, await reader.readexactly(payload_length)
+
+
+class IngestServer:
+    def __init__(self, host, port, max_sessions=INGEST_MAX_SESSIONS, output_dir=INGEST_OUTPUT_DIR, model=None):
+        """
+        Initialize a server transcribing audio streamed by remote clients over TCP, many at a time, with one model.
+        A client sends a header message with its "session_id" and the "sample_rate" of its audio, then messages of
+        16-bit mono PCM audio, and a message of type "end". Each stream goes through its own AudioProcessor and
+        WhisperService, like a local recording, and its results are sent back as they arrive, in "result" messages,
+        followed by a "done" message once the stream is transcribed. They are also written to the output directory.
+        A stream whose transcription falls INGEST_MAX_QUEUED_CHUNKS behind is not read until it catches up, so that
+        TCP flow control makes its client wait. The streams share the model through a TranscriptionScheduler, so that
+        each gets an equal share of it.
+        :param host: The address to listen on.
+        :param port: The port to listen on, or 0 for any free port.
+        :param max_sessions: The maximum number of streams transcribed at the same time.
+        :param output_dir: The directory the results of each stream are written to, as <session id>.json.
+        :param model: A model returned by load_transcription_model, or a Future of one. If not given, the model is
+            loaded in the background.
+        """
+        self.host = host
+        self.port = port
+        self.max_sessions = max_sessions
+        self.output_dir = output_dir
+        if model is None:
+            model_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+            self.model_future = model_loader.submit(load_transcription_model)
+            model_loader.shutdown(wait=False)
+        elif isinstance(model, Future):
+            self.model_future = model
+        else:
+            self.model_future = Future()
+            self.model_future.set_result(model)
+        # Worker processes transcribe TRANSCRIPTION_WORKERS chunks at the same time, an in-process model one
+        self.scheduler = TranscriptionScheduler(TRANSCRIPTION_WORKERS)
+        self.metrics = PipelineMetrics()
+        self.sessions = set()  # IDs of the sessions being transcribed
+        self.loop = None
+        self.stopped = None  # asyncio.Event set by stop
+        self.ready = Event()  # Set once the server listens, with port set to the port it listens on
+
+    def check_header(self, header):
+        """
+        :param header: The header message of a stream.
+        :return: The reason to refuse the stream, or None to accept it.
+        """
+        session_id = header.get("session_id")
+        sample_rate = header.get("sample_rate")
+        if not isinstance(session_id, str) or SESSION_ID_PATTERN.fullmatch(session_id) is None:
+            return "The session_id must be 1 to 64 letters, digits, dots, dashes or underscores, not starting with a dot."
+        if not isinstance(sample_rate, int) or not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE:
+            return f"The sample_rate must be an integer from {MIN_SAMPLE_RATE} to {MAX_SAMPLE_RATE}."
+        if session_id in self.sessions:
+            return f'Session "{session_id}" is already being transcribed.'
+        if len(self.sessions) >= self.max_sessions:
+            return "The server is transcribing as many streams as it can, retry later."
+        return None
+
+    async def handle_connection(self, reader, writer):
+        """
+        Transcribe the stream of a client, answering with an "error" message if it is refused or malformed.
+        """
+        try:
+            header, _ = await read_message(reader, 0)
+            error = self.check_header(header)
+            if error is not None:
+                write_message(writer, {"type": "error", "error": error})
+                await writer.drain()
+                return
+            session_id = header["session_id"]
+            self.sessions.add(session_id)
+            try:
+                await self.transcribe_stream(session_id, header["sample_rate"], reader, writer)
+            finally:
+                self.sessions.discard(session_id)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # The client disconnected, the audio received was transcribed anyway
+        except ValueError as e:
+            with suppress(ConnectionError):
+                write_message(writer, {"type": "error", "error": str(e)})
+                await writer.drain()
+        finally:
+            writer.close()
+            with suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def transcribe_stream(self, session_id, sample_rate, reader, writer):
+        """
+        Add the audio of a stream to its AudioProcessor until the stream ends, while sending its results back.
+        The audio received is transcribed and output even if the client disconnects before the end of the stream.
+        """
+        loop = asyncio.get_running_loop()
+        results = asyncio.Queue()
+        whisper_transcription = WhisperService(
+            self.model_future,
+            self.scheduler.source_lock(session_id),
+            output_file_path=os.path.join(self.output_dir, session_id + ".json"),
+            metrics=self.metrics,
+            source=session_id,
+            result_callback=lambda result: loop.call_soon_threadsafe(results.put_nowait, result),
+        )
+        audio_processor = AudioProcessor(sample_rate, whisper_transcription, INGEST_MAX_QUEUED_CHUNKS, "block")
+        # The audio is added from one thread, in order. It blocks while the stream's queue is full, and the stream is
+        # not read in the meantime
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        sender = asyncio.create_task(self.send_results(results, writer))
+        try:
+            while True:
+                header, payload = await read_message(reader, MAX_PAYLOAD_SIZE)
+                if header.get("type") == "end":
+                    break
+                if len(payload) % 2 != 0:
+                    raise ValueError("Audio payloads must hold whole 16-bit samples.")
+                await loop.run_in_executor(executor, audio_processor.add_audio, payload)
+        finally:
+            await loop.run_in_executor(executor, self.finish_stream, audio_processor)
+            executor.shutdown()
+            results.put_nowait(None)
+            await sender
+
+    @staticmethod
+    def finish_stream(audio_processor):
+        """
+        Transcribe the rest of a stream's audio and output its results, blocking until they are written.
+        """
+        audio_processor.finalize_recording()
+        audio_processor.stop_processing()
+
+    @staticmethod
+    async def send_results(results, writer):
+        """
+        Send the results of a stream to its client as they arrive, until the None that ends them, then a "done"
+        message. Results are no longer sent once the client disconnects.
+        :param results: The asyncio Queue of the results.
+        :param writer: The asyncio StreamWriter of the connection.
+        """
+        try:
+            while (result := await results.get()) is not None:
+                write_message(writer, {"type": "result", "result": result})
+                await writer.drain()
+            write_message(writer, {"type": "done"})
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def serve(self):
+        """
+        Accept streams until stop is called.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        os.makedirs(self.output_dir, exist_ok=True)
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        CliInterface.print_info(
+            "Ingest server listening on: " + CliInterface.colorize(f"{self.host}:{self.port}", bold=True)
+        )
+        self.ready.set()
+        async with server:
+            await self.stopped.wait()
+
+    def serve_forever(self):
+        """
+        Accept streams until stop is called or the process is interrupted, reporting the metrics of every stream
+        together. Streams in progress are transcribed and output before returning.
+        """
+        metrics_reporter = MetricsReporter(self.metrics, METRICS_PORT, METRICS_LOG_INTERVAL)
+        metrics_reporter.start()
+        try:
+            asyncio.run(self.serve())
+        finally:
+            metrics_reporter.stop()
+            if TRANSCRIPTION_WORKERS > 1 and self.model_future.exception() is None:
+                self.model_future.result().shutdown()
+
+    def stop(self):
+        """
+        Stop serve_forever, from another thread.
+        """
+        self.loop.call_soon_threadsafe(self.stopped.set)
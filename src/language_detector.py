@@ -0,0 +1,107 @@
+from threading import Lock
+
+from src.config import LANGUAGE_DETECTION_DURATION, LANGUAGE_RECHECK_INTERVAL, LANGUAGE_RECHECK_LOGPROB
+
+# Minimum duration of an audio chunk used for language detection (in seconds), as shorter ones are often misdetected
+MIN_DETECTION_DURATION = 1.0
+
+
+def language_probabilities(model, audio):
+    """
+    Detect the language of audio with a Whisper model, the way transcribe does: from the first 30 seconds, with one
+    encoder pass and one decoder step.
+    whisper and torch are imported here rather than with this module, as importing them takes seconds.
+    :param model: The Whisper model.
+    :param audio: The audio as a float32 NumPy array sampled at 16 kHz.
+    :return: A dictionary of the probability of each language, by language code.
+    """
+    from whisper.audio import N_FRAMES, N_SAMPLES, log_mel_spectrogram, pad_or_trim
+
+    if not model.is_multilingual:
+        return {"en": 1.0}
+    mel = log_mel_spectrogram(audio, model.dims.n_mels, padding=N_SAMPLES)
+    _, probabilities = model.detect_language(pad_or_trim(mel, N_FRAMES).to(model.device))
+    return probabilities
+
+
+class LanguageDetector:
+    def __init__(
+        self,
+        detection_duration=LANGUAGE_DETECTION_DURATION,
+        recheck_interval=LANGUAGE_RECHECK_INTERVAL,
+        recheck_logprob=LANGUAGE_RECHECK_LOGPROB,
+    ):
+        """
+        Initialize the LanguageDetector, which detects the language of a session once rather than for every chunk, so
+        that chunks skip Whisper's own detection and the language cannot flip between chunks.
+        The language probabilities of the first chunks of at least MIN_DETECTION_DURATION are averaged, weighted by
+        duration, until detection_duration of audio is covered. The language is then kept, until recheck_interval of
+        audio has been transcribed or a chunk decodes with low confidence, which starts a new detection.
+        :param detection_duration: The duration of audio to detect the language on, in seconds.
+        :param recheck_interval: The duration of transcribed audio after which the language is detected again, in
+            seconds, or None to only detect it again on low confidence.
+        :param recheck_logprob: The average log probability of a chunk's decoded tokens below which the language is
+            detected again.
+        """
+        self.detection_duration = detection_duration
+        self.recheck_interval = recheck_interval
+        self.recheck_logprob = recheck_logprob
+        self.lock = Lock()
+        self.language = None  # Detected language code, None until the first detection
+        self.probability = None  # Average probability of the detected language
+        self.detecting = True
+        self.probability_sums = {}  # Sums of the language probabilities of the current detection, weighted by duration
+        self.detected_duration = 0  # Duration of audio in the current detection
+        self.transcribed_duration = 0  # Duration of audio transcribed since the last detection ended
+
+    def needs_detection(self, duration):
+        """
+        :param duration: The duration of an audio chunk about to be transcribed, in seconds.
+        :return: Whether the language of the chunk should be detected, to be passed to add_detection.
+        """
+        return self.detecting and duration >= MIN_DETECTION_DURATION
+
+    def add_detection(self, probabilities, duration):
+        """
+        Add the language probabilities of an audio chunk to the current detection. The most probable language so far
+        is used right away.
+        :param probabilities: A dictionary of the probability of each language, by language code.
+        :param duration: The duration of the audio chunk in seconds.
+        :return: True if this completed the detection, False otherwise.
+        """
+        with self.lock:
+            if not self.detecting:
+                return False
+            for language, probability in probabilities.items():
+                self.probability_sums[language] = self.probability_sums.get(language, 0) + probability * duration
+            self.detected_duration += duration
+            self.language = max(self.probability_sums, key=self.probability_sums.get)
+            self.probability = self.probability_sums[self.language] / self.detected_duration
+            if self.detected_duration < self.detection_duration:
+                return False
+            self.detecting = False
+            self.transcribed_duration = 0
+            return True
+
+    def record_result(self, result, duration):
+        """
+        Record the transcription result of an audio chunk, starting a new detection if the interval has elapsed or the
+        result was decoded with low confidence.
+        :param result: The transcription result.
+        :param duration: The duration of the audio chunk in seconds.
+        """
+        segments = result.get("segments", [])
+        low_confidence = (
+            len(segments) > 0
+            and sum(segment["avg_logprob"] for segment in segments) / len(segments) < self.recheck_logprob
+        )
+        with self.lock:
+            if self.detecting:
+                return
+            self.transcribed_duration += duration
+            interval_elapsed = self.recheck_interval is not None and self.transcribed_duration >= self.recheck_interval
+            if low_confidence or interval_elapsed:
+                # The current language is kept until the new detection has results
+                self.detecting = True
+                self.probability_sums = {}
+                self.detected_duration = 0
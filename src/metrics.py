@@ -0,0 +1,320 @@
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+
+from src.cli_interface import CliInterface
+
+# Upper bounds of the latency histogram buckets (in seconds)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Duration over which the real-time factor gauge is computed (in seconds)
+REAL_TIME_FACTOR_WINDOW = 60
+
+# Prefix of the names of the exported metrics
+METRIC_PREFIX = "audio_transcriber_"
+
+
+class ChunkTimings:
+    def __init__(self, duration, capture_end):
+        """
+        Initialize the timestamps of an audio chunk as it goes through the pipeline, from time.monotonic.
+        The stages are set in order as the chunk reaches them, and stay None until then.
+        :param duration: The duration of the chunk's audio in seconds.
+        :param capture_end: When the last audio of the chunk was captured.
+        """
+        self.duration = duration
+        self.capture_end = capture_end
+        self.enqueue = None  # Added to the processing queue
+        self.dequeue = None  # Taken from the processing queue by a processing thread
+        self.decode_start = None  # Passed to the model
+        self.decode_end = None  # Transcribed, or failed after every retry
+        self.write = None  # Result appended to the results, in capture order
+
+
+class Histogram:
+    def __init__(self, buckets):
+        """
+        Initialize a cumulative histogram in the Prometheus sense.
+        :param buckets: The upper bounds of the buckets, in increasing order. A last +Inf bucket is implied.
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Add a value to the histogram.
+        """
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        :return: The upper bound of the bucket holding the q-quantile, an estimate in the Prometheus style, or None if
+            the histogram is empty or the quantile is beyond the last bound.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return None
+
+    def render(self, name, help_text):
+        """
+        :return: The histogram in the Prometheus text exposition format.
+        """
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {total}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum {self.sum}")
+        lines.append(f"{name}_count {self.count}")
+        return lines
+
+
+class PipelineMetrics:
+    def __init__(self):
+        """
+        Initialize the metrics of the transcription pipeline: latency histograms of the stages chunks go through,
+        counters of chunks, retries, failures and dropped audio, and gauges of the queue depth, of the transcription lag
+        and of the real-time factor. Methods can be called from any thread.
+        """
+        self.lock = Lock()
+        self.stage_histograms = {
+            # Stage name: (start timestamp, end timestamp, help text)
+            "processing": ("capture_end", "enqueue", "Time from the capture of a chunk's last audio to its queuing."),
+            "queue_wait": ("enqueue", "dequeue", "Time chunks wait in the processing queue."),
+            "decode": ("decode_start", "decode_end", "Time the model takes to transcribe a chunk or batch of chunks."),
+            "reorder_wait": ("decode_end", "write", "Time results wait for the results of earlier chunks."),
+            "end_to_end": ("capture_end", "write", "Time from the capture of a chunk's last audio to its result."),
+        }
+        self.histograms = {stage: Histogram(LATENCY_BUCKETS) for stage in self.stage_histograms}
+        self.counters = {
+            "chunks_queued": 0,
+            "chunks_dequeued": 0,
+            "chunks_written": 0,
+            "transcription_retries": 0,
+            "transcription_failures": 0,
+            "chunks_merged": 0,
+            "chunks_downgraded": 0,
+            "audio_seconds": 0.0,
+            "transcription_seconds": 0.0,
+        }
+        self.dropped_chunks = {"overrun": 0, "no_speech": 0, "overload": 0}
+        self.pending = set()  # Timings of the chunks queued and not written yet
+        self.recent_transcriptions = deque()  # (end time, transcription seconds, audio seconds), for the RTF gauge
+
+    def chunk_queued(self, timings):
+        """
+        Record that a chunk was added to the processing queue.
+        """
+        with self.lock:
+            timings.enqueue = time.monotonic()
+            self.counters["chunks_queued"] += 1
+            self.pending.add(timings)
+
+    def chunk_dequeued(self, timings):
+        """
+        Record that a chunk was taken from the processing queue.
+        """
+        with self.lock:
+            timings.dequeue = time.monotonic()
+            self.counters["chunks_dequeued"] += 1
+
+    def transcription_started(self, chunk_timings):
+        """
+        Record that chunks, transcribed together, were passed to the model.
+        :param chunk_timings: The timings of the chunks, None for chunks that are not tracked.
+        """
+        now = time.monotonic()
+        for timings in chunk_timings:
+            if timings is not None:
+                timings.decode_start = now
+
+    def transcription_finished(self, chunk_timings, transcription_seconds):
+        """
+        Record that the model finished transcribing chunks, successfully or not.
+        :param chunk_timings: The timings of the chunks, None for chunks that are not tracked.
+        :param transcription_seconds: The time spent transcribing the chunks, including retries.
+        """
+        now = time.monotonic()
+        audio_seconds = 0.0
+        for timings in chunk_timings:
+            if timings is not None:
+                timings.decode_end = now
+                audio_seconds += timings.duration
+        with self.lock:
+            self.counters["audio_seconds"] += audio_seconds
+            self.counters["transcription_seconds"] += transcription_seconds
+            self.recent_transcriptions.append((now, transcription_seconds, audio_seconds))
+
+    def chunk_written(self, timings):
+        """
+        Record that the result of a chunk was appended to the results, and observe the chunk's stage latencies.
+        """
+        with self.lock:
+            timings.write = time.monotonic()
+            self.counters["chunks_written"] += 1
+            self.pending.discard(timings)
+            for stage, (start, end, _) in self.stage_histograms.items():
+                start_time = getattr(timings, start)
+                end_time = getattr(timings, end)
+                if start_time is not None and end_time is not None:
+                    self.histograms[stage].observe(end_time - start_time)
+
+    def count(self, counter, amount=1):
+        """
+        Increment a counter, such as transcription_retries or transcription_failures.
+        """
+        with self.lock:
+            self.counters[counter] += amount
+
+    def chunks_dropped(self, reason, amount):
+        """
+        Count audio dropped before transcription.
+        :param reason: "overrun" for audio overwritten in the ring buffer before being processed, "no_speech" for
+            segments dropped by voice activity detection, or "overload" for chunks dropped from a full processing queue.
+        :param amount: The number of chunks or segments dropped.
+        """
+        with self.lock:
+            self.dropped_chunks[reason] += amount
+
+    def gauges(self):
+        """
+        :return: A dictionary of the current queue depth, transcription lag (age of the oldest chunk without a result,
+            in seconds) and real-time factor (transcription time per second of audio over the last
+            REAL_TIME_FACTOR_WINDOW seconds; above 1, transcription falls behind).
+        """
+        now = time.monotonic()
+        with self.lock:
+            while self.recent_transcriptions and self.recent_transcriptions[0][0] < now - REAL_TIME_FACTOR_WINDOW:
+                self.recent_transcriptions.popleft()
+            transcription_seconds = sum(seconds for _, seconds, _ in self.recent_transcriptions)
+            audio_seconds = sum(seconds for _, _, seconds in self.recent_transcriptions)
+            oldest_capture = min((timings.capture_end for timings in self.pending), default=now)
+            return {
+                "queue_depth": self.counters["chunks_queued"] - self.counters["chunks_dequeued"],
+                "transcription_lag_seconds": now - oldest_capture,
+                "real_time_factor": transcription_seconds / audio_seconds if audio_seconds > 0 else 0.0,
+            }
+
+    def render(self):
+        """
+        :return: The metrics in the Prometheus text exposition format.
+        """
+        gauges = self.gauges()
+        lines = []
+        with self.lock:
+            for name, value in self.counters.items():
+                metric = f"{METRIC_PREFIX}{name}_total"
+                lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+            metric = f"{METRIC_PREFIX}chunks_dropped_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines += [f'{metric}{{reason="{reason}"}} {value}' for reason, value in self.dropped_chunks.items()]
+            for name, value in gauges.items():
+                metric = f"{METRIC_PREFIX}{name}"
+                lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+            for stage, (_, _, help_text) in self.stage_histograms.items():
+                lines += self.histograms[stage].render(f"{METRIC_PREFIX}chunk_{stage}_seconds", help_text)
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        :return: A one-line summary of the metrics, for the periodic log line.
+        """
+        gauges = self.gauges()
+        with self.lock:
+            end_to_end_p90 = self.histograms["end_to_end"].quantile(0.9)
+            return (
+                f"Metrics: {self.counters['chunks_written']} chunks transcribed, "
+                f"queue depth {gauges['queue_depth']}, "
+                f"lag {gauges['transcription_lag_seconds']:.1f} s, "
+                f"RTF {gauges['real_time_factor']:.2f}, "
+                f"p90 end-to-end latency {'over 60' if end_to_end_p90 is None else f'<= {end_to_end_p90}'} s, "
+                f"{self.counters['transcription_retries']} retries, "
+                f"{self.counters['transcription_failures']} failures, "
+                f"{sum(self.dropped_chunks.values())} dropped"
+            )
+
+
+class MetricsReporter:
+    def __init__(self, metrics, port=None, log_interval=None):
+        """
+        Initialize the reporter of pipeline metrics, which serves them over HTTP and prints a summary periodically.
+        :param metrics: The PipelineMetrics to report.
+        :param port: The port of the HTTP endpoint serving the metrics in the Prometheus text format at
+            http://127.0.0.1:<port>/metrics, or None to not serve them.
+        :param log_interval: The time between printed summaries in seconds, or None to not print them.
+        """
+        self.metrics = metrics
+        self.port = port
+        self.log_interval = log_interval
+        self.server = None
+        self.stopped = Event()
+
+    def start(self):
+        """
+        Start serving and printing the metrics, from background threads.
+        """
+        if self.port is not None:
+            self.server = ThreadingHTTPServer(("127.0.0.1", self.port), self.create_handler())
+            self.server.daemon_threads = True
+            Thread(target=self.server.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{self.server.server_port}/metrics"
+            CliInterface.print_info("Serving metrics at: " + CliInterface.colorize(url, bold=True))
+        if self.log_interval is not None:
+            Thread(target=self.log_metrics, daemon=True).start()
+
+    def create_handler(self):
+        """
+        :return: The request handler class of the HTTP endpoint.
+        """
+        metrics = self.metrics
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *_args):
+                pass  # Every scrape would otherwise be printed to the console
+
+        return MetricsHandler
+
+    def log_metrics(self):
+        """
+        Print a summary of the metrics every log_interval seconds, until stop is called.
+        """
+        while not self.stopped.wait(self.log_interval):
+            CliInterface.print_info(self.metrics.summary())
+
+    def stop(self):
+        """
+        Stop serving and printing the metrics.
+        """
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,127 @@
+import time
+from collections import deque
+from threading import Lock
+
+from src.config import ADAPTIVE_QUEUE_GROWTH, ADAPTIVE_STEP_DOWN_RTF, ADAPTIVE_STEP_UP_RTF, ADAPTIVE_WINDOW
+
+# Whisper's model families from the smallest to the largest, e.g. "small" for "small.en", "large" for "large-v3"
+MODEL_FAMILIES = ["tiny", "base", "small", "medium", "turbo", "large"]
+
+# Number of windows after which a model size found too slow is tried again, as the load of the machine may have changed
+RETRY_WINDOWS = 10
+
+
+def model_family(model_size):
+    """
+    :return: The family of a Whisper model size in MODEL_FAMILIES, or None if it is unknown.
+    """
+    name = model_size.removesuffix(".en")
+    family = "turbo" if name.endswith("turbo") else name.split("-")[0]
+    return family if family in MODEL_FAMILIES else None
+
+
+def check_model_sizes(model_sizes, initial_size):
+    """
+    Check the model sizes of ADAPTIVE_MODEL_SIZES, raising ValueError if they are not known Whisper model sizes ordered
+    from the smallest to the largest, or do not include MODEL_SIZE.
+    :param model_sizes: The model sizes to switch between.
+    :param initial_size: The model size to start with.
+    """
+    families = [model_family(model_size) for model_size in model_sizes]
+    if None in families:
+        unknown_size = model_sizes[families.index(None)]
+        raise ValueError(f"ADAPTIVE_MODEL_SIZES holds an unknown Whisper model size: {unknown_size!r}.")
+    ranks = [MODEL_FAMILIES.index(family) for family in families]
+    if any(rank >= next_rank for rank, next_rank in zip(ranks, ranks[1:])):
+        raise ValueError(
+            f"ADAPTIVE_MODEL_SIZES must list model sizes from the smallest to the largest, one per size: {model_sizes}."
+        )
+    if initial_size not in model_sizes:
+        raise ValueError(f"ADAPTIVE_MODEL_SIZES {model_sizes} must include MODEL_SIZE {initial_size!r}.")
+
+
+class ModelSelector:
+    def __init__(
+        self,
+        model_sizes,
+        initial_size,
+        window=ADAPTIVE_WINDOW,
+        step_down_rtf=ADAPTIVE_STEP_DOWN_RTF,
+        step_up_rtf=ADAPTIVE_STEP_UP_RTF,
+        queue_growth=ADAPTIVE_QUEUE_GROWTH,
+    ):
+        """
+        Initialize the ModelSelector, which picks the model size to transcribe with from the measured real-time factor
+        (transcription time per second of audio) and queue growth of the current model over a rolling window.
+        It steps down to the next smaller size when the current one falls behind, and up to the next larger size when
+        there is headroom. The gap between step_down_rtf and step_up_rtf, a full window of measurements before any
+        switch, and remembering the sizes that fell behind, keep it from switching back and forth.
+        :param model_sizes: The model sizes to choose from, from the smallest to the largest.
+        :param initial_size: The model size to start with, one of model_sizes. Raises ValueError otherwise, see
+            check_model_sizes.
+        :param window: The duration of the rolling window in seconds, and the minimum time between switches.
+        :param step_down_rtf: The real-time factor above which the next smaller size is used.
+        :param step_up_rtf: The real-time factor below which the next larger size is tried.
+        :param queue_growth: The number of chunks the queue must grow by over the window to step down, whatever the
+            real-time factor.
+        """
+        check_model_sizes(model_sizes, initial_size)
+        self.model_sizes = model_sizes
+        self.index = model_sizes.index(initial_size)
+        self.window = window
+        self.step_down_rtf = step_down_rtf
+        self.step_up_rtf = step_up_rtf
+        self.queue_growth = queue_growth
+        self.lock = Lock()
+        self.samples = deque()  # (time, transcription seconds, audio seconds, queue depth) with the current size
+        self.switch_time = time.monotonic()
+        self.too_slow = {}  # Time at which each size fell behind, by size
+
+    @property
+    def model_size(self):
+        """
+        The model size to transcribe with.
+        """
+        return self.model_sizes[self.index]
+
+    def record(self, model_size, transcription_seconds, audio_seconds, queue_depth):
+        """
+        Record a transcription and switch to another model size if needed.
+        :param model_size: The size of the model that transcribed, as measurements of other sizes are ignored.
+        :param transcription_seconds: The time spent transcribing.
+        :param audio_seconds: The duration of the transcribed audio.
+        :param queue_depth: The number of chunks waiting in the queue after the transcription.
+        :return: The new model size if it changed, None otherwise.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if model_size != self.model_size:
+                return None
+            self.samples.append((now, transcription_seconds, audio_seconds, queue_depth))
+            while self.samples[0][0] < now - self.window:
+                self.samples.popleft()
+            if now - self.switch_time < self.window:
+                return None
+            audio_seconds = sum(sample[2] for sample in self.samples)
+            if audio_seconds == 0:
+                return None
+            real_time_factor = sum(sample[1] for sample in self.samples) / audio_seconds
+            growth = self.samples[-1][3] - self.samples[0][3]
+            if (real_time_factor > self.step_down_rtf or growth >= self.queue_growth) and self.index > 0:
+                self.too_slow[self.model_size] = now
+                return self.switch(self.index - 1, now)
+            if real_time_factor < self.step_up_rtf and growth <= 0 and self.index < len(self.model_sizes) - 1:
+                fell_behind = self.too_slow.get(self.model_sizes[self.index + 1])
+                if fell_behind is None or now - fell_behind > RETRY_WINDOWS * self.window:
+                    return self.switch(self.index + 1, now)
+            return None
+
+    def switch(self, index, now):
+        """
+        Switch to another model size, starting a new window of measurements. Called with lock held.
+        :return: The new model size.
+        """
+        self.index = index
+        self.samples.clear()
+        self.switch_time = now
+        return self.model_size
@@ -0,0 +1,307 @@
+import json
+import os
+import socket
+import socketserver
+import struct
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+import numpy as np
+
+from src.cli_interface import CliInterface
+from src.config import TRANSCRIPTION_WORKERS
+from src.cpu_topology import configure_torch_threads, pin_current_thread, torch_thread_counts, transcription_affinity
+
+# Lengths of the JSON header and of the binary payload that start every message
+MESSAGE_PREFIX = struct.Struct("!II")
+
+
+def send_message(file, header, payload=b""):
+    """
+    Send a message made of a JSON header and a binary payload.
+    :param file: The binary file object of the socket.
+    :param header: The JSON-serializable header. NumPy scalars are converted to Python numbers.
+    :param payload: The binary payload (any bytes-like object).
+    """
+    header_data = json.dumps(header, default=lambda value: value.item()).encode()
+    file.write(MESSAGE_PREFIX.pack(len(header_data), len(payload)))
+    file.write(header_data)
+    file.write(payload)
+    file.flush()
+
+
+def receive_message(file):
+    """
+    Receive a message sent with send_message.
+    :param file: The binary file object of the socket.
+    :return: A tuple of the header and the payload.
+    """
+    prefix = read_exactly(file, MESSAGE_PREFIX.size)
+    header_length, payload_length = MESSAGE_PREFIX.unpack(prefix)
+    header = json.loads(read_exactly(file, header_length))
+    return header, read_exactly(file, payload_length)
+
+
+def read_exactly(file, size):
+    """
+    :return: The next size bytes read from a file object, raising ConnectionError if the connection is closed first.
+    """
+    data = file.read(size)
+    if len(data) < size:
+        raise ConnectionError("The connection was closed in the middle of a message.")
+    return data
+
+
+class ModelServer:
+    def __init__(self, socket_path):
+        """
+        Initialize a server that keeps Whisper models loaded and transcribes audio for local clients over a UNIX socket.
+        Models are loaded on first use and kept by model size, so any number of sessions can share them without
+        reloading them. The socket is only accessible to the user running the server.
+        :param socket_path: The path of the UNIX socket to listen on.
+        """
+        self.socket_path = os.path.expanduser(socket_path)
+        # Futures of the (model, lock) of each model size, resolved once loaded, with the model or the TranscriptionPool
+        # used in its place and the lock held while an in-process model transcribes
+        self.models = {}
+        self.models_lock = Lock()  # Held while models is read or written, not while a model loads
+        self.server = None
+
+    def get_model(self, model_size):
+        """
+        Get a loaded model, loading it first if needed. Requests for a model being loaded wait for it, without holding
+        up requests for the models already loaded. A model that fails to load is loaded again by the next request.
+        :param model_size: The size of the model.
+        :return: A tuple of the model and the lock to hold while it transcribes.
+        """
+        with self.models_lock:
+            model_future = self.models.get(model_size)
+            loading = model_future is None
+            if loading:
+                model_future = self.models[model_size] = Future()
+        if loading:
+            try:
+                model_future.set_result((self.load_model(model_size), Lock()))
+            except Exception as e:
+                with self.models_lock:
+                    del self.models[model_size]
+                model_future.set_exception(e)
+        return model_future.result()
+
+    @staticmethod
+    def load_model(model_size):
+        """
+        Load a model, or start a TranscriptionPool in its place if TRANSCRIPTION_WORKERS > 1.
+        :param model_size: The size of the model.
+        :return: The model or the TranscriptionPool.
+        """
+        CliInterface.print_info("Loading Whisper model: " + CliInterface.colorize(model_size, bold=True))
+        if TRANSCRIPTION_WORKERS > 1:
+            from src.transcription_pool import TranscriptionPool
+
+            return TranscriptionPool(model_size, TRANSCRIPTION_WORKERS)
+        from src.quantization import load_whisper_model
+
+        configure_torch_threads(*torch_thread_counts(1))
+        return load_whisper_model(model_size)
+
+    def transcribe(self, model_size, audios, options):
+        """
+        Transcribe audio chunks with the model of the given size, in one batch if there are several of them.
+        :param model_size: The size of the model.
+        :param audios: The audio chunks as float32 NumPy arrays sampled at 16 kHz, or paths to audio files.
+        :param options: The keyword arguments passed to the model's transcribe method.
+        :return: The list of transcription results.
+        """
+        model, model_lock = self.get_model(model_size)
+        if TRANSCRIPTION_WORKERS > 1:
+            if len(audios) == 1:
+                return [model.transcribe(audios[0], **options)]
+            return model.transcribe_batch(audios, **options)
+        with model_lock:
+            if len(audios) == 1:
+                return [model.transcribe(audios[0], **options)]
+            from src.batch_transcription import transcribe_batch
+
+            return transcribe_batch(model, audios, **options)
+
+    def language_probabilities(self, model_size, audio):
+        """
+        Detect the language of audio with the model of the given size.
+        :param model_size: The size of the model.
+        :param audio: The audio as a float32 NumPy array sampled at 16 kHz.
+        :return: A dictionary of the probability of each language, by language code.
+        """
+        model, model_lock = self.get_model(model_size)
+        if TRANSCRIPTION_WORKERS > 1:
+            return model.language_probabilities(audio)
+        with model_lock:
+            from src.language_detector import language_probabilities
+
+            return language_probabilities(model, audio)
+
+    def handle_connection(self, rfile, wfile):
+        """
+        Answer the requests of a client until it closes the connection.
+        A "ping" request starts loading the requested model in the background, if it names one, and a "transcribe"
+        request returns the results of its audio chunks, sent as consecutive float32 arrays, or an error message if it
+        fails. A "detect_language" request returns the language probabilities of its audio, sent as a float32 array.
+        :param rfile: The binary file object to read requests from.
+        :param wfile: The binary file object to write responses to.
+        """
+        try:
+            while True:
+                request, payload = receive_message(rfile)
+                if request["command"] == "ping":
+                    if request.get("model_size") is not None:
+                        Thread(target=self.get_model, args=(request["model_size"],), daemon=True).start()
+                    send_message(wfile, {"status": "ok"})
+                elif request["command"] == "detect_language":
+                    send_message(wfile, self.detect_language_request(request, payload))
+                else:
+                    send_message(wfile, self.transcribe_request(request, payload))
+        except ConnectionError:
+            return  # The client closed the connection
+
+    def transcribe_request(self, request, payload):
+        """
+        :return: The response to a "transcribe" request, with its results or the error message if it failed.
+        """
+        try:
+            if "audio_paths" in request:
+                audios = request["audio_paths"]
+            else:
+                samples = np.frombuffer(payload, dtype=np.float32)
+                audios = np.split(samples, np.cumsum(request["audio_lengths"])[:-1])
+            return {"results": self.transcribe(request["model_size"], audios, request["options"])}
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    def detect_language_request(self, request, payload):
+        """
+        :return: The response to a "detect_language" request, with its probabilities or the error message if it failed.
+        """
+        try:
+            audio = np.frombuffer(payload, dtype=np.float32)
+            return {"probabilities": self.language_probabilities(request["model_size"], audio)}
+        except Exception as e:
+            return {"error": f"{type(e).__name__}: {e}"}
+
+    def serve_forever(self):
+        """
+        Listen on the UNIX socket and answer clients, each connection in its own thread, until stop is called.
+        """
+        os.makedirs(os.path.dirname(self.socket_path), mode=0o700, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            if ModelServerClient(self.socket_path, None).ping():
+                raise RuntimeError(f"A model server is already listening on {self.socket_path}.")
+            os.remove(self.socket_path)  # Left behind by a server that did not exit cleanly
+        model_server = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                pin_current_thread(transcription_affinity())
+                model_server.handle_connection(self.rfile, self.wfile)
+
+        old_umask = os.umask(0o177)  # Create the socket accessible to the current user only
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, RequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.server.daemon_threads = True
+        CliInterface.print_info("Model server listening on: " + CliInterface.colorize(self.socket_path, bold=True))
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.socket_path)
+
+    def stop(self):
+        """
+        Stop serve_forever, from another thread.
+        """
+        self.server.shutdown()
+
+
+class ModelServerClient:
+    def __init__(self, socket_path, model_size):
+        """
+        Initialize a client of a ModelServer. It can be used in place of a Whisper model: transcribe calls from several
+        threads each use their own connection.
+        :param socket_path: The path of the server's UNIX socket.
+        :param model_size: The size of the model to transcribe with, or None for a client that only pings the server.
+        """
+        self.socket_path = os.path.expanduser(socket_path)
+        self.model_size = model_size
+
+    def ping(self):
+        """
+        Check that the server is running, and have it start loading the model if the client has a model size and the
+        model is not loaded yet.
+        :return: True if the server answered.
+        """
+        request = {"command": "ping"}
+        if self.model_size is not None:
+            request["model_size"] = self.model_size
+        try:
+            self.request(request)
+            return True
+        except (OSError, ConnectionError):
+            return False
+
+    def transcribe(self, audio, **options):
+        """
+        Transcribe audio with the server's model, blocking until the result is available.
+        :param audio: The audio as a float32 NumPy array sampled at 16 kHz, or the path to an audio file.
+        :param options: The keyword arguments passed to the model's transcribe method.
+        :return: The transcription result.
+        """
+        return self.transcribe_batch([audio], **options)[0]
+
+    def transcribe_batch(self, audios, **options):
+        """
+        Transcribe several audio chunks in one batch with the server's model, blocking until the results are available.
+        :param audios: The audio chunks as float32 NumPy arrays sampled at 16 kHz, or paths to audio files.
+        :param options: The keyword arguments passed to the model's transcribe method.
+        :return: The list of transcription results.
+        """
+        request = {"command": "transcribe", "model_size": self.model_size, "options": options}
+        if all(isinstance(audio, str) for audio in audios):
+            request["audio_paths"] = audios
+            payload = b""
+        else:
+            request["audio_lengths"] = [len(audio) for audio in audios]
+            payload = np.concatenate([np.asarray(audio, dtype=np.float32) for audio in audios]).tobytes()
+        response = self.request(request, payload)
+        if "error" in response:
+            raise RuntimeError(f"The model server failed to transcribe: {response['error']}")
+        return response["results"]
+
+    def language_probabilities(self, audio):
+        """
+        Detect the language of audio with the server's model, blocking until the result is available.
+        :param audio: The audio as a float32 NumPy array sampled at 16 kHz.
+        :return: A dictionary of the probability of each language, by language code.
+        """
+        request = {"command": "detect_language", "model_size": self.model_size}
+        response = self.request(request, np.asarray(audio, dtype=np.float32).tobytes())
+        if "error" in response:
+            raise RuntimeError(f"The model server failed to detect the language: {response['error']}")
+        return response["probabilities"]
+
+    def request(self, request, payload=b""):
+        """
+        Send a request to the server on a new connection.
+        :return: The header of the server's response.
+        """
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(self.socket_path)
+            with connection.makefile("rwb") as file:
+                send_message(file, request, payload)
+                response, _ = receive_message(file)
+        return response
+
+    def shutdown(self):
+        """
+        Nothing to stop: the server keeps its models loaded for the next sessions.
+        """
@@ -0,0 +1,191 @@
+import os
+
+import numpy as np
+import pyaudio
+
+from src.audio_utils import find_supported_sample_rates, preferred_sample_rate
+from src.cli_interface import CliInterface, start_pause_message
+from src.config import FRAMES_PER_BUFFER
+
+
+class AudioSource:
+    def __init__(self, label, device_index, channel, sample_rate):
+        """
+        Initialize an audio source: one channel of an input device, transcribed on its own.
+        :param label: The name of the source, labelling its results and its output file.
+        :param device_index: The index of the input device.
+        :param channel: The channel of the device to capture, 0 for the first.
+        :param sample_rate: The sample rate to capture the device at, the same for every source of the device.
+        """
+        self.label = label
+        self.device_index = device_index
+        self.channel = channel
+        self.sample_rate = sample_rate
+
+
+def source_output_path(output_file_path, label):
+    """
+    :return: The path of the output file of a source, e.g. "results.alice.json" for "results.json".
+    """
+    base, extension = os.path.splitext(output_file_path)
+    return f"{base}.{label}{extension}"
+
+
+def find_input_device(device_infos, device):
+    """
+    Find an input device by index or by name.
+    :param device_infos: The information of every audio device, by device index.
+    :param device: The index of the device, or a case-insensitive part of its name matching only one input device.
+    :return: The index of the device.
+    """
+    if isinstance(device, int):
+        if 0 <= device < len(device_infos) and device_infos[device].get("maxInputChannels") > 0:
+            return device
+        raise ValueError(f"There is no input device with index {device}.")
+    matches = [
+        index
+        for index, info in enumerate(device_infos)
+        if info.get("maxInputChannels") > 0 and device.lower() in info.get("name").lower()
+    ]
+    if len(matches) != 1:
+        names = ", ".join(device_infos[index].get("name") for index in matches)
+        raise ValueError(f'"{device}" matches {len(matches)} input devices' + (f": {names}." if names else "."))
+    return matches[0]
+
+
+def resolve_audio_sources(pyaudio_instance, device_infos, device_cache, source_configs):
+    """
+    Resolve the configured audio sources (see AUDIO_SOURCES) to devices, channels and sample rates. Each device is
+    captured at the rate picked by preferred_sample_rate, its supported rates being probed once and cached.
+    :param pyaudio_instance: The PyAudio instance.
+    :param device_infos: The information of every audio device, by device index.
+    :param device_cache: The DeviceCache of the devices' supported sample rates.
+    :param source_configs: A list of dictionaries with the "label", "device" and optional "channel" of each source.
+    :return: The list of AudioSources. Raises ValueError if a source is invalid.
+    """
+    sources = []
+    sample_rates = {}  # Sample rate of each device, by device index
+    for source_config in source_configs:
+        label = source_config["label"]
+        if any(source.label == label for source in sources):
+            raise ValueError(f'Several audio sources are labelled "{label}".')
+        device_index = find_input_device(device_infos, source_config["device"])
+        channel = source_config.get("channel", 0)
+        channel_count = device_infos[device_index].get("maxInputChannels")
+        if not 0 <= channel < channel_count:
+            raise ValueError(f'The device of audio source "{label}" has no channel {channel}, only {channel_count}.')
+        if device_index not in sample_rates:
+            supported_rates = device_cache.get_sample_rates(device_index)
+            if supported_rates is None:
+                supported_rates = find_supported_sample_rates(pyaudio_instance, device_index)
+                device_cache.set_sample_rates(device_index, supported_rates)
+            if not supported_rates:
+                raise ValueError(f'No supported sample rates found for the device of audio source "{label}".')
+            sample_rates[device_index] = preferred_sample_rate(supported_rates)
+        sources.append(AudioSource(label, device_index, channel, sample_rates[device_index]))
+    device_cache.save()
+    return sources
+
+
+class MultiSourceRecorder:
+    def __init__(self, pyaudio_instance, sources, audio_processors):
+        """
+        Initialize the MultiSourceRecorder, which records several audio sources at the same time, in place of an
+        AudioRecorder. Each device is opened as one stream, whose channels are split between the AudioProcessors of
+        its sources.
+        :param pyaudio_instance: The PyAudio instance.
+        :param sources: The AudioSources to record.
+        :param audio_processors: The AudioProcessor of each source, in the same order.
+        """
+        self.pyaudio_instance = pyaudio_instance
+        self.audio_processors = audio_processors
+        self.devices = {}  # (sample rate, [(channel, AudioProcessor)]) of each device, by device index
+        for source, audio_processor in zip(sources, audio_processors):
+            _, channel_processors = self.devices.setdefault(source.device_index, (source.sample_rate, []))
+            channel_processors.append((source.channel, audio_processor))
+        self.recording = False
+        self.streams = []
+
+    def toggle_recording(self):
+        """
+        Toggle the recording state of every source.
+        """
+        if self.recording:
+            self.pause_recording()
+            print(CliInterface.colorize("\r\n\u23f8", bold=True) + " Recording paused. " + start_pause_message)
+        else:
+            self.start_recording()
+            print(CliInterface.colorize("\r\n\u25cf", red=True) + " Recording started. " + start_pause_message)
+
+    def start_recording(self):
+        """
+        Start recording every source, opening one stream per device. If a device cannot be opened, none is recorded.
+        """
+        if self.recording:
+            return
+        CliInterface.print_info("Initializing recording...")
+        try:
+            for device_index, (sample_rate, channel_processors) in self.devices.items():
+                channel_count = max(channel for channel, _ in channel_processors) + 1
+                stream = self.pyaudio_instance.open(
+                    format=pyaudio.paInt16,
+                    channels=channel_count,
+                    rate=sample_rate,
+                    input=True,
+                    input_device_index=device_index,
+                    frames_per_buffer=FRAMES_PER_BUFFER,
+                    stream_callback=self.create_callback(channel_count, channel_processors),
+                )
+                self.streams.append(stream)
+                stream.start_stream()
+        except Exception:
+            self.close_streams()
+            raise
+        self.recording = True
+
+    @staticmethod
+    def create_callback(channel_count, channel_processors):
+        """
+        :param channel_count: The number of channels of the stream.
+        :param channel_processors: The (channel, AudioProcessor) of each source of the stream.
+        :return: The callback of the stream, passing each channel's audio to the AudioProcessor of its source.
+        """
+
+        def callback(in_data, frame_count, time_info, status):
+            if channel_count == 1:
+                for _, audio_processor in channel_processors:
+                    audio_processor.audio_callback(in_data, frame_count, time_info, status)
+                return (None, pyaudio.paContinue)
+            frames = np.frombuffer(in_data, dtype=np.int16).reshape(-1, channel_count)
+            for channel, audio_processor in channel_processors:
+                audio_processor.audio_callback(frames[:, channel].tobytes(), frame_count, time_info, status)
+            return (None, pyaudio.paContinue)
+
+        return callback
+
+    def close_streams(self):
+        """
+        Stop and close the open streams.
+        """
+        for stream in self.streams:
+            stream.stop_stream()
+            stream.close()
+        self.streams = []
+
+    def pause_recording(self, stop=False):
+        """
+        Pause recording every source, and wait for the transcription of the audio recorded so far.
+        :param stop: Whether the recording is being stopped.
+        """
+        CliInterface.print_info(
+            "Pausing recording... wait for processing to complete"
+            if not stop
+            else "Stopping recording... wait for processing to complete"
+        )
+        if self.recording:
+            self.close_streams()
+            for audio_processor in self.audio_processors:
+                audio_processor.finalize_recording()
+            self.recording = False
+        for audio_processor in self.audio_processors:
+            audio_processor.wait_for_processing()
@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+
+from src.audio_utils import WHISPER_SAMPLE_RATE
+from src.cli_interface import CliInterface
+from src.config import PARTIAL_INTERVAL, PARTIAL_MODEL_SIZE, TRANSCRIPTION_WORKERS
+from src.cpu_topology import pin_current_thread, transcription_affinity
+from src.whisper_service import load_transcription_model
+
+# Minimum duration of speech worth a partial transcription (in seconds)
+MIN_PARTIAL_DURATION = 0.5
+
+
+class PartialTranscriber:
+    def __init__(self, audio_processor, model_size=PARTIAL_MODEL_SIZE, interval=PARTIAL_INTERVAL):
+        """
+        Initialize the PartialTranscriber, the fast first pass of two-pass streaming transcription.
+        Every interval seconds, the speech segment being captured is transcribed with a small model, from its start to
+        the latest captured audio, and the text is appended to the results as a partial result. Once the segment ends,
+        the AudioProcessor queues it for the configured model, whose final result replaces the partial ones.
+        :param audio_processor: The AudioProcessor segmenting the captured audio, with voice activity detection.
+        :param model_size: The size of the model transcribing the partial results, loaded in the background.
+        :param interval: The time between partial transcriptions in seconds.
+        """
+        self.audio_processor = audio_processor
+        self.whisper_transcription = audio_processor.whisper_transcription
+        self.interval = interval
+        model_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="partial-model-loader")
+        self.model_future = model_loader.submit(load_transcription_model, model_size)
+        model_loader.shutdown(wait=False)
+        self.stopped = Event()
+        self.thread = Thread(target=self.run)
+        self.last_transcribed = None  # (sequence, sample count) of the last partial transcription
+
+    def start(self):
+        """
+        Start transcribing partial results in a background thread.
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop transcribing partial results, waiting for the current transcription to finish, and stop the model's
+        worker processes if any.
+        """
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+        if TRANSCRIPTION_WORKERS > 1 and self.model_future.exception() is None:
+            self.model_future.result().shutdown()
+
+    def run(self):
+        """
+        Transcribe the open speech segment every interval seconds, once the model is loaded, until stop is called.
+        Runs in the background thread.
+        """
+        pin_current_thread(transcription_affinity())
+        while not self.stopped.wait(self.interval):
+            if not self.model_future.done():
+                continue
+            if self.model_future.exception() is not None:
+                CliInterface.print_error(self.model_future.exception())
+                CliInterface.print_warning("Partial results are disabled, the partial model could not be loaded.")
+                return
+            try:
+                self.transcribe_open_segment()
+            except Exception as e:
+                CliInterface.print_error(e)
+
+    def transcribe_open_segment(self):
+        """
+        Transcribe the speech segment being captured, if it grew since its last partial transcription, and append the
+        text as a partial result unless the segment ended in the meantime, its final result being on its way.
+        """
+        open_segment = self.audio_processor.open_segment()
+        if open_segment is None:
+            return
+        sequence, audio = open_segment
+        if len(audio) < MIN_PARTIAL_DURATION * WHISPER_SAMPLE_RATE or self.last_transcribed == (sequence, len(audio)):
+            return
+        self.last_transcribed = (sequence, len(audio))
+        # Word timestamps are only needed for the final results, and cost a second pass over the audio
+        options = {**self.whisper_transcription.transcription_options(), "word_timestamps": False}
+        result = self.model_future.result().transcribe(audio, **options)
+        # The segment's final result is written once it is queued, which increments next_sequence, so checking it with
+        # the results lock held keeps the partial result from being written after the final one
+        self.whisper_transcription.append_partial_result(
+            result["text"], sequence, lambda: self.audio_processor.next_sequence == sequence
+        )
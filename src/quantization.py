@@ -0,0 +1,75 @@
+import os
+import tempfile
+
+import torch
+import whisper
+from torch.ao.quantization import quantize_dynamic
+
+from src.cli_interface import CliInterface
+from src.config import QUANTIZE_INT8, QUANTIZED_MODEL_CACHE_DIR
+
+
+def load_whisper_model(model_size):
+    """
+    Load a Whisper model, quantized to int8 if QUANTIZE_INT8 is set.
+    :param model_size: The size of the model to load.
+    :return: The Whisper model.
+    """
+    if QUANTIZE_INT8:
+        return load_quantized_model(model_size, QUANTIZED_MODEL_CACHE_DIR)
+    return whisper.load_model(model_size)
+
+
+def quantize_model(model):
+    """
+    Quantize the linear layers of a Whisper model to int8, in place.
+    Weights are quantized once, and activations are quantized on the fly at every call with their own range, so no
+    calibration data is needed. The other layers (embeddings, convolutions, layer norms) stay in float32.
+    :param model: The Whisper model, on the CPU, as quantized layers only run there.
+    :return: The quantized model.
+    """
+    for module in model.modules():
+        # Whisper subclasses Linear to cast weights to the input's data type, but quantize_dynamic only replaces modules
+        # of the exact types it is given, so they are quantized as plain Linear layers
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+    return quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def quantized_model_path(cache_dir, model_size):
+    """
+    :return: The path of the cached quantized model of a size. The path holds the torch and whisper versions, as the
+        saved model can only be loaded by the versions that saved it.
+    """
+    file_name = f"{model_size}-int8-torch{torch.__version__}-whisper{whisper.__version__}.pt"
+    return os.path.join(os.path.expanduser(cache_dir), file_name)
+
+
+def load_quantized_model(model_size, cache_dir):
+    """
+    Load the quantized model of a size from the cache, or load and quantize the Whisper model and save it to the cache.
+    The whole model is saved rather than its state dict, as rebuilding a quantized model to load a state dict into
+    costs as much time as quantizing the original one. Loading it unpickles classes, so the cache directory is only
+    accessible to the current user.
+    :param model_size: The size of the model.
+    :param cache_dir: The directory of the cached quantized models.
+    :return: The quantized Whisper model, on the CPU.
+    """
+    path = quantized_model_path(cache_dir, model_size)
+    if os.path.exists(path):
+        try:
+            return torch.load(path, weights_only=False)
+        except Exception as e:
+            CliInterface.print_warning(f"Could not load the quantized model cache, quantizing the model again: {e}")
+
+    CliInterface.print_info("Quantizing Whisper model to int8: " + CliInterface.colorize(model_size, bold=True))
+    model = quantize_model(whisper.load_model(model_size, device="cpu"))
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        # Write to a temporary file first, so that an interrupted save does not leave a truncated model in the cache
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=".tmp", delete=False) as file:
+            torch.save(model, file)
+        os.replace(file.name, path)
+    except OSError as e:
+        CliInterface.print_warning(f"Could not save the quantized model cache: {e}")
+    return model
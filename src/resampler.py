@@ -0,0 +1,79 @@
+from math import gcd
+
+import numpy as np
+
+
+class PolyphaseResampler:
+    def __init__(self, input_rate, output_rate, taps_per_phase=48, block_size=16384):
+        """
+        Initialize a streaming polyphase resampler converting audio from input_rate to output_rate.
+        The resampler keeps its filter history and phase between calls, so an audio stream can be fed in chunks of any
+        size and the output is the same as if the whole stream had been resampled at once.
+        :param input_rate: The sample rate of the input audio.
+        :param output_rate: The sample rate of the output audio.
+        :param taps_per_phase: The number of filter taps applied to each output sample.
+        :param block_size: The maximum number of output samples computed at once, to bound temporary memory use.
+        """
+        divisor = gcd(input_rate, output_rate)
+        self.input_rate = input_rate
+        self.output_rate = output_rate
+        self.up = output_rate // divisor
+        self.down = input_rate // divisor
+        self.taps_per_phase = taps_per_phase
+        self.block_size = block_size
+        self.phase_filters = self.design_phase_filters()
+        self.tap_offsets = np.arange(taps_per_phase)
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the filter history and phase, to start resampling a new audio stream.
+        """
+        self.history = np.zeros(self.taps_per_phase - 1, dtype=np.float32)
+        # Position of the next output sample in the upsampled domain, relative to the start of the next input block
+        self.position = 0
+
+    def design_phase_filters(self):
+        """
+        Design the Kaiser-windowed sinc low-pass filter and split it into one sub-filter per phase.
+        :return: A float32 array of shape (up, taps_per_phase); row p holds the taps applied for phase p.
+        """
+        length = self.taps_per_phase * self.up
+        cutoff = 0.5 / max(self.up, self.down)
+        n = np.arange(length) - (length - 1) / 2
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, 8.0)
+        prototype *= self.up / prototype.sum()
+        return prototype.reshape(self.taps_per_phase, self.up).T.astype(np.float32)
+
+    def process(self, samples):
+        """
+        Resample the next block of a mono audio stream.
+        :param samples: The input samples as a float32 NumPy array.
+        :return: The resampled samples as a float32 NumPy array.
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if self.up == self.down:
+            return samples
+        extended = np.concatenate((self.history, samples))
+        input_length = len(samples) * self.up
+        output_length = max(0, -(-(input_length - self.position) // self.down))
+        output = np.empty(output_length, dtype=np.float32)
+        for start in range(0, output_length, self.block_size):
+            end = min(start + self.block_size, output_length)
+            positions = self.position + np.arange(start, end, dtype=np.int64) * self.down
+            indices = positions // self.up + (self.taps_per_phase - 1)
+            frames = extended[indices[:, None] - self.tap_offsets]
+            output[start:end] = np.einsum("ij,ij->i", frames, self.phase_filters[positions % self.up])
+        self.position += output_length * self.down - input_length
+        history_start = len(samples)
+        self.history = extended[history_start:].copy()
+        return output
+
+    def flush(self):
+        """
+        Push the samples still held in the filter history through the filter, at the end of an audio stream.
+        :return: The remaining resampled samples as a float32 NumPy array.
+        """
+        output = self.process(np.zeros(self.taps_per_phase // 2, dtype=np.float32))
+        self.reset()
+        return output
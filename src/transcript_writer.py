@@ -0,0 +1,137 @@
+import json
+import os
+import time
+
+
+def stream_path_for(output_file_path):
+    """
+    :return: The path of the JSON Lines stream of results finalized into output_file_path.
+    """
+    return os.path.splitext(output_file_path)[0] + ".jsonl"
+
+
+def read_records(path):
+    """
+    Read the records of a JSON Lines stream.
+    A last line cut short by a crash is skipped, so a stream can always be read back.
+    :param path: The path of the stream.
+    :return: A generator of the records, in the order they were written.
+    """
+    with open(path) as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                if line.endswith("\n"):
+                    raise
+
+
+def build_transcription_output(path, raw, include_words):
+    """
+    Build the transcription output from the results streamed by a TranscriptWriter.
+    Partial results are left out, as they are replaced by the final results of the same chunks.
+    :param path: The path of the stream.
+    :param raw: Whether to output the raw Whisper results instead of the full text and words.
+    :param include_words: Whether to include the words of the segments, when raw is False.
+    :return: The list of results if raw, otherwise a dictionary with the full text and the list of words, the list
+        of overloads if any audio was dropped or transcribed with a downgraded model, and the list of detected languages
+        if the session language was detected. Each overload holds the position in the full text where it occurred, and
+        each language the position from which it was used, as text_offset.
+    """
+    results = [record for record in read_records(path) if record.get("status") != "partial"]
+    if raw:
+        return results
+    texts = []
+    words = []
+    overloads = []
+    languages = []
+    text_length = 0
+    for result in results:
+        if "overload" in result:
+            overloads.append({**result["overload"], "text_offset": text_length})
+        if "language_probability" in result:
+            # Keep the latest probability of each language, as it covers the most detected audio
+            if languages and languages[-1]["language"] == result["language"]:
+                languages[-1]["probability"] = result["language_probability"]
+            else:
+                language = {"language": result["language"], "probability": result["language_probability"]}
+                languages.append({**language, "text_offset": text_length})
+        texts.append(result["text"])
+        text_length += len(result["text"])
+        if include_words:
+            words += [word for segment in result.get("segments", []) for word in segment.get("words", [])]
+    output = {
+        "full_text": "".join(texts),
+        "words": words,
+    }
+    if overloads:
+        output["overloads"] = overloads
+    if languages:
+        output["languages"] = languages
+    return output
+
+
+class TranscriptWriter:
+    def __init__(self, path, fsync_interval):
+        """
+        Initialize an append-only writer streaming transcription results to a JSON Lines file, one result per line.
+        Each result is written and flushed to the operating system as soon as it is appended, so a crash of the
+        application loses nothing, and a power loss at most fsync_interval seconds of results. The file is only created
+        when the first result is appended.
+        :param path: The path of the stream.
+        :param fsync_interval: The minimum time between fsync calls in seconds, 0 to sync after every result, or None
+            to leave syncing to the operating system.
+        """
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.file = None
+        self.record_count = 0
+        self.last_sync_time = time.monotonic()
+
+    def open(self):
+        """
+        Open the stream for appending. When a new stream is started, the stream left by a session that did not finish is
+        kept, renamed with an ".interrupted" suffix.
+        """
+        if self.record_count == 0 and os.path.exists(self.path):
+            os.replace(self.path, self.path + ".interrupted")
+        self.file = open(self.path, "a")
+
+    def append(self, record):
+        """
+        Write a record to the stream.
+        :param record: The JSON-serializable record. NumPy scalars are converted to Python numbers.
+        """
+        if self.file is None:
+            self.open()
+        self.file.write(json.dumps(record, default=lambda value: value.item()) + "\n")
+        self.file.flush()
+        self.record_count += 1
+        if self.fsync_interval is not None and time.monotonic() - self.last_sync_time >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """
+        Make the operating system write the stream to disk.
+        """
+        os.fsync(self.file.fileno())
+        self.last_sync_time = time.monotonic()
+
+    def close(self):
+        """
+        Sync and close the stream. Records can still be appended afterwards, to the same stream.
+        """
+        if self.file is None:
+            return
+        self.sync()
+        self.file.close()
+        self.file = None
+
+    def remove(self):
+        """
+        Close and delete the stream, once its results have been output.
+        """
+        self.close()
+        if self.record_count > 0:
+            os.remove(self.path)
+        self.record_count = 0
@@ -0,0 +1,136 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from src.cpu_topology import configure_torch_threads, pin_current_thread, torch_thread_counts, transcription_affinity
+
+# Whisper model loaded by the initializer of each worker process
+worker_model = None
+
+# Barrier shared by the worker processes, passed to the initializer, which the warm-up tasks wait on
+worker_barrier = None
+
+
+def load_worker_model(model_size, intra_op_threads, inter_op_threads, cores, barrier=None):
+    """
+    Load the Whisper model in a worker process. Used as the initializer of the process pool.
+    :param model_size: The size of the model to load.
+    :param intra_op_threads: The number of intra-op threads torch may use in the worker process, or None for all cores.
+    :param inter_op_threads: The number of inter-op threads torch may use in the worker process, or None for all cores.
+    :param cores: The CPU cores to pin the worker process to, or None to leave it unrestricted.
+    :param barrier: The barrier of the pool's workers, waited on by wait_for_workers.
+    """
+    global worker_model, worker_barrier
+    from src.quantization import load_whisper_model
+
+    worker_barrier = barrier
+    pin_current_thread(cores)
+    configure_torch_threads(intra_op_threads, inter_op_threads)
+    worker_model = load_whisper_model(model_size)
+
+
+def wait_for_workers():
+    """
+    Wait until every worker process of the pool has loaded its model. Submitted once per worker when the pool starts:
+    a worker waiting here cannot take another of these tasks, so the pool has to start every worker to run them.
+    """
+    worker_barrier.wait()
+
+
+def transcribe_in_worker(audio, options):
+    """
+    Transcribe audio with the model of the current worker process.
+    :param audio: The audio as a float32 NumPy array sampled at 16 kHz, or the path to an audio file.
+    :param options: The keyword arguments passed to the model's transcribe method.
+    :return: The transcription result.
+    """
+    return worker_model.transcribe(audio, **options)
+
+
+def transcribe_batch_in_worker(audios, options):
+    """
+    Transcribe several audio chunks in one batch with the model of the current worker process.
+    :param audios: The audio chunks as float32 NumPy arrays sampled at 16 kHz.
+    :param options: The keyword arguments passed to the model's transcribe method.
+    :return: The list of transcription results.
+    """
+    from src.batch_transcription import transcribe_batch
+
+    return transcribe_batch(worker_model, audios, **options)
+
+
+def language_probabilities_in_worker(audio):
+    """
+    Detect the language of audio with the model of the current worker process.
+    :param audio: The audio as a float32 NumPy array sampled at 16 kHz.
+    :return: A dictionary of the probability of each language, by language code.
+    """
+    from src.language_detector import language_probabilities
+
+    return language_probabilities(worker_model, audio)
+
+
+class TranscriptionPool:
+    def __init__(self, model_size, worker_count):
+        """
+        Initialize a pool of worker processes, each holding its own copy of the Whisper model, and wait until every
+        worker has loaded it, as the process pool only starts workers when work is submitted.
+        The pool can be used in place of a Whisper model: transcribe calls from several threads run in parallel, one per
+        worker process. The CPU cores left to transcription are split evenly between the workers' torch thread pools
+        (see TORCH_INTRA_OP_THREADS), and the workers are pinned to them if CPU_AFFINITY is set.
+        :param model_size: The size of the model to load in each worker.
+        :param worker_count: The number of worker processes.
+        """
+        self.worker_count = worker_count
+        # Spawn fresh interpreters, as forking a process running audio and torch threads is not safe
+        context = multiprocessing.get_context("spawn")
+        self.executor = ProcessPoolExecutor(
+            max_workers=worker_count,
+            mp_context=context,
+            initializer=load_worker_model,
+            initargs=(
+                model_size,
+                *torch_thread_counts(worker_count),
+                transcription_affinity(),
+                context.Barrier(worker_count),
+            ),
+        )
+        warm_up_futures = [self.executor.submit(wait_for_workers) for _ in range(worker_count)]
+        try:
+            for future in warm_up_futures:
+                future.result()
+        except Exception:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def transcribe(self, audio, **options):
+        """
+        Transcribe audio in one of the worker processes, blocking until the result is available.
+        :param audio: The audio as a float32 NumPy array sampled at 16 kHz, or the path to an audio file.
+        :param options: The keyword arguments passed to the model's transcribe method.
+        :return: The transcription result.
+        """
+        return self.executor.submit(transcribe_in_worker, audio, options).result()
+
+    def transcribe_batch(self, audios, **options):
+        """
+        Transcribe several audio chunks in one batch in one of the worker processes, blocking until the results are
+        available.
+        :param audios: The audio chunks as float32 NumPy arrays sampled at 16 kHz.
+        :param options: The keyword arguments passed to the model's transcribe method.
+        :return: The list of transcription results.
+        """
+        return self.executor.submit(transcribe_batch_in_worker, audios, options).result()
+
+    def language_probabilities(self, audio):
+        """
+        Detect the language of audio in one of the worker processes, blocking until the result is available.
+        :param audio: The audio as a float32 NumPy array sampled at 16 kHz.
+        :return: A dictionary of the probability of each language, by language code.
+        """
+        return self.executor.submit(language_probabilities_in_worker, audio).result()
+
+    def shutdown(self):
+        """
+        Stop the worker processes once their current work is done.
+        """
+        self.executor.shutdown(wait=True)
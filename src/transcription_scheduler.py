@@ -0,0 +1,87 @@
+import time
+from itertools import count
+from threading import Condition, local
+
+
+class TranscriptionScheduler:
+    def __init__(self, slots=1):
+        """
+        Initialize the TranscriptionScheduler, which shares a model between the WhisperServices of several audio
+        sources, giving each source an equal share of the model's time.
+        A source waiting for the model gets it before the sources that used it for longer, so a source with a backlog
+        cannot hold back the others: while several sources wait, their chunks are interleaved. A source that was idle
+        resumes at the usage of the busiest ones rather than at its own, so it cannot save up model time to use later.
+        :param slots: The number of transcriptions the model runs at the same time, e.g. TRANSCRIPTION_WORKERS for a
+            TranscriptionPool, or 1 for an in-process model.
+        """
+        self.slots = slots
+        self.condition = Condition()
+        self.running = 0  # Number of turns in progress
+        self.usage = {}  # Model time used by each source in seconds
+        self.virtual_time = 0.0  # Usage of the source of the latest turn, to which idle sources catch up
+        self.waiting = []  # (arrival, source) of the turns waiting for the model
+        self.arrivals = count()
+
+    def acquire(self, source):
+        """
+        Wait for the turn of a source to use the model.
+        :param source: The label of the audio source.
+        """
+        with self.condition:
+            self.usage[source] = max(self.usage.get(source, 0.0), self.virtual_time)
+            request = (next(self.arrivals), source)
+            self.waiting.append(request)
+            while self.running >= self.slots or self.next_request() != request:
+                self.condition.wait()
+            self.waiting.remove(request)
+            self.running += 1
+            self.virtual_time = max(self.virtual_time, self.usage[source])
+            # Another slot may be free for the next request
+            self.condition.notify_all()
+
+    def release(self, source, seconds):
+        """
+        End the turn of a source, and hand the model to the next one.
+        :param source: The label of the audio source.
+        :param seconds: The time the source used the model for.
+        """
+        with self.condition:
+            self.usage[source] += seconds
+            self.running -= 1
+            self.condition.notify_all()
+
+    def next_request(self):
+        """
+        :return: The waiting request of the source with the least usage, the earliest one for equal usage. Called with
+            condition held.
+        """
+        return min(self.waiting, key=lambda request: (self.usage[request[1]], request[0]))
+
+    def source_lock(self, source):
+        """
+        :param source: The label of the audio source.
+        :return: A SourceLock taking the turns of the source, to pass as the model_lock of its WhisperService.
+        """
+        return SourceLock(self, source)
+
+
+class SourceLock:
+    def __init__(self, scheduler, source):
+        """
+        Initialize a lock-like context manager, which waits for the turn of an audio source to use the shared model
+        when entered, and measures how long the source used it until exited. Threads hold their turns independently.
+        :param scheduler: The TranscriptionScheduler.
+        :param source: The label of the audio source.
+        """
+        self.scheduler = scheduler
+        self.source = source
+        self.turn = local()  # Start time of the calling thread's turn
+
+    def __enter__(self):
+        self.scheduler.acquire(self.source)
+        self.turn.start_time = time.monotonic()
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.scheduler.release(self.source, time.monotonic() - self.turn.start_time)
+        return False
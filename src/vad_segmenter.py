@@ -0,0 +1,154 @@
+import math
+
+import numpy as np
+
+
+class VadSegmenter:
+    def __init__(
+        self,
+        sample_rate,
+        energy_threshold_db=-45,
+        max_zero_crossing_rate=0.4,
+        min_segment_duration=0.3,
+        max_segment_duration=15,
+        hangover_duration=0.5,
+        preroll_duration=0.2,
+        frame_duration=0.03,
+    ):
+        """
+        Initialize a streaming voice activity detection (VAD) segmenter.
+        Audio is split into short frames, and a frame holds speech when its energy is above energy_threshold_db and
+        its zero-crossing rate is below max_zero_crossing_rate (broadband noise crosses zero far more often than voiced
+        speech). A segment starts at the first speech frame, with preroll_duration of audio before it, and ends once
+        hangover_duration of non-speech has followed the last speech frame.
+        :param sample_rate: The sample rate of the audio.
+        :param energy_threshold_db: The frame energy above which a frame can hold speech, in dB relative to full scale.
+        :param max_zero_crossing_rate: The fraction of zero crossings per sample below which a frame can hold speech.
+        :param min_segment_duration: Segments holding less speech than this, in seconds, are dropped as noise.
+        :param max_segment_duration: Segments are cut when they reach this duration in seconds.
+        :param hangover_duration: The duration of non-speech, in seconds, that ends a segment.
+        :param preroll_duration: The duration of audio before the first speech frame added to a segment, in seconds.
+        :param frame_duration: The duration of an analysis frame in seconds.
+        """
+        self.sample_rate = sample_rate
+        self.energy_threshold_db = energy_threshold_db
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+        self.frame_size = int(sample_rate * frame_duration)
+        self.min_speech_frames = math.ceil(min_segment_duration / frame_duration)
+        self.max_segment_frames = max(1, int(max_segment_duration / frame_duration))
+        self.hangover_frames = max(1, math.ceil(hangover_duration / frame_duration))
+        self.preroll_frames = min(int(preroll_duration / frame_duration), self.max_segment_frames - 1)
+        self.segment = np.empty(self.max_segment_frames * self.frame_size, dtype=np.float32)
+        self.preroll = np.empty((self.preroll_frames, self.frame_size), dtype=np.float32)
+        self.dropped_segments = 0  # Number of segments dropped for holding too little speech
+        self.reset()
+
+    def reset(self):
+        """
+        Discard the current segment and any buffered audio, to start segmenting a new audio stream.
+        """
+        self.remainder = np.empty(0, dtype=np.float32)
+        self.segment_frames = 0
+        self.speech_frames = 0
+        self.silence_frames = 0
+        self.preroll_count = 0
+
+    def classify_frames(self, frames):
+        """
+        Decide which frames hold speech, from their energy and zero-crossing rate.
+        :param frames: A float32 array of shape (frame count, frame size).
+        :return: A boolean array with one value per frame, True for speech.
+        """
+        energy_db = 10 * np.log10(np.mean(np.square(frames), axis=1) + 1e-12)
+        zero_crossing_rate = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+        return (energy_db > self.energy_threshold_db) & (zero_crossing_rate < self.max_zero_crossing_rate)
+
+    def process(self, samples):
+        """
+        Segment the next block of a mono audio stream.
+        :param samples: The audio samples as a float32 NumPy array.
+        :return: A list of the segments completed by this block, each a float32 NumPy array.
+        """
+        samples = np.concatenate((self.remainder, samples))
+        frame_count = len(samples) // self.frame_size
+        frames_end = frame_count * self.frame_size
+        frames = samples[:frames_end].reshape(frame_count, self.frame_size)
+        self.remainder = samples[frames_end:].copy()
+
+        segments = []
+        for frame, is_speech in zip(frames, self.classify_frames(frames)):
+            if self.segment_frames == 0:
+                if is_speech:
+                    self.start_segment()
+                else:
+                    self.add_preroll_frame(frame)
+                    continue
+            self.add_segment_frame(frame)
+            if is_speech:
+                self.speech_frames += 1
+                self.silence_frames = 0
+            else:
+                self.silence_frames += 1
+            if self.silence_frames >= self.hangover_frames or self.segment_frames == self.max_segment_frames:
+                self.close_segment(segments)
+        return segments
+
+    def flush(self):
+        """
+        Close the current segment at the end of an audio stream.
+        :return: A list holding the last segment, or an empty list if it holds too little speech.
+        """
+        segments = []
+        if self.segment_frames > 0:
+            self.close_segment(segments)
+        self.reset()
+        return segments
+
+    def current_segment(self):
+        """
+        :return: The audio of the segment being captured, as a view of the segment buffer that stays valid until the
+            next call to process, or an empty array between segments.
+        """
+        end = self.segment_frames * self.frame_size
+        return self.segment[:end]
+
+    def add_preroll_frame(self, frame):
+        """
+        Keep a non-speech frame as preroll for the next segment, overwriting the oldest preroll frame.
+        """
+        if self.preroll_frames == 0:
+            return
+        self.preroll[self.preroll_count % self.preroll_frames] = frame
+        self.preroll_count += 1
+
+    def start_segment(self):
+        """
+        Start a segment with the preroll frames, in the order they were captured.
+        """
+        available = min(self.preroll_count, self.preroll_frames)
+        for i in range(self.preroll_count - available, self.preroll_count):
+            self.add_segment_frame(self.preroll[i % self.preroll_frames])
+        self.preroll_count = 0
+
+    def add_segment_frame(self, frame):
+        """
+        Copy a frame to the end of the current segment.
+        """
+        start = self.segment_frames * self.frame_size
+        end = start + self.frame_size
+        self.segment[start:end] = frame
+        self.segment_frames += 1
+
+    def close_segment(self, segments):
+        """
+        End the current segment, adding a copy of it to segments if it holds enough speech.
+        :param segments: The list of completed segments.
+        """
+        if self.speech_frames >= self.min_speech_frames:
+            end = self.segment_frames * self.frame_size
+            segments.append(self.segment[:end].copy())
+        else:
+            self.dropped_segments += 1
+        self.segment_frames = 0
+        self.speech_frames = 0
+        self.silence_frames = 0
@@ -0,0 +1,63 @@
+import numpy as np
+
+# Duration of the frames of a volume envelope (in seconds), the resolution of word volumes
+VOLUME_FRAME_DURATION = 0.02
+
+
+def energy_to_db(energy, sample_count):
+    """
+    Convert the energy of audio samples to their RMS volume in decibels, on the scale of 16-bit sample values.
+    :param energy: The sum of the squared float samples, a number or a NumPy array.
+    :param sample_count: The number of samples, a number or a NumPy array of the same shape.
+    :return: The volume in decibels, -inf where there are no samples or they are all silent.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_square = np.where(sample_count > 0, energy / np.maximum(sample_count, 1), 0)
+        return 10 * np.log10(mean_square) + 20 * np.log10(32768)
+
+
+class VolumeEnvelope:
+    def __init__(self, samples, sample_rate, frame_duration=VOLUME_FRAME_DURATION):
+        """
+        Initialize the volume envelope of an audio chunk, from one pass over its samples, to get the volume of any part
+        of the chunk without reading the samples again.
+        The energy (sum of squared samples) of each frame is accumulated, so the volume between two frame boundaries is
+        the difference of two cumulative sums, for any number of intervals at once.
+        :param samples: The audio samples as a float32 NumPy array.
+        :param sample_rate: The sample rate of the audio.
+        :param frame_duration: The duration of the frames in seconds.
+        """
+        self.frame_duration = frame_duration
+        frame_size = max(1, int(sample_rate * frame_duration))
+        frame_count = -(-len(samples) // frame_size)
+        squares = np.square(samples, dtype=np.float64)
+        # The last frame may be shorter, so sample counts are accumulated along with energies
+        frame_energies = np.add.reduceat(squares, np.arange(0, len(samples), frame_size)) if len(samples) > 0 else []
+        self.cumulative_energy = np.concatenate(([0.0], np.cumsum(frame_energies)))
+        self.cumulative_samples = np.minimum(np.arange(frame_count + 1) * frame_size, len(samples))
+
+    @property
+    def volume_db(self):
+        """
+        The volume of the whole audio chunk in decibels.
+        """
+        return float(energy_to_db(self.cumulative_energy[-1], self.cumulative_samples[-1]))
+
+    def volumes_db(self, starts, ends):
+        """
+        Calculate the volumes of intervals of the audio chunk, such as words, rounded out to whole frames. An interval
+        shorter than a frame gets the volume of the frame holding its start, and intervals are clipped to the chunk.
+        :param starts: The start times of the intervals in seconds, relative to the start of the chunk.
+        :param ends: The end times of the intervals in seconds.
+        :return: A NumPy array of the volumes of the intervals in decibels.
+        """
+        frame_count = len(self.cumulative_samples) - 1
+        if frame_count == 0:
+            return np.full(len(starts), -np.inf)
+        first_frames = np.clip(np.floor(np.asarray(starts, dtype=np.float64) / self.frame_duration), 0, frame_count - 1)
+        end_frames = np.ceil(np.asarray(ends, dtype=np.float64) / self.frame_duration)
+        first_frames = first_frames.astype(np.int64)
+        end_frames = np.clip(end_frames, first_frames + 1, frame_count).astype(np.int64)
+        energies = self.cumulative_energy[end_frames] - self.cumulative_energy[first_frames]
+        sample_counts = self.cumulative_samples[end_frames] - self.cumulative_samples[first_frames]
+        return energy_to_db(energies, sample_counts)
@@ -1,110 +1,486 @@
 import json
 import os
 import time
-
-import whisper
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import nullcontext
+from threading import Lock
 
 from src.cli_interface import CliInterface
 from src.config import (
     LANGUAGE_CODE,
     MAX_RETRIES,
+    MODEL_SERVER_SOCKET_PATH,
     MODEL_SIZE,
     OUTPUT_FILE_PATH,
     OUTPUT_RAW_TRANSCRIPTION,
     PRINT_TO_FILE,
     PROMPT,
     TASK,
+    TRANSCRIPT_FSYNC_INTERVAL,
+    TRANSCRIPTION_WORKERS,
+    USE_MODEL_SERVER,
 )
+from src.cpu_topology import configure_torch_threads, pin_current_thread, torch_thread_counts, transcription_affinity
+from src.language_detector import LanguageDetector, language_probabilities
+from src.metrics import PipelineMetrics
+from src.model_selector import ModelSelector
+from src.model_server import ModelServerClient
+from src.transcript_writer import TranscriptWriter, build_transcription_output, stream_path_for
+from src.transcription_pool import TranscriptionPool
+from src.volume_envelope import VolumeEnvelope
+
+
+def load_transcription_model(model_size=None):
+    """
+    Connect to the model server if USE_MODEL_SERVER is set and it is running. Otherwise load the Whisper model, or
+    start a pool of worker processes each holding its own copy if TRANSCRIPTION_WORKERS > 1.
+    whisper and torch are imported here rather than with this module, as importing them takes seconds.
+    :param model_size: The size of the model to load, MODEL_SIZE if not given.
+    :return: The Whisper model, or the ModelServerClient or TranscriptionPool used in its place.
+    """
+    model_size = MODEL_SIZE if model_size is None else model_size
+    if USE_MODEL_SERVER:
+        client = ModelServerClient(MODEL_SERVER_SOCKET_PATH, model_size)
+        if client.ping():
+            CliInterface.print_info("Using the model server's Whisper model: " + CliInterface.colorize(model_size, bold=True))
+            return client
+
+    from src.quantization import load_whisper_model
+
+    CliInterface.print_info("Loading Whisper model: " + CliInterface.colorize(model_size, bold=True))
+    if TRANSCRIPTION_WORKERS > 1:
+        CliInterface.print_info(f"Starting {TRANSCRIPTION_WORKERS} transcription worker processes")
+        return TranscriptionPool(model_size, TRANSCRIPTION_WORKERS)
+    # Threads started while loading, such as torch's thread pool, inherit the pinning
+    pin_current_thread(transcription_affinity())
+    configure_torch_threads(*torch_thread_counts(1))
+    return load_whisper_model(model_size)
 
 
 class WhisperService:
-    def __init__(self):
+    def __init__(
+        self,
+        model=None,
+        model_lock=None,
+        output_file_path=None,
+        metrics=None,
+        fallback_model_size=None,
+        print_results=False,
+        adaptive_model_sizes=None,
+        source=None,
+        result_callback=None,
+        spool=None,
+    ):
+        """
+        Initialize the WhisperService, which transcribes audio chunks and collects their results.
+        :param model: A model returned by load_transcription_model, or a Future of one still loading, to share it with
+            other services. If not given, the service starts loading its own model in a background thread, and stops
+            it in shutdown. Audio chunks can be queued for transcription right away; they are transcribed once the
+            model is ready.
+        :param model_lock: A lock held while the model transcribes, for an in-process model shared with other services,
+            as it can only run one transcription at a time, or the SourceLock of a TranscriptionScheduler.
+        :param output_file_path: The path of the file to write the results to. If not given, the results are written
+            to OUTPUT_FILE_PATH if PRINT_TO_FILE is set, and printed otherwise.
+        :param metrics: The PipelineMetrics recording the chunks' timings and the transcription counters, to share them
+            with other services. If not given, the service records its own.
+        :param fallback_model_size: The size of a faster model to transcribe with while downgraded is set, loaded in the
+            background after the model. If not given, the model is always used.
+        :param print_results: Whether to print the text of the results as they are appended, for live captioning.
+        :param adaptive_model_sizes: The model sizes to switch between depending on transcription speed, from the
+            smallest to the largest, including MODEL_SIZE (see ModelSelector), loaded in the background after the model.
+            Only used when the service loads its own model. If not given, the model size does not change.
+        :param source: The label of the audio source, added to every result, to the output and to printed results, or
+            None for a single source.
+        :param result_callback: A function called with each result as it is appended, in capture order, e.g. to send
+            it to a client, or None.
+        :param spool: The AudioSpool the chunks are appended to before they are transcribed, in which they are marked as
+            transcribed, or as kept if they were not transcribed, once their results are written, or None.
+        """
+        self.owns_model = model is None
+        model_loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-loader")
+        if model is None:
+            self.model_future = model_loader.submit(load_transcription_model)
+        elif isinstance(model, Future):
+            self.model_future = model
+        else:
+            self.model_future = Future()
+            self.model_future.set_result(model)
+        self.fallback_model_size = fallback_model_size
+        self.fallback_model_future = (
+            None if fallback_model_size is None else model_loader.submit(load_transcription_model, fallback_model_size)
+        )
+        self.model_selector = None
+        self.adaptive_model_futures = {}  # Models to switch between, by size
+        if adaptive_model_sizes and self.owns_model:
+            self.model_selector = ModelSelector(adaptive_model_sizes, MODEL_SIZE)
+            for model_size in adaptive_model_sizes:
+                self.adaptive_model_futures[model_size] = (
+                    self.model_future
+                    if model_size == MODEL_SIZE
+                    else model_loader.submit(load_transcription_model, model_size)
+                )
+        model_loader.shutdown(wait=False)
+        self.downgraded = False  # Set while transcription cannot keep up, to use the fallback model
+        self.language_detector = None if LANGUAGE_CODE else LanguageDetector()
+        self.print_results = print_results
+        self.source = source
+        self.result_callback = result_callback
+        self.spool = spool
+        self.model_lock = nullcontext() if model_lock is None else model_lock
+        self.output_file_path = output_file_path
+        self.metrics = PipelineMetrics() if metrics is None else metrics
+        # Results with volumes are streamed to disk in capture order as they arrive, rather than kept in memory
+        self.transcript_writer = TranscriptWriter(
+            stream_path_for(OUTPUT_FILE_PATH if output_file_path is None else output_file_path), TRANSCRIPT_FSYNC_INTERVAL
+        )
+        self.pending_results = {}  # Results waiting for the results of earlier chunks, by sequence number
+        self.next_sequence = 0  # Sequence number of the next result to append to results
+        self.results_lock = Lock()
+        self.active_tasks = 0  # Number of chunks being transcribed, updated under active_tasks_lock
+        self.active_tasks_lock = Lock()
+
+    @property
+    def model(self):
         """
-        Initialize the WhisperTranscription with the given model size and sample rate.
-        :param model_size: The size of the model to use for transcription.
-        :param chosen_sample_rate: The sample rate chosen for recording.
+        The Whisper model, or the TranscriptionPool used in its place, waiting for it to finish loading if needed.
+        Raises the loading error if the model could not be loaded.
         """
-        CliInterface.print_info("Loading Whisper model: " + CliInterface.colorize(MODEL_SIZE, bold=True))
-        self.model = whisper.load_model(MODEL_SIZE)
-        self.results = []  # Accumulate transcription results with volumes
-        self.active_tasks = 0
+        return self.model_future.result()
 
-    def transcribe_audio_chunk(self, temp_file_path, volume_db):
+    def transcription_model(self):
         """
-        Transcribe an audio chunk from a temporary file.
-        :param temp_file_path: The path to the temporary file containing the audio chunk.
-        :param volume_db: The volume of the audio chunk in decibels.
+        Choose the model to transcribe with: the fallback model while downgraded is set and it is loaded, otherwise the
+        model size picked by model_selector once it is loaded, otherwise the model.
+        :return: A tuple of the model, of its size, and of the overload information added to its results, or None if
+            there is no overload.
         """
-        self.active_tasks += 1
+        fallback_model_future = self.fallback_model_future
+        if self.downgraded and fallback_model_future is not None and fallback_model_future.done():
+            if fallback_model_future.exception() is None:
+                overload = {"reason": "downgraded", "model_size": self.fallback_model_size}
+                return fallback_model_future.result(), self.fallback_model_size, overload
+        if self.model_selector is not None:
+            model_size = self.model_selector.model_size
+            model_future = self.adaptive_model_futures[model_size]
+            if model_future.done() and model_future.exception() is None:
+                return model_future.result(), model_size, None
+        return self.model, MODEL_SIZE, None
+
+    def transcribe_audio_chunk(self, audio, volume, sequence=None, timings=None):
+        """
+        Transcribe an audio chunk. Several chunks can be transcribed at once from different threads.
+        :param audio: The audio chunk as a float32 NumPy array sampled at 16 kHz, or the path to a temporary WAV file
+            containing it. A temporary file is removed once the transcription is done, whether it succeeded or not.
+        :param volume: The VolumeEnvelope of the audio chunk, or its volume in decibels.
+        :param sequence: The sequence number of the audio chunk in capture order, see append_transcription_result.
+        :param timings: The ChunkTimings of the audio chunk, or None if it is not tracked by the metrics.
+        """
+        with self.active_tasks_lock:
+            self.active_tasks += 1
         attempt = 0
-        while attempt < MAX_RETRIES:
+        result = None
+        try:
+            self.metrics.transcription_started([timings])
+            start_time = time.monotonic()
+            while attempt < MAX_RETRIES:
+                try:
+                    model, model_size, overload = self.transcription_model()
+                    attempt_start_time = time.monotonic()
+                    with self.model_lock:
+                        self.detect_language(model, [audio], [timings])
+                        result = model.transcribe(audio, **self.transcription_options())
+                    self.annotate_results([result], model_size, overload, [timings])
+                    self.record_language([result], [timings])
+                    self.adapt_model_size(model_size, time.monotonic() - attempt_start_time, [timings])
+                    break
+                except Exception as e:
+                    CliInterface.print_error(e)
+                    CliInterface.print_warning(f"Retrying transcription attempt {attempt + 1}...")
+                    self.metrics.count("transcription_retries")
+                    time.sleep(1)  # Adding delay between retries
+                    attempt += 1
+            if attempt == MAX_RETRIES:
+                CliInterface.print_error("Failed to transcribe audio chunk.")
+                self.metrics.count("transcription_failures")
+            self.metrics.transcription_finished([timings], time.monotonic() - start_time)
+            self.append_transcription_result(result, volume, sequence, timings)  # Append result with volume
+        finally:
+            if isinstance(audio, str):
+                os.remove(audio)  # Clean up the temporary file
+            with self.active_tasks_lock:
+                self.active_tasks -= 1
+
+    def transcribe_audio_batch(self, chunks):
+        """
+        Transcribe several audio chunks in one batch, sharing the model's per-call work between them.
+        The results are the same as transcribing the chunks one by one, which is done instead, with retries, if the
+        batch fails.
+        :param chunks: A list of (audio, volume, sequence, timings) tuples, as passed to transcribe_audio_chunk, with
+            the audio as float32 NumPy arrays.
+        """
+        with self.active_tasks_lock:
+            self.active_tasks += len(chunks)
+        audios = [audio for audio, _, _, _ in chunks]
+        chunk_timings = [timings for _, _, _, timings in chunks]
+        self.metrics.transcription_started(chunk_timings)
+        start_time = time.monotonic()
+        try:
+            model, model_size, overload = self.transcription_model()
+            with self.model_lock:
+                self.detect_language(model, audios, chunk_timings)
+                # A TranscriptionPool or ModelServerClient batches in the process holding the model
+                if hasattr(model, "transcribe_batch"):
+                    results = model.transcribe_batch(audios, **self.transcription_options())
+                else:
+                    # Imported here as it imports whisper and torch, see load_transcription_model
+                    from src import batch_transcription
+
+                    results = batch_transcription.transcribe_batch(model, audios, **self.transcription_options())
+            self.annotate_results(results, model_size, overload, chunk_timings)
+            self.record_language(results, chunk_timings)
+        except Exception as e:
+            CliInterface.print_error(e)
+            CliInterface.print_warning("Batch transcription failed, transcribing the audio chunks one by one...")
+            self.metrics.count("transcription_retries")
+            results = None
+        finally:
+            with self.active_tasks_lock:
+                self.active_tasks -= len(chunks)
+
+        if results is None:
+            for audio, volume, sequence, timings in chunks:
+                self.transcribe_audio_chunk(audio, volume, sequence, timings)
+            return
+        self.metrics.transcription_finished(chunk_timings, time.monotonic() - start_time)
+        self.adapt_model_size(model_size, time.monotonic() - start_time, chunk_timings)
+        for (_, volume, sequence, timings), result in zip(chunks, results):
+            self.append_transcription_result(result, volume, sequence, timings)
+
+    def annotate_results(self, results, model_size, overload, chunk_timings):
+        """
+        Record in transcription results which model size produced them, and whether they were degraded by an overload,
+        such as a downgrade to a faster model.
+        :param results: The transcription results.
+        :param model_size: The size of the model that produced them.
+        :param overload: The overload information returned by transcription_model, or None if there was no overload.
+        :param chunk_timings: The ChunkTimings of the chunks, for their duration, None for chunks that are not tracked.
+        """
+        for result, timings in zip(results, chunk_timings):
+            result["model_size"] = model_size
+            if overload is not None:
+                result["overload"] = {**overload, "duration": None if timings is None else timings.duration}
+        if overload is not None:
+            self.metrics.count("chunks_downgraded", len(results))
+
+    def detect_language(self, model, audios, chunk_timings):
+        """
+        Detect the session language on audio chunks about to be transcribed, while language_detector needs more audio.
+        Called with model_lock held. If detection fails, the chunks are transcribed with the language detected so far,
+        or Whisper detects the language of each chunk itself.
+        :param model: The model about to transcribe the chunks.
+        :param audios: The audio chunks, as float32 NumPy arrays or paths to WAV files, which are left to Whisper.
+        :param chunk_timings: The ChunkTimings of the chunks, for their duration, None for chunks that are not tracked.
+        """
+        if self.language_detector is None:
+            return
+        for audio, timings in zip(audios, chunk_timings):
+            if isinstance(audio, str) or timings is None or not self.language_detector.needs_detection(timings.duration):
+                continue
             try:
-                result = self.model.transcribe(
-                    temp_file_path,
-                    word_timestamps=True if TASK == "transcribe" else False,
-                    language=LANGUAGE_CODE,
-                    prompt=PROMPT,
-                    task=TASK,
-                )
-                os.remove(temp_file_path)  # Clean up the temporary file
-                self.append_transcription_result(result, volume_db)  # Append result with volume
-                break
+                # A TranscriptionPool or ModelServerClient detects in the process holding the model
+                if hasattr(model, "language_probabilities"):
+                    probabilities = model.language_probabilities(audio)
+                else:
+                    probabilities = language_probabilities(model, audio)
             except Exception as e:
                 CliInterface.print_error(e)
-                CliInterface.print_warning(f"Retrying transcription attempt {attempt + 1}...")
-                time.sleep(1)  # Adding delay between retries
-                attempt += 1
-        if attempt == MAX_RETRIES:
-            CliInterface.print_error("Failed to transcribe audio chunk.")
+                CliInterface.print_warning("Language detection failed.")
+                return
+            if self.language_detector.add_detection(probabilities, timings.duration):
+                language = self.language_detector.language
+                probability = self.language_detector.probability
+                CliInterface.print_info(f"Detected language: {CliInterface.colorize(language, bold=True)} ({probability:.0%})")
 
-        self.active_tasks -= 1
+    def record_language(self, results, chunk_timings):
+        """
+        Record in transcription results the probability of the session language they were transcribed in, and let
+        language_detector check the language again if their confidence is low.
+        :param results: The transcription results.
+        :param chunk_timings: The ChunkTimings of the chunks, for their duration, None for chunks that are not tracked.
+        """
+        if self.language_detector is None:
+            return
+        for result, timings in zip(results, chunk_timings):
+            if result.get("language") == self.language_detector.language:
+                result["language_probability"] = self.language_detector.probability
+            if timings is not None:
+                self.language_detector.record_result(result, timings.duration)
+
+    def adapt_model_size(self, model_size, transcription_seconds, chunk_timings):
+        """
+        Let model_selector switch to another model size if transcription falls behind or has headroom.
+        :param model_size: The size of the model that transcribed the chunks.
+        :param transcription_seconds: The time spent transcribing the chunks.
+        :param chunk_timings: The ChunkTimings of the chunks, for their duration, None for chunks that are not tracked.
+        """
+        if self.model_selector is None:
+            return
+        audio_seconds = sum(timings.duration for timings in chunk_timings if timings is not None)
+        if audio_seconds == 0:
+            return
+        queue_depth = self.metrics.gauges()["queue_depth"]
+        new_model_size = self.model_selector.record(model_size, transcription_seconds, audio_seconds, queue_depth)
+        if new_model_size is None:
+            return
+        model_sizes = self.model_selector.model_sizes
+        if model_sizes.index(new_model_size) < model_sizes.index(model_size):
+            CliInterface.print_warning(f"Transcription is falling behind, switching to the {new_model_size} model.")
+        else:
+            CliInterface.print_info(f"Transcription has headroom, switching to the {new_model_size} model.")
 
-    def append_transcription_result(self, result, volume_db):
+    def skip_audio_chunk(self, duration, sequence=None, timings=None):
         """
-        Append a transcription result and its volume to the list of results.
-        :param result: The result of the transcription.
-        :param volume_db: The volume of the audio chunk in decibels.
+        Record an audio chunk dropped without being transcribed, as a result without text marking the gap.
+        :param duration: The duration of the audio chunk in seconds.
+        :param sequence: The sequence number of the audio chunk in capture order, see append_transcription_result.
+        :param timings: The ChunkTimings of the audio chunk, or None if it is not tracked by the metrics.
         """
-        if TASK == "transcribe":
-            for segment in result.get("segments", []):
-                for word in segment.get("words", []):
-                    word["volume_db"] = volume_db
-        self.results.append(result)
+        result = {"text": "", "segments": [], "overload": {"reason": "dropped", "duration": duration}}
+        self.append_transcription_result(result, None, sequence, timings)
 
-    def output_transcription_results(self):
+    def transcription_options(self):
+        """
+        :return: The keyword arguments passed to the model's transcribe method. Without LANGUAGE_CODE, the language is the
+            one detected for the session, or None for Whisper to detect the language of each chunk until it is detected.
+        """
+        return {
+            "word_timestamps": True if TASK == "transcribe" else False,
+            "language": LANGUAGE_CODE if self.language_detector is None else self.language_detector.language,
+            "prompt": PROMPT,
+            "task": TASK,
+        }
+
+    def append_transcription_result(self, result, volume, sequence=None, timings=None):
+        """
+        Append a transcription result and its volume to the results streamed by transcript_writer, marked as final and
+        with its sequence number, to replace the partial results of the chunk, if any (see append_partial_result).
+        Results with a sequence number are appended in sequence order: a result that arrives before the results of
+        earlier chunks waits in pending_results until they have all arrived.
+        :param result: The result of the transcription, or None if the audio chunk could not be transcribed.
+        :param volume: The VolumeEnvelope of the audio chunk, from which the volume of each word is calculated, or the
+            volume of the audio chunk in decibels, given to every word.
+        :param sequence: The sequence number of the audio chunk, or None to append the result right away.
+        :param timings: The ChunkTimings of the audio chunk, or None if it is not tracked by the metrics.
+        """
+        if result is not None:
+            result["status"] = "final"
+            if sequence is not None:
+                result["sequence"] = sequence
+            if self.source is not None:
+                result["source"] = self.source
+        if result is not None and TASK == "transcribe":
+            words = [word for segment in result.get("segments", []) for word in segment.get("words", [])]
+            if isinstance(volume, VolumeEnvelope):
+                volumes_db = volume.volumes_db([word["start"] for word in words], [word["end"] for word in words])
+            else:
+                volumes_db = [volume] * len(words)
+            for word, volume_db in zip(words, volumes_db):
+                word["volume_db"] = float(volume_db)
+        with self.results_lock:
+            if sequence is None:
+                self.write_transcription_result(result, timings)
+                return
+            self.pending_results[sequence] = (result, timings)
+            while self.next_sequence in self.pending_results:
+                self.write_transcription_result(*self.pending_results.pop(self.next_sequence), self.next_sequence)
+                self.next_sequence += 1
+
+    def write_transcription_result(self, result, timings, sequence=None):
+        """
+        Append a transcription result to the stream, in capture order. Called with results_lock held.
+        :param result: The result of the transcription, or None if the audio chunk could not be transcribed.
+        :param timings: The ChunkTimings of the audio chunk, or None if it is not tracked by the metrics.
+        :param sequence: The sequence number of the audio chunk, to mark it in the spool, or None.
+        """
+        if result is not None:
+            self.transcript_writer.append(result)
+            if self.print_results and result["text"].strip():
+                CliInterface.print_transcript(result["text"], source=self.source)
+            if self.result_callback is not None:
+                self.result_callback(result)
+        if self.spool is not None and sequence is not None:
+            # Chunks dropped by the overload policy, or that could not be transcribed, are kept to be replayed
+            if result is None or result.get("overload", {}).get("reason") == "dropped":
+                self.spool.mark_kept(sequence)
+            else:
+                self.spool.mark_transcribed(sequence)
+        if timings is not None:
+            self.metrics.chunk_written(timings)
+
+    def append_partial_result(self, text, sequence, is_open=None):
+        """
+        Append a partial transcription of an audio chunk still being captured to the results streamed by
+        transcript_writer, right away. It is superseded by any later result with the same sequence number: the next
+        partial result, or the chunk's final result.
+        :param text: The text transcribed so far.
+        :param sequence: The sequence number the audio chunk will be queued with.
+        :param is_open: A function returning whether the chunk is still being captured, called with results_lock held,
+            so that the chunk's final result cannot be written between the check and the append, or None.
+        :return: True if the partial result was appended, False if the chunk was no longer open.
+        """
+        record = {"status": "partial", "sequence": sequence, "text": text}
+        if self.source is not None:
+            record["source"] = self.source
+        with self.results_lock:
+            if is_open is not None and not is_open():
+                return False
+            self.transcript_writer.append(record)
+        if self.print_results:
+            CliInterface.print_transcript(text, partial=True, source=self.source)
+        return True
+
+    def shutdown(self):
+        """
+        Stop the transcription worker processes, if any and if the service started them.
+        """
+        if not self.owns_model or TRANSCRIPTION_WORKERS == 1:
+            return
+        model_futures = {self.model_future, self.fallback_model_future, *self.adaptive_model_futures.values()}
+        for model_future in model_futures - {None}:
+            if model_future.exception() is None:
+                model_future.result().shutdown()
+
+    def output_transcription_results(self, final=True):
         """
         Output the full transcription results, including the full text and information about each word.
+        The output is built from the streamed results, and the stream is removed once the output is written.
+        :param final: Whether the session is over. If False, the output is written from the results so far, and the
+            stream is kept for the results still to come.
         """
-        if self.results.__len__() == 0:
+        if final:
+            self.transcript_writer.close()
+        if self.transcript_writer.record_count == 0:
             CliInterface.print_warning("No transcription results to output.")
             return
-        if OUTPUT_RAW_TRANSCRIPTION:
-            output = self.results
-        else:
-            full_text = "".join([result["text"] for result in self.results])
-            words = (
-                [
-                    word
-                    for result in self.results
-                    for segment in result.get("segments", [])
-                    for word in segment.get("words", [])
-                ]
-                if TASK == "transcribe"
-                else []
-            )
-            output = {
-                "full_text": full_text,
-                "words": words,
-            }
+        output = build_transcription_output(
+            self.transcript_writer.path, raw=OUTPUT_RAW_TRANSCRIPTION, include_words=TASK == "transcribe"
+        )
+        if self.source is not None and not OUTPUT_RAW_TRANSCRIPTION:
+            output = {"source": self.source, **output}
 
         json_output = json.dumps(output, indent=4)
 
-        if PRINT_TO_FILE:
-            with open(OUTPUT_FILE_PATH, "w") as file:
+        output_file_path = self.output_file_path
+        if output_file_path is None and PRINT_TO_FILE:
+            output_file_path = OUTPUT_FILE_PATH
+        if output_file_path is not None:
+            with open(output_file_path, "w") as file:
                 file.write(json_output)
             CliInterface.print_info(
-                "Transcription results have been written to: " + CliInterface.colorize(OUTPUT_FILE_PATH, bold=True)
+                "Transcription results have been written to: " + CliInterface.colorize(output_file_path, bold=True)
             )
         else:
             CliInterface.print_info("Transcription results:")
             print(json_output)
+        if final:
+            self.transcript_writer.remove()
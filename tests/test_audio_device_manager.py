@@ -2,42 +2,114 @@ import pytest
 
 from src.audio_device_manager import AudioDeviceManager
 
+DEVICE_INFOS = [
+    {"name": "Speakers", "hostApi": 0, "maxInputChannels": 0, "defaultSampleRate": 48000.0},
+    {"name": "USB Microphone", "hostApi": 0, "maxInputChannels": 1, "defaultSampleRate": 44100.0},
+]
+
 
 @pytest.fixture
-def audio_device_manager(mocker):
-    mock_choose_device = mocker.patch("src.audio_device_manager.choose_audio_device")
-    mock_find_rates = mocker.patch("src.audio_device_manager.find_supported_sample_rates")
-    mock_choose_rate = mocker.patch("src.audio_device_manager.choose_sample_rate")
+def device_mocks(mocker, tmp_path):
+    mocker.patch("src.audio_device_manager.CliInterface")
+    mocker.patch("src.audio_device_manager.DEVICE_CACHE_PATH", str(tmp_path / "devices.json"))
+    mocker.patch("src.audio_device_manager.USE_CACHED_AUDIO_DEVICE", True)
+    mock_get_infos = mocker.patch("src.audio_device_manager.get_device_infos", return_value=DEVICE_INFOS)
+    mock_choose_device = mocker.patch("src.audio_device_manager.choose_audio_device", return_value=1)
+    mock_find_rates = mocker.patch("src.audio_device_manager.find_supported_sample_rates", return_value=[16000, 44100])
+    mock_choose_rate = mocker.patch("src.audio_device_manager.choose_sample_rate", return_value=44100)
 
     pyaudio_instance = mocker.patch("pyaudio.PyAudio", autospec=True)
-    pyaudio_instance.return_value.terminate = mocker.Mock()
+    pyaudio_instance.terminate = mocker.Mock()
+    pyaudio_instance.get_host_api_info_by_index.return_value = {"name": "ALSA"}
+
+    yield pyaudio_instance, mock_get_infos, mock_choose_device, mock_find_rates, mock_choose_rate
 
+
+@pytest.fixture
+def audio_device_manager(device_mocks):
+    pyaudio_instance, _, mock_choose_device, mock_find_rates, mock_choose_rate = device_mocks
     yield AudioDeviceManager(pyaudio_instance), mock_choose_device, mock_find_rates, mock_choose_rate
 
 
 def test_setup_audio_device_with_supported_rates(audio_device_manager):
     manager, mock_choose_device, mock_find_rates, mock_choose_rate = audio_device_manager
-    mock_choose_device.return_value = 0
-    mock_find_rates.return_value = [44100]
-    mock_choose_rate.return_value = 44100
 
-    device_index, sample_rate = manager.setup_audio_device()
-
-    assert device_index == 0
-    assert sample_rate == 44100
+    assert manager.device_index == 1
+    assert manager.chosen_sample_rate == 44100
+    mock_choose_device.assert_called_once_with(manager.pyaudio_instance, DEVICE_INFOS)
+    mock_choose_rate.assert_called_once_with([16000, 44100])
 
 
 def test_setup_audio_device_exits_with_no_supported_rates(mocker, audio_device_manager):
     manager, mock_choose_device, mock_find_rates, mock_choose_rate = audio_device_manager
-    mock_choose_device.return_value = 0
+    mocker.patch("src.audio_device_manager.USE_CACHED_AUDIO_DEVICE", False)
+    manager.device_cache.entries["sample_rates"].clear()  # Probe again instead of using the rates cached on creation
     mock_find_rates.return_value = []
-    mock_choose_rate.return_value = 44100
-    mock_print_error = mocker.patch(
-        "src.cli_interface.CliInterface.print_error", return_value="No supported sample rates found for the device."
-    )
+    mock_print_error = mocker.patch("src.audio_device_manager.CliInterface.print_error")
 
     with pytest.raises(SystemExit):
         manager.setup_audio_device()
 
     mock_print_error.assert_called_once_with("No supported sample rates found for the device.")
     manager.pyaudio_instance.terminate.assert_called_once()
+
+
+def test_cached_choice_is_used_without_prompts(device_mocks):
+    pyaudio_instance, _, mock_choose_device, mock_find_rates, mock_choose_rate = device_mocks
+    AudioDeviceManager(pyaudio_instance)
+
+    manager = AudioDeviceManager(pyaudio_instance)
+
+    assert (manager.device_index, manager.chosen_sample_rate) == (1, 44100)
+    mock_choose_device.assert_called_once()
+    mock_find_rates.assert_called_once()
+    mock_choose_rate.assert_called_once()
+
+
+def test_cached_sample_rates_skip_probing(mocker, device_mocks):
+    pyaudio_instance, _, mock_choose_device, mock_find_rates, _ = device_mocks
+    AudioDeviceManager(pyaudio_instance)
+    mocker.patch("src.audio_device_manager.USE_CACHED_AUDIO_DEVICE", False)
+
+    AudioDeviceManager(pyaudio_instance)
+
+    assert mock_choose_device.call_count == 2
+    mock_find_rates.assert_called_once()
+
+
+def test_cache_is_discarded_when_devices_change(device_mocks):
+    pyaudio_instance, mock_get_infos, mock_choose_device, mock_find_rates, _ = device_mocks
+    AudioDeviceManager(pyaudio_instance)
+    mock_get_infos.return_value = DEVICE_INFOS + [
+        {"name": "Bluetooth Headset", "hostApi": 0, "maxInputChannels": 1, "defaultSampleRate": 16000.0}
+    ]
+
+    AudioDeviceManager(pyaudio_instance)
+
+    assert mock_choose_device.call_count == 2
+    assert mock_find_rates.call_count == 2
+
+
+# Test that without a user to ask, the default input device is used at Whisper's sample rate, without being cached
+def test_default_device_is_used_when_not_interactive(device_mocks):
+    pyaudio_instance, _, mock_choose_device, _, mock_choose_rate = device_mocks
+    pyaudio_instance.get_default_input_device_info.return_value = {"index": 1}
+
+    manager = AudioDeviceManager(pyaudio_instance, interactive=False)
+
+    assert (manager.device_index, manager.chosen_sample_rate) == (1, 16000)
+    mock_choose_device.assert_not_called()
+    mock_choose_rate.assert_not_called()
+    assert manager.device_cache.get_default() is None
+
+
+# Test that without a user to ask, the cached last choice is preferred to the default input device
+def test_cached_choice_is_used_when_not_interactive(mocker, device_mocks):
+    pyaudio_instance, _, _, _, _ = device_mocks
+    AudioDeviceManager(pyaudio_instance)
+    mocker.patch("src.audio_device_manager.USE_CACHED_AUDIO_DEVICE", False)
+
+    manager = AudioDeviceManager(pyaudio_instance, interactive=False)
+
+    assert (manager.device_index, manager.chosen_sample_rate) == (1, 44100)
+    pyaudio_instance.get_default_input_device_info.assert_not_called()
@@ -1,32 +1,69 @@
+import threading
+
+import numpy as np
 import pytest
 
 from src.audio_processor import AudioProcessor
+from src.metrics import ChunkTimings
+from src.volume_envelope import VolumeEnvelope
 
 MOCK_FILE_PATH = "/tmp/mockfile.wav"
+VOLUME = VolumeEnvelope(np.full(16000, 0.1, dtype=np.float32), 16000)
+
+
+def speech_like(duration, sample_rate=16000):
+    # A loud low-frequency tone stands in for voiced speech
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    return (0.3 * np.sin(2 * np.pi * 200 * t)).astype(np.float32)
+
+
+def to_pcm(samples):
+    return (samples * 32767).astype(np.int16).tobytes()
+
+
+def stop_processing_threads(processor):
+    for _ in processor.processing_threads:
+        processor.processing_queue.put(None)
+    for processing_thread in processor.processing_threads:
+        processing_thread.join()
 
 
 # Use a fixture to create a test instance of AudioProcessor
 @pytest.fixture
 def audio_processor(mocker):
-    mocker.patch("src.whisper_service.WhisperService")
+    mocker.patch("src.audio_processor.WhisperService")
     mocker.patch("src.cli_interface.CliInterface")
     mocker.patch("tempfile.mkstemp", return_value=(None, MOCK_FILE_PATH))
     mocker.patch("wave.open", autospec=True)
     mocker.patch("os.close")
+    # Most tests check fixed-size chunking, voice activity detection is tested with vad_audio_processor
+    mocker.patch("src.audio_processor.VAD_ENABLED", False)
+    # Most tests check chunk-by-chunk transcription, batching is tested in test_queued_chunks_are_transcribed_in_batches
+    mocker.patch("src.audio_processor.TRANSCRIPTION_BATCH_SIZE", 1)
 
     processor = AudioProcessor(chosen_sample_rate=16000)
     yield processor  # This yields control back to the test function
 
-    # Teardown logic to ensure the thread is stopped
-    processor.is_processing = False
-    processor.processing_thread.join()
+    # Teardown logic to ensure the threads are stopped
+    stop_processing_threads(processor)
+
+
+@pytest.fixture
+def vad_audio_processor(mocker):
+    mocker.patch("src.audio_processor.WhisperService")
+    mocker.patch("src.audio_processor.VAD_ENABLED", True)
+
+    processor = AudioProcessor(chosen_sample_rate=16000)
+    yield processor
+
+    stop_processing_threads(processor)
 
 
 def test_process_audio_chunk_volume(audio_processor):
     # Test volume calculation with mock data
-    mock_data = b"\x00\x01" * 100  # Mock audio data
+    mock_data = np.full(100, 256 / 32768, dtype=np.float32)  # Mock audio data
     volume = audio_processor.process_audio_chunk_volume(mock_data)
-    assert volume != -float("inf"), "Volume should be calculable and not -inf"
+    assert volume.volume_db == pytest.approx(20 * np.log10(256)), "Volume should be on the scale of 16-bit sample values"
 
 
 def test_audio_callback_adds_data_to_buffer(audio_processor):
@@ -36,72 +73,372 @@ def test_audio_callback_adds_data_to_buffer(audio_processor):
     assert len(audio_processor.audio_buffer) == len(mock_data), "Buffer should contain the mock data"
 
 
+def test_audio_callback_queues_full_chunks(audio_processor, mocker):
+    # A full chunk is queued as soon as it is complete, and the rest stays in the buffer
+    process_and_queue_chunk_mock = mocker.patch.object(audio_processor, "process_and_queue_chunk")
+    mock_data = b"\x00\x01" * 1024
+    for _ in range(audio_processor.desired_length // len(mock_data) + 1):
+        audio_processor.audio_callback(in_data=mock_data, _frame_count=None, _time_info=None, _status=None)
+
+    process_and_queue_chunk_mock.assert_called_once()
+    assert len(process_and_queue_chunk_mock.call_args.args[0]) == audio_processor.desired_length
+    assert len(audio_processor.audio_buffer) == len(mock_data) - audio_processor.desired_length % len(mock_data)
+
+
+def test_audio_callback_pins_its_thread_once(audio_processor, mocker):
+    # The callback thread is pinned to the capture cores on the first call only
+    pin_mock = mocker.patch("src.audio_processor.pin_current_thread")
+    mocker.patch("src.audio_processor.capture_affinity", return_value=[0])
+    for _ in range(3):
+        audio_processor.audio_callback(in_data=b"\x00\x01", _frame_count=None, _time_info=None, _status=None)
+
+    pin_mock.assert_called_once_with([0])
+
+
 def test_finalize_recording_processes_remaining_data(audio_processor, mocker):
     # Mock the method that will be called when finalizing recording to verify it's called correctly
     process_and_queue_chunk_mock = mocker.patch.object(audio_processor, "process_and_queue_chunk")
 
     # Simulate remaining data in the buffer
-    audio_processor.audio_buffer = b"\x00\x01" * 100
+    audio_processor.audio_buffer.write(b"\x00\x01" * 100)
     audio_processor.finalize_recording()
 
-    # Verify the process_and_queue_chunk method was called
+    # Verify the process_and_queue_chunk method was called with the remaining data
     process_and_queue_chunk_mock.assert_called_once()
+    assert bytes(process_and_queue_chunk_mock.call_args.args[0]) == b"\x00\x01" * 100
+    assert len(audio_processor.audio_buffer) == 0
 
 
 def test_stop_processing_thread(audio_processor, mocker):
     # Mock the join method to ensure it's called, indicating the thread is waited on to finish
-    join_mock = mocker.patch.object(audio_processor.processing_thread, "join")
+    join_mock = mocker.patch.object(audio_processor.processing_threads[0], "join")
 
     audio_processor.stop_processing()
 
-    # Check that is_processing is False and join has been called, ensuring thread termination
+    # Check that is_processing is False, the sentinel was queued and join has been called, ensuring thread termination
     assert not audio_processor.is_processing, "Processing should be stopped"
     join_mock.assert_called_once()
 
 
-def test_integration_with_whisper_service(audio_processor, mocker):
-    # Ensure is_processing is True to start processing
-    audio_processor.is_processing = True
+def test_stop_processing_finishes_queued_chunks(audio_processor, mocker):
+    transcribe_mock = mocker.patch.object(audio_processor.whisper_transcription, "transcribe_audio_chunk")
+    for _ in range(3):
+        audio_processor.processing_queue.put((0, 1.0, np.zeros(16000, dtype=np.float32), VOLUME, ChunkTimings(1.0, 0)))
+
+    audio_processor.stop_processing()
+
+    assert transcribe_mock.call_count == 3
+    assert not audio_processor.processing_threads[0].is_alive()
 
+
+def test_integration_with_whisper_service(audio_processor, mocker):
     # Mock the transcribe_audio_chunk method of WhisperService
     transcribe_mock = mocker.patch.object(audio_processor.whisper_transcription, "transcribe_audio_chunk")
 
     # Simulate processing an audio chunk
-    mock_data = b"\x00\x01" * 1000  # Mock audio data
+    mock_data = np.full(16000, 256 / 32768, dtype=np.float32)  # Mock audio data
     temp_file_path = MOCK_FILE_PATH  # Assuming tempfile.mkstemp is mocked to return this path
-    volume_db = audio_processor.process_audio_chunk_volume(mock_data)
-    audio_processor.processing_queue.put((mock_data, temp_file_path, volume_db))
+    volume = audio_processor.process_audio_chunk_volume(mock_data)
+    timings = ChunkTimings(1.0, 0)
+    audio_processor.processing_queue.put((0, 1.0, temp_file_path, volume, timings))
 
-    # Adjust is_processing to False to allow the processing loop to exit
-    audio_processor.is_processing = False
-    audio_processor.process_audio_chunks_queue()  # Process the queue item
+    # Wait for the processing thread to transcribe the queued chunk
+    audio_processor.wait_for_processing()
 
     # Verify WhisperService.transcribe_audio_chunk is called correctly
-    transcribe_mock.assert_called_once_with(temp_file_path, volume_db)
+    transcribe_mock.assert_called_once_with(temp_file_path, volume, 0, timings)
+    assert audio_processor.is_processing_completed()
+
+
+def test_queue_audio_numbers_chunks_in_order(audio_processor, mocker):
+    transcribe_mock = mocker.patch.object(audio_processor.whisper_transcription, "transcribe_audio_chunk")
+    for _ in range(3):
+        audio_processor.queue_audio(np.zeros(1600, dtype=np.float32))
+    audio_processor.wait_for_processing()
+
+    assert [call.args[2] for call in transcribe_mock.call_args_list] == [0, 1, 2]
+
+
+def test_worker_threads_transcribe_in_parallel(mocker):
+    mocker.patch("src.audio_processor.WhisperService")
+    mocker.patch("src.audio_processor.VAD_ENABLED", False)
+    mocker.patch("src.audio_processor.TRANSCRIPTION_WORKERS", 3)
+    mocker.patch("src.audio_processor.TRANSCRIPTION_BATCH_SIZE", 1)
+    processor = AudioProcessor(chosen_sample_rate=16000)
+    barrier = threading.Barrier(3, timeout=5)
+    processor.whisper_transcription.transcribe_audio_chunk.side_effect = lambda *_args: barrier.wait()
+    try:
+        assert len(processor.processing_threads) == 3
+        for _ in range(3):
+            processor.queue_audio(np.zeros(1600, dtype=np.float32))
+        # Every worker must be transcribing at the same time for the barrier to be passed
+        processor.wait_for_processing()
+        assert not barrier.broken
+    finally:
+        stop_processing_threads(processor)
+
+
+def test_queued_chunks_are_transcribed_in_batches(audio_processor, mocker):
+    # Chunks that queue up while a chunk is being transcribed are taken together, up to the batch size
+    mocker.patch("src.audio_processor.TRANSCRIPTION_BATCH_SIZE", 2)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_transcription(*_args):
+        started.set()
+        release.wait()
+
+    whisper_transcription = audio_processor.whisper_transcription
+    mocker.patch.object(whisper_transcription, "transcribe_audio_chunk", side_effect=slow_transcription)
+    batch_mock = mocker.patch.object(whisper_transcription, "transcribe_audio_batch")
+    audio_processor.queue_audio(np.zeros(1600, dtype=np.float32))
+    started.wait()
+    for _ in range(3):
+        audio_processor.queue_audio(np.zeros(1600, dtype=np.float32))
+    release.set()
+    audio_processor.wait_for_processing()
+
+    assert [call.args[2] for call in whisper_transcription.transcribe_audio_chunk.call_args_list] == [0, 3]
+    batch_mock.assert_called_once()
+    assert [sequence for _, _, sequence, _ in batch_mock.call_args.args[0]] == [1, 2]
+    assert audio_processor.is_processing_completed()
+
+
+def test_sentinel_taken_with_a_batch_stops_processing(audio_processor, mocker):
+    # The sentinel is put back when it is drained with a batch, then ends the loop once the batch is transcribed
+    mocker.patch("src.audio_processor.TRANSCRIPTION_BATCH_SIZE", 4)
+    batch_mock = mocker.patch.object(audio_processor.whisper_transcription, "transcribe_audio_batch")
+    stop_processing_threads(audio_processor)
+    for _ in range(2):
+        audio_processor.processing_queue.put((0, 1.0, np.zeros(16000, dtype=np.float32), VOLUME, ChunkTimings(1.0, 0)))
+    audio_processor.processing_queue.put(None)
+
+    audio_processor.process_audio_chunks_queue()
+
+    assert len(batch_mock.call_args.args[0]) == 2
+    assert audio_processor.processing_queue.empty()
+    assert audio_processor.is_processing_completed()
+
+
+def test_wait_for_processing_waits_for_transcription_to_finish(audio_processor, mocker):
+    # The chunk must count as pending until its transcription returns, not just until it leaves the queue
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_transcription(*_args):
+        started.set()
+        release.wait()
+
+    mocker.patch.object(audio_processor.whisper_transcription, "transcribe_audio_chunk", side_effect=slow_transcription)
+    audio_processor.processing_queue.put((0, 1.0, np.zeros(16000, dtype=np.float32), VOLUME, ChunkTimings(1.0, 0)))
+    started.wait()
+
+    assert audio_processor.processing_queue.empty()
+    assert not audio_processor.is_processing_completed()
+    release.set()
+    audio_processor.wait_for_processing()
+    assert audio_processor.is_processing_completed()
 
 
 def test_silent_audio_volume_calculation(audio_processor):
     # Silent audio data
-    silent_data = b"\x00\x00" * 1000
+    silent_data = np.zeros(1000, dtype=np.float32)
     volume = audio_processor.process_audio_chunk_volume(silent_data)
-    assert volume == -float("inf"), "Volume of silent audio should be -inf"
+    assert volume.volume_db == -float("inf"), "Volume of silent audio should be -inf"
 
 
 def test_process_and_queue_chunk(audio_processor, mocker):
+    # Chunks are queued in memory by default, without touching the disk
+    mkstemp_mock = mocker.patch("tempfile.mkstemp", return_value=(None, MOCK_FILE_PATH))
+
+    # Simulate processing a chunk taken from the buffer
+    mock_data = b"\x00\x01" * 1000
+    audio_processor.process_and_queue_chunk(memoryview(mock_data))
+
+    mkstemp_mock.assert_not_called()
+
+    # Verify the queue has one item and it's the expected data
+    assert not audio_processor.processing_queue.empty(), "Processing queue should have one item"
+    sequence, duration, audio, _, _ = audio_processor.processing_queue.get()
+    assert sequence == 0
+    assert duration == 1000 / 16000, "Queued duration should match the original audio chunk"
+    assert isinstance(audio, np.ndarray) and audio.dtype == np.float32
+    np.testing.assert_array_equal(audio, np.full(1000, 256 / 32768, dtype=np.float32))
+
+
+def test_process_and_queue_chunk_resamples_to_16khz(mocker):
+    mocker.patch("src.audio_processor.WhisperService")
+    mocker.patch("src.audio_processor.VAD_ENABLED", False)
+    processor = AudioProcessor(chosen_sample_rate=48000)
+    try:
+        processor.process_and_queue_chunk(memoryview(b"\x00\x01" * 48000))
+        _, _, audio, _, _ = processor.processing_queue.get()
+        assert len(audio) == 16000
+    finally:
+        stop_processing_threads(processor)
+
+
+def test_process_and_queue_chunk_debug_files(audio_processor, mocker):
     # Mock the tempfile and wave.open to avoid actual file operations
+    mocker.patch("src.audio_processor.DEBUG_SAVE_AUDIO_FILES", True)
     mkstemp_mock = mocker.patch("tempfile.mkstemp", return_value=(None, MOCK_FILE_PATH))
     wave_open_mock = mocker.patch("wave.open")
 
-    # Simulate adding data to the buffer and processing it
-    mock_data = b"\x00\x01" * 1000  # Enough data to trigger processing
-    audio_processor.audio_buffer = mock_data
-    audio_processor.process_and_queue_chunk()
+    audio_processor.process_and_queue_chunk(memoryview(b"\x00\x01" * 1000))
 
     # Check that a temp file was created and wave file was written
     mkstemp_mock.assert_called_once()
     wave_open_mock.assert_called_once()
+    wave_open_mock.return_value.__enter__.return_value.setsampwidth.assert_called_once_with(2)
+    _, _, audio, _, _ = audio_processor.processing_queue.get()
+    assert audio == MOCK_FILE_PATH
 
-    # Verify the queue has one item and it's the expected data
-    assert not audio_processor.processing_queue.empty(), "Processing queue should have one item"
-    queued_data, _, _ = audio_processor.processing_queue.get()
-    assert queued_data == mock_data, "Queued data should match the original audio buffer"
+
+def test_vad_drops_silence(vad_audio_processor, mocker):
+    queue_audio_mock = mocker.patch.object(vad_audio_processor, "queue_audio")
+    silence = to_pcm(np.zeros(16000, dtype=np.float32))
+    for _ in range(5):
+        vad_audio_processor.audio_callback(in_data=silence, _frame_count=None, _time_info=None, _status=None)
+    vad_audio_processor.finalize_recording()
+
+    queue_audio_mock.assert_not_called()
+
+
+def test_vad_queues_speech_segments(vad_audio_processor, mocker):
+    queue_audio_mock = mocker.patch.object(vad_audio_processor, "queue_audio")
+    silence = np.zeros(16000, dtype=np.float32)
+    audio = np.concatenate((silence, speech_like(2.0), silence, speech_like(1.0), silence))
+    vad_audio_processor.audio_callback(in_data=to_pcm(audio), _frame_count=None, _time_info=None, _status=None)
+    vad_audio_processor.finalize_recording()
+
+    durations = [len(call.args[0]) / 16000 for call in queue_audio_mock.call_args_list]
+    assert len(durations) == 2, "Each utterance should be queued as one segment"
+    assert 2.0 < durations[0] < 3.0
+    assert 1.0 < durations[1] < 2.0
+
+
+def test_vad_finalize_recording_flushes_open_segment(vad_audio_processor, mocker):
+    queue_audio_mock = mocker.patch.object(vad_audio_processor, "queue_audio")
+    vad_audio_processor.audio_callback(
+        in_data=to_pcm(speech_like(1.0)), _frame_count=None, _time_info=None, _status=None
+    )
+    queue_audio_mock.assert_not_called()
+
+    vad_audio_processor.finalize_recording()
+
+    queue_audio_mock.assert_called_once()
+
+
+def test_open_segment_returns_speech_being_captured(vad_audio_processor, mocker):
+    mocker.patch.object(vad_audio_processor, "queue_audio")
+    assert vad_audio_processor.open_segment() is None
+
+    vad_audio_processor.audio_callback(
+        in_data=to_pcm(speech_like(1.0)), _frame_count=None, _time_info=None, _status=None
+    )
+    sequence, audio = vad_audio_processor.open_segment()
+
+    assert sequence == vad_audio_processor.next_sequence
+    assert 0.9 < len(audio) / 16000 <= 1.0
+    assert not np.shares_memory(audio, vad_audio_processor.vad_segmenter.segment)
+
+
+@pytest.fixture
+def overloaded_processor(mocker):
+    # Returns a processor whose queue is not drained, to fill it up
+    def create(overload_policy, max_queued_chunks=2):
+        mocker.patch("src.audio_processor.WhisperService")
+        mocker.patch("src.audio_processor.CliInterface")
+        mocker.patch("src.audio_processor.VAD_ENABLED", False)
+        processor = AudioProcessor(16000, max_queued_chunks=max_queued_chunks, overload_policy=overload_policy)
+        processor.whisper_transcription.downgraded = False
+        stop_processing_threads(processor)
+        return processor
+
+    return create
+
+
+def queued_sequences(processor):
+    return [item[0] for item in processor.processing_queue.queue]
+
+
+def test_unknown_overload_policy(mocker):
+    mocker.patch("src.audio_processor.WhisperService")
+    with pytest.raises(ValueError):
+        AudioProcessor(16000, overload_policy="drop_newest")
+
+
+def test_full_queue_drops_oldest_chunk(overloaded_processor):
+    processor = overloaded_processor("drop_oldest")
+    for _ in range(3):
+        processor.queue_audio(np.zeros(1600, dtype=np.float32))
+
+    assert queued_sequences(processor) == [1, 2]
+    # The dropped chunk is marked as a gap in the results, in its place in capture order
+    skip_mock = processor.whisper_transcription.skip_audio_chunk
+    assert skip_mock.call_args.args[:2] == (0.1, 0)
+    assert processor.processing_queue.unfinished_tasks == 2
+
+
+def test_full_queue_merges_into_newest_chunk(overloaded_processor):
+    processor = overloaded_processor("merge")
+    processor.queue_audio(np.zeros(1600, dtype=np.float32))
+    processor.queue_audio(np.zeros(1600, dtype=np.float32))
+    processor.queue_audio(np.ones(3200, dtype=np.float32))
+
+    assert queued_sequences(processor) == [0, 1]
+    _, duration, audio, volume, timings = processor.processing_queue.queue[-1]
+    assert duration == timings.duration == pytest.approx(0.3)
+    assert len(audio) == 4800
+    assert volume.volume_db == pytest.approx(20 * np.log10(32768 * np.sqrt(2 / 3)))
+    assert processor.next_sequence == 2
+    processor.whisper_transcription.skip_audio_chunk.assert_not_called()
+
+
+# Test that queued chunks, and audio merged into them, are appended to the spool with their sequence numbers
+def test_queued_audio_is_spooled(overloaded_processor):
+    processor = overloaded_processor("merge")
+    for _ in range(3):
+        processor.queue_audio(np.zeros(1600, dtype=np.float32))
+
+    assert [call.args[0] for call in processor.spool.append.call_args_list] == [0, 1, 1]
+
+
+def test_merge_falls_back_to_dropping_long_chunks(overloaded_processor):
+    processor = overloaded_processor("merge")
+    for _ in range(3):
+        processor.queue_audio(np.zeros(16000 * 20, dtype=np.float32))
+
+    assert queued_sequences(processor) == [1, 2]
+
+
+# Test that while downgraded, a chunk that cannot be merged waits for room in the queue rather than dropping audio
+def test_downgrade_blocks_chunks_that_cannot_be_merged(overloaded_processor):
+    processor = overloaded_processor("downgrade")
+    for _ in range(2):
+        processor.queue_audio(np.zeros(16000 * 20, dtype=np.float32))
+    thread = threading.Thread(target=processor.queue_audio, args=(np.zeros(16000 * 20, dtype=np.float32),))
+    thread.start()
+    thread.join(0.1)
+
+    assert thread.is_alive()
+    processor.processing_queue.get_nowait()
+    thread.join()
+    assert queued_sequences(processor) == [1, 2]
+    processor.whisper_transcription.skip_audio_chunk.assert_not_called()
+
+
+def test_full_queue_downgrades_model_until_caught_up(overloaded_processor, mocker):
+    processor = overloaded_processor("downgrade")
+    for _ in range(3):
+        processor.queue_audio(np.zeros(1600, dtype=np.float32))
+
+    assert processor.whisper_transcription.downgraded is True
+    # The chunk that overflows the queue is merged rather than dropped
+    assert queued_sequences(processor) == [0, 1]
+    assert len(processor.processing_queue.queue[-1][2]) == 3200
+    processor.whisper_transcription.skip_audio_chunk.assert_not_called()
+
+    processor.processing_queue.get_nowait()
+    processor.restore_model()
+    assert processor.whisper_transcription.downgraded is False
@@ -13,8 +13,6 @@ def mock_dependencies(mocker):
 
     # Mocking the audio processor
     audio_processor_mock = mocker.patch("src.audio_processor.AudioProcessor", autospec=True)
-    # Simulating that processing is completed
-    audio_processor_mock.is_processing_completed.return_value = True
 
     return audio_device_manager_mock, pyaudio_instance, audio_processor_mock
 
@@ -60,11 +58,9 @@ def test_pause_recording_stops_stream_and_finalizes(audio_recorder):
 
 
 def test_pause_recording_waits_for_processing_completion(audio_recorder):
-    # Pausing recording should wait for processing to complete before finalizing
+    # Pausing recording should finalize the recording, then wait for processing to complete
     audio_recorder.start_recording()
-    # Simulating that the first call to is_processing_completed returns False, and the second returns True
-    audio_recorder.audio_processor.is_processing_completed.side_effect = [False, True]
     audio_recorder.pause_recording(stop=True)
-    assert audio_recorder.audio_processor.is_processing_completed.call_count == 2
+    audio_recorder.audio_processor.wait_for_processing.assert_called_once()
     assert not audio_recorder.recording, "Recording should be stopped"
     audio_recorder.audio_processor.finalize_recording.assert_called_once()
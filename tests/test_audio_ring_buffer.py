@@ -0,0 +1,57 @@
+import pytest
+
+from src.audio_ring_buffer import AudioRingBuffer
+
+
+@pytest.fixture
+def ring_buffer():
+    return AudioRingBuffer(chunk_size=8, chunk_count=3)
+
+
+def test_write_accumulates_partial_chunk(ring_buffer):
+    ring_buffer.write(b"\x01\x02\x03")
+    assert len(ring_buffer) == 3
+    assert ring_buffer.pop_chunk() is None
+
+
+def test_write_splits_data_across_chunks(ring_buffer):
+    ring_buffer.write(bytes(range(12)))
+
+    chunk = ring_buffer.pop_chunk()
+    assert isinstance(chunk, memoryview)
+    assert bytes(chunk) == bytes(range(8))
+    assert ring_buffer.pop_chunk() is None
+    assert bytes(ring_buffer.flush()) == bytes(range(8, 12))
+    assert len(ring_buffer) == 0
+
+
+def test_write_wraps_around_without_reallocating(ring_buffer):
+    buffer = ring_buffer.buffer
+    for i in range(10):
+        ring_buffer.write(bytes([i]) * 8)
+        assert bytes(ring_buffer.pop_chunk()) == bytes([i]) * 8
+    assert ring_buffer.buffer is buffer
+    assert len(buffer) == 24
+    assert ring_buffer.overruns == 0
+
+
+def test_write_drops_oldest_chunk_when_full(ring_buffer):
+    for i in range(4):
+        ring_buffer.write(bytes([i]) * 8)
+
+    assert ring_buffer.overruns == 2
+    assert bytes(ring_buffer.pop_chunk()) == bytes([2]) * 8
+    assert bytes(ring_buffer.pop_chunk()) == bytes([3]) * 8
+    assert ring_buffer.pop_chunk() is None
+
+
+def test_clear_discards_data(ring_buffer):
+    ring_buffer.write(bytes(12))
+    ring_buffer.clear()
+    assert len(ring_buffer) == 0
+    assert ring_buffer.pop_chunk() is None
+
+
+def test_requires_at_least_two_chunks():
+    with pytest.raises(ValueError):
+        AudioRingBuffer(chunk_size=8, chunk_count=1)
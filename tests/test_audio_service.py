@@ -4,6 +4,7 @@ import pytest
 from pynput import keyboard
 
 from src.audio_service import AudioService
+from src.multi_source_recorder import AudioSource
 
 
 # Fixture to mock dependencies and create an instance of AudioService
@@ -17,6 +18,7 @@ def audio_service(mocker):
     audio_device_manager_mock = mocker.patch("src.audio_service.AudioDeviceManager")
     audio_processor_mock = mocker.patch("src.audio_service.AudioProcessor")
     audio_recorder_mock = mocker.patch("src.audio_service.AudioRecorder")
+    mocker.patch("src.audio_service.WhisperService")
 
     # Configure the pyaudio_mock to return specific values for get_device_count and get_device_info_by_index
     pyaudio_instance_mock = pyaudio_mock.return_value
@@ -26,6 +28,7 @@ def audio_service(mocker):
     service = AudioService()
     service.audio_device_manager = audio_device_manager_mock
     service.audio_processor = audio_processor_mock
+    service.audio_processors = [audio_processor_mock]
     service.audio_recorder = audio_recorder_mock
 
     return service
@@ -41,6 +44,23 @@ def test_on_key_press_stop_recording(audio_service):
     audio_service.audio_recorder.pyaudio_instance.terminate.assert_called_once()
 
 
+def test_model_loading_starts_before_device_selection(mocker):
+    mocker.patch("src.audio_service.CliInterface")
+    mocker.patch("src.audio_service.pyaudio.PyAudio")
+    mocker.patch("src.audio_service.AudioRecorder")
+    startup = MagicMock()
+    startup.attach_mock(mocker.patch("src.audio_service.WhisperService"), "WhisperService")
+    startup.attach_mock(mocker.patch("src.audio_service.AudioDeviceManager"), "AudioDeviceManager")
+    startup.attach_mock(mocker.patch("src.audio_service.AudioProcessor"), "AudioProcessor")
+
+    service = AudioService()
+
+    assert [call[0] for call in startup.mock_calls] == ["WhisperService", "AudioDeviceManager", "AudioProcessor"]
+    startup.AudioProcessor.assert_called_once_with(
+        startup.AudioDeviceManager.return_value.chosen_sample_rate, service.whisper_transcription, 6, "drop_oldest"
+    )
+
+
 def test_on_key_press_toggle_recording(audio_service):
     audio_service.audio_recorder.recording = False
 
@@ -65,3 +85,141 @@ def test_run_with_real_and_fake_file(audio_service, mocker, is_real_file):
     audio_service.run()
 
     mock_listener.assert_called_once()
+
+
+# Test that ADAPTIVE_MODEL_SIZES without MODEL_SIZE is reported before anything is set up
+def test_invalid_adaptive_model_sizes_exit(mocker):
+    cli_interface_mock = mocker.patch("src.audio_service.CliInterface")
+    mocker.patch("src.audio_service.ADAPTIVE_MODEL_SIZES", ["tiny", "small"])
+    mocker.patch("src.audio_service.MODEL_SIZE", "base")
+    whisper_service_mock = mocker.patch("src.audio_service.WhisperService")
+
+    with pytest.raises(SystemExit):
+        AudioService(interactive=False)
+
+    assert "MODEL_SIZE" in str(cli_interface_mock.print_error.call_args.args[0])
+    whisper_service_mock.assert_not_called()
+
+
+# Test that stopping twice, e.g. from the control API and then on exit, only stops the service once
+def test_stop_is_idempotent(audio_service):
+    audio_service.audio_recorder.recording = False
+
+    assert audio_service.stop()
+    assert not audio_service.stop()
+
+    audio_service.audio_processor.stop_processing.assert_called_once()
+    assert not audio_service.start_recording()
+    audio_service.audio_recorder.start_recording.assert_not_called()
+
+
+# Test that flushing waits for the queued chunks and outputs the results so far, without ending the session
+def test_flush(audio_service):
+    assert audio_service.flush()
+
+    audio_service.audio_processor.wait_for_processing.assert_called_once()
+    audio_service.audio_processor.whisper_transcription.output_transcription_results.assert_called_once_with(final=False)
+    audio_service.audio_processor.stop_processing.assert_not_called()
+
+
+# Test that the status reports the recording state along with the pipeline gauges
+def test_status(audio_service):
+    metrics = audio_service.metrics
+    metrics.counters = {"chunks_written": 3}
+    metrics.gauges.return_value = {"queue_depth": 1, "transcription_lag_seconds": 2.5, "real_time_factor": 0.4}
+    audio_service.audio_recorder.recording = True
+
+    assert audio_service.status() == {
+        "state": "recording",
+        "chunks_transcribed": 3,
+        "queue_depth": 1,
+        "transcription_lag_seconds": 2.5,
+        "real_time_factor": 0.4,
+    }
+
+
+# Test that a headless service chooses its audio device without prompting
+def test_headless_service_does_not_prompt(mocker):
+    mocker.patch("src.audio_service.CliInterface")
+    mocker.patch("src.audio_service.pyaudio.PyAudio")
+    mocker.patch("src.audio_service.AudioRecorder")
+    mocker.patch("src.audio_service.AudioProcessor")
+    mocker.patch("src.audio_service.WhisperService")
+    audio_device_manager_mock = mocker.patch("src.audio_service.AudioDeviceManager")
+
+    service = AudioService(interactive=False)
+
+    audio_device_manager_mock.assert_called_once_with(service.pyaudio_instance, False)
+
+
+# Test that every audio source gets its own labelled WhisperService and AudioProcessor, sharing one model and scheduler
+def test_audio_sources_share_one_model(mocker):
+    mocker.patch("src.audio_service.CliInterface")
+    mocker.patch("src.audio_service.pyaudio.PyAudio")
+    mocker.patch("src.audio_service.get_device_infos", return_value=[{"name": "Interface", "maxInputChannels": 2}])
+    mocker.patch("src.audio_service.DeviceCache")
+    mocker.patch("src.audio_service.AUDIO_SOURCES", [{"label": "alice", "channel": 0}, {"label": "bob", "channel": 1}])
+    mocker.patch("src.audio_service.OUTPUT_FILE_PATH", "results.json")
+    mocker.patch(
+        "src.audio_service.resolve_audio_sources",
+        return_value=[AudioSource("alice", 0, 0, 16000), AudioSource("bob", 0, 1, 16000)],
+    )
+    load_model_mock = mocker.patch("src.audio_service.load_transcription_model")
+    whisper_service_mock = mocker.patch("src.audio_service.WhisperService")
+    audio_processor_mock = mocker.patch("src.audio_service.AudioProcessor")
+    recorder_mock = mocker.patch("src.audio_service.MultiSourceRecorder")
+    mocker.patch("src.audio_service.AudioDeviceManager", side_effect=AssertionError("No device should be chosen"))
+
+    service = AudioService()
+
+    assert service.shared_model_future.result() is load_model_mock.return_value
+    load_model_mock.assert_called_once_with()
+    (alice_args, alice_kwargs), (bob_args, bob_kwargs) = whisper_service_mock.call_args_list
+    assert alice_args[0] is bob_args[0] is service.shared_model_future
+    assert alice_args[1].scheduler is bob_args[1].scheduler
+    assert (alice_kwargs["source"], alice_kwargs["output_file_path"]) == ("alice", "results.alice.json")
+    assert (bob_kwargs["source"], bob_kwargs["output_file_path"]) == ("bob", "results.bob.json")
+    assert alice_kwargs["metrics"] is bob_kwargs["metrics"] is service.metrics
+    assert service.audio_processors == [audio_processor_mock.return_value] * 2
+    assert service.audio_recorder is recorder_mock.return_value
+
+
+# Test that stopping several sources stops every AudioProcessor and the shared worker processes
+def test_stop_audio_sources(audio_service, mocker):
+    mocker.patch("src.audio_service.TRANSCRIPTION_WORKERS", 2)
+    audio_service.audio_recorder.recording = False
+    audio_service.audio_processors = [MagicMock(), MagicMock()]
+    audio_service.shared_model_future = MagicMock()
+    audio_service.shared_model_future.exception.return_value = None
+
+    audio_service.stop()
+
+    for audio_processor in audio_service.audio_processors:
+        audio_processor.stop_processing.assert_called_once()
+    audio_service.shared_model_future.result.return_value.shutdown.assert_called_once()
+
+
+# Test that the audio left in the spool is replayed in the background, taking turns with the session, into a replay
+# output, and that stopping waits for the replay
+def test_spool_is_replayed_while_recording(mocker):
+    mocker.patch("src.audio_service.CliInterface")
+    mocker.patch("src.audio_service.pyaudio.PyAudio")
+    mocker.patch("src.audio_service.AudioDeviceManager")
+    mocker.patch("src.audio_service.AudioProcessor")
+    mocker.patch("src.audio_service.AudioRecorder")
+    mocker.patch("src.audio_service.SPOOL_PATH", "/path/to/session")
+    mocker.patch("src.audio_service.OUTPUT_FILE_PATH", "results.json")
+    spool_mock = mocker.patch("src.audio_service.AudioSpool").return_value
+    whisper_service_mock = mocker.patch("src.audio_service.WhisperService")
+
+    service = AudioService(interactive=False)
+    service.stop()
+
+    session_call, replay_call = whisper_service_mock.call_args_list
+    assert session_call.kwargs["spool"] is spool_mock
+    assert replay_call.args[0] is whisper_service_mock.return_value.model_future
+    assert replay_call.args[1].scheduler is session_call.kwargs["model_lock"].scheduler
+    assert replay_call.kwargs["output_file_path"] == "results.replay.json"
+    assert replay_call.kwargs["result_callback"] is spool_mock.mark_replayed
+    spool_mock.replay.assert_called_once_with(whisper_service_mock.return_value, service.replay_stopped)
+    assert service.replay_stopped.is_set()
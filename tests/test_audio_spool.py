@@ -0,0 +1,181 @@
+import os
+from threading import Event
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from src.audio_spool import AudioSpool, MappedFile, replay_output_path
+
+
+def tone(duration, frequency=220):
+    t = np.arange(int(duration * 16000)) / 16000
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+@pytest.fixture
+def spool_path(mocker, tmp_path):
+    mocker.patch("src.audio_spool.CliInterface")
+    return str(tmp_path / "spool" / "session")
+
+
+def replay_service(spool, transcribed=True):
+    # A WhisperService that writes every result, or none, calling mark_replayed like its result_callback
+    service = Mock()
+    if transcribed:
+        service.transcribe_audio_chunk.side_effect = lambda _audio, _volume, sequence: spool.mark_replayed(
+            {"sequence": sequence}
+        )
+    return service
+
+
+def test_replay_output_path():
+    assert replay_output_path("results/transcription.json") == "results/transcription.replay.json"
+
+
+# Test that data spanning several extents is written and read back, growing the file by whole extents
+def test_mapped_file_grows_by_extents(tmp_path):
+    mapped_file = MappedFile(str(tmp_path / "file"), 1)
+    data = bytes(range(256)) * 40
+
+    mapped_file.write(100, data)
+
+    assert mapped_file.read(100, len(data)) == data
+    assert os.path.getsize(tmp_path / "file") == mapped_file.size() == 3 * mapped_file.extent_size
+    mapped_file.close()
+
+
+def spool_files(spool_path):
+    return sorted(os.listdir(os.path.dirname(spool_path)))
+
+
+# Test that the spool is removed when the session ends with every chunk transcribed
+def test_transcribed_spool_is_removed(spool_path):
+    spool = AudioSpool(spool_path)
+    spool.append(0, tone(0.5))
+    spool.append(1, tone(0.5))
+    spool.mark_transcribed(1)
+    spool.mark_transcribed(0)
+    spool.close()
+
+    assert spool_files(spool_path) == []
+
+
+# Test that the spool moves on to a new segment once one is full, and removes the segments whose chunks are transcribed
+def test_transcribed_segments_are_removed(spool_path):
+    spool = AudioSpool(spool_path, segment_size=16000)
+    for sequence in range(3):
+        spool.append(sequence, tone(0.5))
+
+    assert [segment.generation for segment in spool.segments] == [0, 1, 2]
+    spool.mark_transcribed(1)
+    spool.mark_transcribed(0)
+    assert spool_files(spool_path) == ["session.2.0.idx", "session.2.0.pcm"]
+
+
+# Test that the chunks left untranscribed by a crash are replayed in capture order, merged chunks in one piece, even
+# across segments
+def test_untranscribed_chunks_are_replayed_after_crash(spool_path):
+    spool = AudioSpool(spool_path, segment_size=24000)
+    spool.append(0, tone(0.5))
+    spool.append(1, tone(0.25))
+    spool.append(1, tone(0.25, 440))
+    spool.append(2, tone(0.5, 880))
+    spool.mark_transcribed(0)
+    # The application crashes: the spool is opened again without being closed
+
+    recovered = AudioSpool(spool_path, segment_size=24000)
+    service = replay_service(recovered)
+
+    assert recovered.replay(service) == 2
+    replayed = [call.args[0] for call in service.transcribe_audio_chunk.call_args_list]
+    assert [call.args[2] for call in service.transcribe_audio_chunk.call_args_list] == [0, 1]
+    np.testing.assert_allclose(replayed[0], np.concatenate((tone(0.25), tone(0.25, 440))), atol=1e-4)
+    np.testing.assert_allclose(replayed[1], tone(0.5, 880), atol=1e-4)
+    service.output_transcription_results.assert_called_once_with()
+    assert recovered.pending_chunks() == []
+    assert recovered.segments == [recovered.segment]
+
+
+# Test that chunks which cannot be transcribed again are kept, apart from the chunks of the next session
+def test_failed_replay_keeps_chunks(spool_path):
+    spool = AudioSpool(spool_path)
+    spool.append(0, tone(0.5))
+
+    recovered = AudioSpool(spool_path)
+    recovered.replay(replay_service(recovered, transcribed=False))
+    recovered.append(0, tone(0.5, 440))
+    recovered.mark_transcribed(0)
+    recovered.close()
+
+    assert [len(records) for records in AudioSpool(spool_path).pending_chunks()] == [1]
+
+
+# Test that a segment holding dropped chunks is rewritten with only them, so that it does not keep transcribed audio
+def test_kept_chunks_are_rewritten(spool_path):
+    spool = AudioSpool(spool_path, segment_size=24000)
+    spool.append(0, tone(0.5))
+    spool.append(1, tone(0.25, 440))
+    spool.append(2, tone(0.5))
+    spool.mark_transcribed(0)
+    spool.mark_kept(1)
+
+    assert spool_files(spool_path) == ["session.0.1.idx", "session.0.1.pcm", "session.1.0.idx", "session.1.0.pcm"]
+    assert os.path.getsize(spool.path + ".0.1.pcm") == 8000
+    spool.mark_transcribed(2)
+    spool.close()
+
+    recovered = AudioSpool(spool_path)
+    service = replay_service(recovered)
+    assert recovered.replay(service) == 1
+    np.testing.assert_allclose(service.transcribe_audio_chunk.call_args.args[0], tone(0.25, 440), atol=1e-4)
+    recovered.close()
+    assert spool_files(spool_path) == []
+
+
+# Test that a crash while a segment is rewritten, before or after the new index is renamed into place, leaves one
+# complete copy of the kept chunks to replay
+@pytest.mark.parametrize("crash_point", ["src.audio_spool.os.replace", "src.audio_spool.SpoolSegment.remove"])
+def test_crash_while_rewriting_keeps_chunks(spool_path, mocker, crash_point):
+    spool = AudioSpool(spool_path, segment_size=24000)
+    spool.append(0, tone(0.5))
+    spool.append(1, tone(0.25, 440))
+    spool.append(2, tone(0.5))
+    spool.mark_transcribed(0)
+    crash = mocker.patch(crash_point, side_effect=OSError("Crashed"))
+
+    with pytest.raises(OSError):
+        spool.mark_kept(1)
+    mocker.stopall()
+    mocker.patch("src.audio_spool.CliInterface")
+    assert crash.called
+
+    recovered = AudioSpool(spool_path, segment_size=24000)
+    service = replay_service(recovered)
+    assert recovered.replay(service) == 2
+    replayed = [call.args[0] for call in service.transcribe_audio_chunk.call_args_list]
+    np.testing.assert_allclose(replayed[0], tone(0.25, 440), atol=1e-4)
+    np.testing.assert_allclose(replayed[1], tone(0.5), atol=1e-4)
+    recovered.close()
+    assert spool_files(spool_path) == []
+
+
+# Test that a replay running during a session only replays the earlier session's chunks, and stops when asked to
+def test_replay_during_session(spool_path):
+    spool = AudioSpool(spool_path)
+    spool.append(0, tone(0.5))
+    spool.append(1, tone(0.5))
+    spool.close()
+
+    recovered = AudioSpool(spool_path)
+    recovered.append(0, tone(0.5, 440))
+    stopped = Event()
+    service = replay_service(recovered)
+    service.transcribe_audio_chunk.side_effect = lambda _audio, _volume, sequence: stopped.set()
+
+    assert recovered.replay(service, stopped) == 1
+    np.testing.assert_allclose(service.transcribe_audio_chunk.call_args.args[0], tone(0.5), atol=1e-4)
+    recovered.mark_transcribed(0)
+    recovered.close()
+
+    assert [len(records) for records in AudioSpool(spool_path).pending_chunks()] == [1, 1]
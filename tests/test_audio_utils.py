@@ -1,12 +1,17 @@
+import io
 from unittest.mock import Mock
 
+import numpy as np
 import pytest
 
 from src.audio_utils import (
     choose_audio_device,
     choose_sample_rate,
+    decode_audio_file,
     find_supported_sample_rates,
     get_audio_devices,
+    pcm16_to_float32,
+    preferred_sample_rate,
 )
 
 
@@ -37,8 +42,9 @@ def mock_pyaudio_instance():
 # Test to verify the get_audio_devices function
 def test_get_audio_devices(mock_pyaudio_instance):
     devices = get_audio_devices(mock_pyaudio_instance)
-    # Check if the function returns the correct devices
+    # Check if the function returns the correct devices, querying each device once
     assert devices == [(0, "Device 1"), (2, "Device 3")]
+    assert mock_pyaudio_instance.get_device_info_by_index.call_count == 3
 
 
 # Test to verify the choose_audio_device function
@@ -52,23 +58,35 @@ def test_choose_audio_device(mocker, mock_pyaudio_instance):
 
 # Test to verify the find_supported_sample_rates function
 def test_find_supported_sample_rates_correctly_filters_rates(mock_pyaudio_instance, mock_supported_rates):
-    # Define the side effect for the open method of the PyAudio instance
-    def open_side_effect(*args, **kwargs):
-        rate = kwargs.get("rate")
-        # Raise an exception for unsupported sample rates
+    # Define the side effect for the is_format_supported method of the PyAudio instance
+    def is_format_supported_side_effect(rate, **kwargs):
+        # Raise an exception for unsupported sample rates, like PyAudio does
         if rate not in mock_supported_rates:
-            raise ValueError("Unsupported sample rate")
-        else:
-            return Mock()  # Simulate a successful stream opening
+            raise ValueError("Invalid sample rate")
+        return True
 
-    mock_pyaudio_instance.open.side_effect = open_side_effect
+    mock_pyaudio_instance.is_format_supported.side_effect = is_format_supported_side_effect
 
     # Call the function with the mock PyAudio instance and a device index
     actual_supported_rates = find_supported_sample_rates(mock_pyaudio_instance, 0)
-    # Check if the function returns the correct supported sample rates
+    # Check if the function returns the correct supported sample rates, without opening the device
     assert set(actual_supported_rates) == set(
         mock_supported_rates
     ), "find_supported_sample_rates should return the correct supported rates"
+    mock_pyaudio_instance.open.assert_not_called()
+
+
+# Test that a test stream is opened when the host API cannot answer is_format_supported
+def test_find_supported_sample_rates_falls_back_to_opening_streams(mock_pyaudio_instance, mock_supported_rates):
+    def open_side_effect(*args, **kwargs):
+        if kwargs.get("rate") not in mock_supported_rates:
+            raise OSError("Invalid sample rate")
+        return Mock()
+
+    mock_pyaudio_instance.is_format_supported.side_effect = OSError("Unanticipated host error")
+    mock_pyaudio_instance.open.side_effect = open_side_effect
+
+    assert find_supported_sample_rates(mock_pyaudio_instance, 0) == mock_supported_rates
 
 
 # Test to verify the choose_sample_rate function
@@ -78,3 +96,57 @@ def test_choose_sample_rate(mocker):
     sample_rate = choose_sample_rate([44100, 48000, 96000])
     # Check if the function returns the correct sample rate
     assert sample_rate == 48000
+
+
+# Test that Whisper's sample rate is preferred, and the highest rate otherwise
+def test_preferred_sample_rate():
+    assert preferred_sample_rate([8000, 16000, 48000]) == 16000
+    assert preferred_sample_rate([44100, 48000]) == 48000
+
+
+# Test to verify the pcm16_to_float32 function
+def test_pcm16_to_float32():
+    pcm_data = np.array([0, 16384, -32768, 32767], dtype=np.int16).tobytes()
+    samples = pcm16_to_float32(pcm_data)
+    assert samples.dtype == np.float32
+    np.testing.assert_allclose(samples, [0.0, 0.5, -1.0, 32767 / 32768])
+
+
+# Fixture to mock an ffmpeg process decoding a file
+@pytest.fixture
+def mock_ffmpeg(mocker):
+    process = Mock()
+    process.stdout = io.BytesIO(b"\x01\x00" * 5)
+    process.stderr = io.BytesIO(b"")
+    process.wait.return_value = 0
+    process.poll.return_value = 0
+    return mocker.patch("src.audio_utils.subprocess.Popen", return_value=process)
+
+
+def test_decode_audio_file_streams_blocks(mock_ffmpeg):
+    blocks = list(decode_audio_file("recording.mp3", 4))
+
+    assert blocks == [b"\x01\x00" * 2, b"\x01\x00" * 2, b"\x01\x00"]
+    command = mock_ffmpeg.call_args.args[0]
+    assert command[0] == "ffmpeg" and "recording.mp3" in command
+    assert command[command.index("-ar") + 1] == "16000"
+
+
+def test_decode_audio_file_raises_on_ffmpeg_error(mock_ffmpeg):
+    process = mock_ffmpeg.return_value
+    process.stderr = io.BytesIO(b"recording.mp3: Invalid data found when processing input")
+    process.wait.return_value = 1
+
+    with pytest.raises(RuntimeError, match="Invalid data"):
+        list(decode_audio_file("recording.mp3", 4))
+
+
+def test_decode_audio_file_stops_ffmpeg_when_closed_early(mock_ffmpeg):
+    process = mock_ffmpeg.return_value
+    process.poll.return_value = None
+
+    blocks = decode_audio_file("recording.mp3", 4)
+    next(blocks)
+    blocks.close()
+
+    process.kill.assert_called_once()
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+import torch
+from whisper.model import ModelDimensions, Whisper
+
+from src.batch_transcription import precomputed, transcribe_batch, transcribe_module
+
+OPTIONS = {"language": "en", "fp16": False, "sample_len": 3, "temperature": 0.0, "condition_on_previous_text": False}
+
+
+# Use a small randomly initialized model, as the tests only compare batched and single transcription
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    dimensions = ModelDimensions(
+        n_mels=80,
+        n_audio_ctx=1500,
+        n_audio_state=32,
+        n_audio_head=2,
+        n_audio_layer=1,
+        n_vocab=51865,
+        n_text_ctx=448,
+        n_text_state=32,
+        n_text_head=2,
+        n_text_layer=1,
+    )
+    model = Whisper(dimensions).eval()
+    # Whisper leaves the decoder's positional embedding uninitialized, to be overwritten by the checkpoint
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.01)
+    return model
+
+
+@pytest.fixture
+def audios():
+    rng = np.random.default_rng(0)
+    return [(0.1 * rng.standard_normal(16000 * duration)).astype(np.float32) for duration in (2, 3)]
+
+
+# Test that batched transcription decodes the same text and tokens as transcribing each chunk alone
+def test_transcribe_batch_matches_single_transcription(model, audios):
+    single_results = [model.transcribe(audio, **OPTIONS) for audio in audios]
+    batch_results = transcribe_batch(model, audios, **OPTIONS)
+
+    assert [result["text"] for result in batch_results] == [result["text"] for result in single_results]
+    for batch_result, single_result in zip(batch_results, single_results):
+        assert [segment["tokens"] for segment in batch_result["segments"]] == [
+            segment["tokens"] for segment in single_result["segments"]
+        ]
+
+
+# Test that the encoder runs once for the whole batch and the model is restored afterwards
+def test_transcribe_batch_encodes_once(model, audios, mocker):
+    forward_spy = mocker.spy(model.encoder, "forward")
+
+    transcribe_batch(model, audios, **OPTIONS)
+
+    assert forward_spy.call_count == 1
+    assert forward_spy.call_args.args[0].shape[0] == len(audios)
+    assert "decode" not in vars(model)
+
+
+# Test that the mel spectrogram of each chunk is computed once, and transcribe's function is restored afterwards
+def test_transcribe_batch_computes_each_mel_once(model, audios, mocker):
+    from whisper.audio import log_mel_spectrogram
+
+    batch_mel_spy = mocker.patch("src.batch_transcription.log_mel_spectrogram", wraps=log_mel_spectrogram)
+    transcribe_mel_spy = mocker.patch.object(transcribe_module, "log_mel_spectrogram", wraps=log_mel_spectrogram)
+
+    transcribe_batch(model, audios, **OPTIONS)
+
+    assert batch_mel_spy.call_count == len(audios)
+    transcribe_mel_spy.assert_not_called()
+    assert transcribe_module.log_mel_spectrogram is transcribe_mel_spy
+
+
+# Test that the model's methods and transcribe's function are restored when the block raises
+def test_precomputed_restores_model_on_error(model):
+    log_mel_spectrogram = transcribe_module.log_mel_spectrogram
+    encoder_forward = model.encoder.forward
+
+    with pytest.raises(RuntimeError):
+        with precomputed(model, [], []):
+            assert transcribe_module.log_mel_spectrogram is not log_mel_spectrogram
+            raise RuntimeError("Transcription failed")
+
+    assert transcribe_module.log_mel_spectrogram is log_mel_spectrogram
+    assert model.encoder.forward == encoder_forward
+    assert "forward" not in vars(model.encoder) and "decode" not in vars(model)
@@ -0,0 +1,104 @@
+import os
+import stat
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from src.control_server import ControlClient, ControlServer
+
+STATUS = {"state": "paused", "chunks_transcribed": 0, "queue_depth": 0}
+
+
+# Fixture to run a control server of a mocked audio service on a temporary socket
+@pytest.fixture
+def control_server(mocker, tmp_path):
+    mocker.patch("src.control_server.CliInterface")
+    audio_service = Mock()
+    audio_service.status.return_value = STATUS
+    server = ControlServer(audio_service, str(tmp_path / "control" / "control.sock"))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+    client = ControlClient(server.socket_path)
+    while not client.is_running():
+        pass
+    yield server, client, server_thread
+
+    if server_thread.is_alive():
+        server.stop()
+        server_thread.join()
+
+
+def test_is_running_without_server(tmp_path):
+    assert not ControlClient(str(tmp_path / "missing.sock")).is_running()
+
+
+# Test that the socket is only accessible to the current user
+def test_socket_is_private(control_server):
+    server, _, _ = control_server
+
+    assert stat.S_IMODE(os.stat(server.socket_path).st_mode) == 0o600
+
+
+# Test that commands call the audio service and answer with its status
+@pytest.mark.parametrize(
+    "command, method", [("start", "start_recording"), ("pause", "pause_recording"), ("flush", "flush")]
+)
+def test_commands_call_the_audio_service(control_server, command, method):
+    server, client, _ = control_server
+
+    assert client.request(command) == (200, STATUS)
+    getattr(server.audio_service, method).assert_called_once_with()
+
+
+# Test that the status is answered while a command is in progress
+def test_status_does_not_wait_for_commands(control_server):
+    server, client, _ = control_server
+    pause_started = threading.Event()
+    pause_released = threading.Event()
+
+    def pause_recording():
+        pause_started.set()
+        pause_released.wait()
+        return True
+
+    server.audio_service.pause_recording.side_effect = pause_recording
+    pause_thread = threading.Thread(target=client.request, args=("pause",))
+    pause_thread.start()
+    pause_started.wait()
+
+    assert client.request("status") == (200, STATUS)
+    pause_released.set()
+    pause_thread.join()
+
+
+# Test that the stop command stops the audio service, then the server
+def test_stop_stops_the_server(control_server):
+    server, client, server_thread = control_server
+
+    assert client.request("stop") == (200, STATUS)
+    server_thread.join()
+
+    server.audio_service.stop.assert_called_once_with()
+    assert not os.path.exists(server.socket_path)
+
+
+# Test that commands sent to a stopped session, unknown commands and wrong methods are answered with errors
+def test_errors(control_server):
+    server, client, _ = control_server
+    server.audio_service.start_recording.return_value = False
+    server.audio_service.flush.side_effect = OSError("Disk full")
+
+    assert client.request("start") == (409, {"error": "The session is stopped."})
+    assert client.request("flush") == (500, {"error": "OSError: Disk full"})
+    assert client.request("restart")[0] == 404
+    assert server.handle_request("GET", "/pause")[0] == 405
+    assert server.handle_request("POST", "/status")[0] == 405
+
+
+# Test that a second server does not take over the socket of a running one
+def test_second_server_is_refused(control_server):
+    server, _, _ = control_server
+
+    with pytest.raises(RuntimeError):
+        ControlServer(Mock(), server.socket_path).serve_forever()
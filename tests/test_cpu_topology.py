@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from src.cpu_topology import (
+    capture_affinity,
+    configure_torch_threads,
+    pin_current_thread,
+    split_cores,
+    torch_thread_counts,
+    transcription_affinity,
+)
+
+
+@pytest.fixture
+def cores(mocker):
+    mocker.patch("src.cpu_topology.available_cores", return_value=[0, 1, 2, 3, 4, 5, 6, 7])
+    mocker.patch("src.cpu_topology.CAPTURE_CORES", 1)
+
+
+# Test that the first CAPTURE_CORES cores are kept for capture and the others for transcription
+def test_split_cores_reserves_capture_cores(cores):
+    assert split_cores() == ([0], [1, 2, 3, 4, 5, 6, 7])
+
+
+# Test that capture and transcription share the cores when there are not enough of them to separate
+@pytest.mark.parametrize("capture_cores", [0, 8])
+def test_split_cores_shares_cores_when_too_few(mocker, cores, capture_cores):
+    mocker.patch("src.cpu_topology.CAPTURE_CORES", capture_cores)
+
+    assert split_cores() == (list(range(8)), list(range(8)))
+
+
+# Test that "auto" splits the transcription cores between the workers and uses one inter-op thread
+@pytest.mark.parametrize("worker_count, intra_op_threads", [(1, 7), (2, 3), (8, 1)])
+def test_torch_thread_counts_auto(mocker, cores, worker_count, intra_op_threads):
+    mocker.patch("src.cpu_topology.TORCH_INTRA_OP_THREADS", "auto")
+    mocker.patch("src.cpu_topology.TORCH_INTER_OP_THREADS", "auto")
+
+    assert torch_thread_counts(worker_count) == (intra_op_threads, 1)
+
+
+# Test that configured thread counts, and None for torch's defaults, are used as they are
+def test_torch_thread_counts_configured(mocker, cores):
+    mocker.patch("src.cpu_topology.TORCH_INTRA_OP_THREADS", 4)
+    mocker.patch("src.cpu_topology.TORCH_INTER_OP_THREADS", None)
+
+    assert torch_thread_counts(2) == (4, None)
+
+
+# Test that the thread pools are only sized when a count is given, and that a started inter-op pool is left as it is
+def test_configure_torch_threads(mocker):
+    set_num_threads_mock = mocker.patch("torch.set_num_threads")
+    mocker.patch("torch.get_num_interop_threads", return_value=4)
+    set_num_interop_threads_mock = mocker.patch("torch.set_num_interop_threads", side_effect=RuntimeError)
+
+    configure_torch_threads(3, 1)
+    configure_torch_threads(None, None)
+
+    set_num_threads_mock.assert_called_once_with(3)
+    set_num_interop_threads_mock.assert_called_once_with(1)
+
+
+# Test that the affinities are only given with CPU_AFFINITY
+@pytest.mark.parametrize("enabled", [False, True])
+def test_affinities_follow_cpu_affinity_setting(mocker, cores, enabled):
+    mocker.patch("src.cpu_topology.CPU_AFFINITY", enabled)
+
+    assert capture_affinity() == ([0] if enabled else None)
+    assert transcription_affinity() == (list(range(1, 8)) if enabled else None)
+
+
+# Test that pinning restricts the calling thread only, leaving the process's main thread unrestricted
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="sched_setaffinity is not available")
+def test_pin_current_thread_pins_calling_thread():
+    from threading import Thread
+
+    main_thread_cores = os.sched_getaffinity(0)
+    core = min(main_thread_cores)
+    thread_cores = []
+
+    def pin():
+        pin_current_thread([core])
+        thread_cores.append(os.sched_getaffinity(0))
+
+    thread = Thread(target=pin)
+    thread.start()
+    thread.join()
+
+    assert thread_cores == [{core}]
+    assert os.sched_getaffinity(0) == main_thread_cores
+
+
+# Test that None leaves the thread unrestricted
+def test_pin_current_thread_without_cores(mocker):
+    setaffinity_mock = mocker.patch("src.cpu_topology.os.sched_setaffinity", create=True)
+
+    pin_current_thread(None)
+
+    setaffinity_mock.assert_not_called()
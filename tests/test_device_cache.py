@@ -0,0 +1,43 @@
+from unittest.mock import Mock
+
+import pytest
+
+from src.device_cache import DeviceCache
+
+DEVICE_INFOS = [
+    {"name": "Built-in Microphone", "hostApi": 0, "maxInputChannels": 2, "defaultSampleRate": 48000.0},
+    {"name": "USB Microphone", "hostApi": 1, "maxInputChannels": 1, "defaultSampleRate": 44100.0},
+]
+
+
+@pytest.fixture
+def pyaudio_instance():
+    instance = Mock()
+    instance.get_host_api_info_by_index.side_effect = lambda index: {"name": ["ALSA", "JACK"][index]}
+    return instance
+
+
+def test_devices_are_keyed_by_host_api_and_name(tmp_path, pyaudio_instance):
+    cache = DeviceCache(str(tmp_path / "devices.json"), pyaudio_instance, DEVICE_INFOS)
+
+    assert cache.device_keys == ["ALSA/Built-in Microphone", "JACK/USB Microphone"]
+
+
+def test_entries_survive_a_restart(tmp_path, pyaudio_instance):
+    cache = DeviceCache(str(tmp_path / "devices.json"), pyaudio_instance, DEVICE_INFOS)
+    cache.set_sample_rates(1, [16000, 44100])
+    cache.set_default(1, 16000)
+    cache.save()
+
+    reloaded = DeviceCache(str(tmp_path / "devices.json"), pyaudio_instance, DEVICE_INFOS)
+    assert reloaded.get_sample_rates(1) == [16000, 44100]
+    assert reloaded.get_default() == (1, 16000)
+
+
+def test_unreadable_cache_file_is_ignored(tmp_path, pyaudio_instance):
+    (tmp_path / "devices.json").write_text("{not json")
+
+    cache = DeviceCache(str(tmp_path / "devices.json"), pyaudio_instance, DEVICE_INFOS)
+
+    assert cache.get_default() is None
+    assert cache.get_sample_rates(0) is None
@@ -0,0 +1,86 @@
+import subprocess
+import sys
+from unittest.mock import Mock
+
+import pytest
+
+from src.file_transcriber import FileTranscriber, find_audio_files
+
+
+# Test that transcribing files, and streams, works without PortAudio: importing pyaudio fails in the subprocess
+def test_import_does_not_need_pyaudio():
+    code = "import sys; sys.modules['pyaudio'] = None; import src.file_transcriber, src.ingest_server"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
+
+
+# Fixture to create a FileTranscriber with a mocked model, decoding mocked files
+@pytest.fixture
+def file_transcriber(mocker):
+    mocker.patch("src.file_transcriber.load_transcription_model", return_value=Mock())
+    mocker.patch("src.file_transcriber.CliInterface")
+    mocker.patch("src.file_transcriber.TRANSCRIPTION_WORKERS", 1)
+    return FileTranscriber()
+
+
+def test_find_audio_files(tmp_path):
+    (tmp_path / "b.wav").touch()
+    (tmp_path / "nested").mkdir()
+    (tmp_path / "nested" / "a.MP3").touch()
+    (tmp_path / "b.wav.json").touch()
+
+    audio_files = find_audio_files([str(tmp_path), "other.ogg"])
+
+    assert audio_files == [str(tmp_path / "b.wav"), str(tmp_path / "nested" / "a.MP3"), "other.ogg"]
+
+
+def test_transcribe_file_streams_audio_through_the_pipeline(file_transcriber, mocker):
+    decode_mock = mocker.patch("src.file_transcriber.decode_audio_file", return_value=[b"\x00\x01" * 8000] * 3)
+    whisper_service_mock = mocker.patch("src.file_transcriber.WhisperService")
+    audio_processor_mock = mocker.patch("src.file_transcriber.AudioProcessor")
+
+    duration = file_transcriber.transcribe_file("recording.wav")
+
+    # Every file shares the model loaded once and the metrics, and writes its results next to it
+    whisper_service_mock.assert_called_once_with(
+        file_transcriber.model,
+        file_transcriber.model_lock,
+        output_file_path="recording.wav.json",
+        metrics=file_transcriber.metrics,
+    )
+    audio_processor = audio_processor_mock.return_value
+    decode_mock.assert_called_once_with("recording.wav", audio_processor.desired_length)
+    assert audio_processor.add_audio.call_count == 3
+    audio_processor.finalize_recording.assert_called_once()
+    audio_processor.stop_processing.assert_called_once_with()
+    assert duration == pytest.approx(1.5)
+
+
+def test_transcribe_file_skips_output_when_decoding_fails(file_transcriber, mocker):
+    mocker.patch("src.file_transcriber.decode_audio_file", side_effect=RuntimeError("ffmpeg failed"))
+    mocker.patch("src.file_transcriber.WhisperService")
+    audio_processor_mock = mocker.patch("src.file_transcriber.AudioProcessor")
+
+    assert file_transcriber.transcribe_file("broken.wav") is None
+    audio_processor_mock.return_value.stop_processing.assert_called_once_with(output_results=False)
+
+
+def test_run_transcribes_every_file_and_prints_throughput(file_transcriber, mocker):
+    mocker.patch("src.file_transcriber.find_audio_files", return_value=["a.wav", "b.wav", "c.wav"])
+    transcribe_file_mock = mocker.patch.object(file_transcriber, "transcribe_file", side_effect=[3600, None, 1800])
+    print_summary_mock = mocker.patch.object(file_transcriber, "print_summary")
+
+    assert not file_transcriber.run(["recordings"])
+
+    assert [call.args[0] for call in transcribe_file_mock.call_args_list] == ["a.wav", "b.wav", "c.wav"]
+    assert print_summary_mock.call_args.args[0] == [3600, None, 1800]
+
+
+def test_print_summary(file_transcriber, mocker):
+    cli_interface_mock = mocker.patch("src.file_transcriber.CliInterface")
+
+    file_transcriber.print_summary([3600, None, 1800], 1800)
+
+    cli_interface_mock.print_info.assert_called_once_with(
+        "Transcribed 2 files, 1.50 hours of audio, in 0.50 hours: 3.00 audio hours per wall-clock hour."
+    )
+    cli_interface_mock.print_warning.assert_called_once_with("1 files could not be transcribed.")
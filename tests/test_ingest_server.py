@@ -0,0 +1,109 @@
+import asyncio
+import json
+import threading
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from src.ingest_server import IngestServer, read_message, write_message
+
+
+def speech_like_audio(duration, sample_rate=16000):
+    # A tone in syllable-like bursts, as 16-bit PCM bytes, so that voice activity detection keeps it
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    envelope = (np.sin(2 * np.pi * 4 * t) > 0).astype(np.float32)
+    return (0.3 * 32767 * envelope * np.sin(2 * np.pi * 220 * t)).astype(np.int16).tobytes()
+
+
+# Fixture to run an ingest server with a mocked model on any free port
+@pytest.fixture
+def ingest_server(mocker, tmp_path):
+    mocker.patch("src.ingest_server.CliInterface")
+    mocker.patch("src.ingest_server.TRANSCRIPTION_WORKERS", 1)
+    mocker.patch("src.ingest_server.MetricsReporter")
+    mocker.patch("src.whisper_service.LANGUAGE_CODE", "en")
+    model = Mock(spec=["transcribe"])
+    model.transcribe.return_value = {"text": "Hello", "segments": []}
+    server = IngestServer("127.0.0.1", 0, max_sessions=2, output_dir=str(tmp_path / "results"), model=model)
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+    server.ready.wait()
+    yield server
+
+    server.stop()
+    server_thread.join()
+
+
+def stream(server, header, messages):
+    # Send a header and messages to the server, and return the messages it answers with until it closes the connection
+    async def client():
+        reader, writer = await asyncio.open_connection(server.host, server.port)
+        write_message(writer, header)
+        for message_header, payload in messages:
+            write_message(writer, message_header, payload)
+        await writer.drain()
+        answers = []
+        try:
+            while True:
+                answers.append((await read_message(reader))[0])
+        except asyncio.IncompleteReadError:
+            pass
+        writer.close()
+        return answers
+
+    return asyncio.run(client())
+
+
+# Test that the results of a stream are sent back, followed by "done", and written to the output directory
+def test_stream_is_transcribed(ingest_server, tmp_path):
+    audio = speech_like_audio(2)
+    messages = [({"type": "audio"}, audio[:32000]), ({"type": "audio"}, audio[32000:]), ({"type": "end"}, b"")]
+
+    answers = stream(ingest_server, {"session_id": "call-1", "sample_rate": 16000}, messages)
+
+    assert answers[-1] == {"type": "done"}
+    results = [answer["result"] for answer in answers[:-1]]
+    assert results and all(answer["type"] == "result" for answer in answers[:-1])
+    assert all(result["text"] == "Hello" and result["source"] == "call-1" for result in results)
+    with open(tmp_path / "results" / "call-1.json") as file:
+        assert json.load(file)["source"] == "call-1"
+    assert ingest_server.sessions == set()
+
+
+# Test that invalid headers are refused with an error message
+@pytest.mark.parametrize(
+    "header, error",
+    [
+        ({"session_id": "../call", "sample_rate": 16000}, "session_id"),
+        ({"session_id": "call", "sample_rate": 1000}, "sample_rate"),
+        ({"session_id": "call", "sample_rate": "16000"}, "sample_rate"),
+        ([1, 2], "JSON object"),
+    ],
+)
+def test_invalid_header_is_refused(ingest_server, header, error):
+    answers = stream(ingest_server, header, [])
+
+    assert len(answers) == 1
+    assert answers[0]["type"] == "error" and error in answers[0]["error"]
+
+
+# Test that a session already being transcribed, or one more than max_sessions, is refused
+def test_busy_sessions_are_refused(ingest_server):
+    ingest_server.sessions.update({"call-1", "call-2"})
+
+    duplicate = stream(ingest_server, {"session_id": "call-1", "sample_rate": 16000}, [])
+    too_many = stream(ingest_server, {"session_id": "call-3", "sample_rate": 16000}, [])
+
+    assert "already being transcribed" in duplicate[0]["error"]
+    assert "as many streams as it can" in too_many[0]["error"]
+
+
+# Test that audio payloads with half a sample end the stream with an error
+def test_odd_payload_is_refused(ingest_server):
+    answers = stream(
+        ingest_server, {"session_id": "call-1", "sample_rate": 16000}, [({"type": "audio"}, b"\x00\x00\x00")]
+    )
+
+    assert answers[-1]["type"] == "error" and "whole 16-bit samples" in answers[-1]["error"]
+    assert ingest_server.sessions == set()
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import torch
+from whisper.model import ModelDimensions, Whisper
+
+from src.language_detector import LanguageDetector, language_probabilities
+
+
+def low_confidence_result():
+    return {"text": " Hallo", "segments": [{"avg_logprob": -1.5}, {"avg_logprob": -0.9}]}
+
+
+def confident_result():
+    return {"text": " Hello", "segments": [{"avg_logprob": -0.2}]}
+
+
+# Test that the probabilities of the first chunks are averaged, weighted by duration, until the detection duration
+def test_detection_averages_chunks_until_duration():
+    detector = LanguageDetector(detection_duration=10, recheck_interval=None, recheck_logprob=-1.0)
+
+    assert not detector.add_detection({"de": 0.6, "en": 0.4}, 2)
+    assert (detector.language, detector.probability) == ("de", pytest.approx(0.6))
+    assert detector.add_detection({"de": 0.1, "en": 0.9}, 8)
+    assert (detector.language, detector.probability) == ("en", pytest.approx(0.8))
+    assert not detector.needs_detection(5)
+
+
+# Test that chunks too short for a reliable detection are not detected
+def test_short_chunks_are_not_detected():
+    detector = LanguageDetector(detection_duration=10, recheck_interval=None, recheck_logprob=-1.0)
+
+    assert not detector.needs_detection(0.5)
+    assert detector.needs_detection(1.5)
+
+
+# Test that the language is detected again once the interval of transcribed audio has elapsed
+def test_detection_restarts_after_interval():
+    detector = LanguageDetector(detection_duration=2, recheck_interval=60, recheck_logprob=-1.0)
+    detector.add_detection({"en": 0.9}, 2)
+
+    detector.record_result(confident_result(), 30)
+    assert not detector.needs_detection(5)
+    detector.record_result(confident_result(), 30)
+    assert detector.needs_detection(5)
+    # The language is kept until the new detection has results
+    assert detector.language == "en"
+    detector.add_detection({"fr": 0.7}, 2)
+    assert (detector.language, detector.probability) == ("fr", pytest.approx(0.7))
+
+
+# Test that a chunk decoded with low confidence starts a new detection
+def test_detection_restarts_on_low_confidence():
+    detector = LanguageDetector(detection_duration=2, recheck_interval=None, recheck_logprob=-1.0)
+    detector.add_detection({"en": 0.9}, 2)
+
+    detector.record_result({"text": "", "segments": []}, 5)
+    assert not detector.needs_detection(5)
+    detector.record_result(low_confidence_result(), 5)
+    assert detector.needs_detection(5)
+
+
+# Test that language probabilities come from the model's detection on the first window of the audio
+def test_language_probabilities_with_model():
+    torch.manual_seed(0)
+    dimensions = ModelDimensions(
+        n_mels=80,
+        n_audio_ctx=1500,
+        n_audio_state=32,
+        n_audio_head=2,
+        n_audio_layer=1,
+        n_vocab=51865,
+        n_text_ctx=448,
+        n_text_state=32,
+        n_text_head=2,
+        n_text_layer=1,
+    )
+    model = Whisper(dimensions).eval()
+    # Whisper leaves the decoder's positional embedding uninitialized, to be overwritten by the checkpoint
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.01)
+    audio = (0.1 * np.random.default_rng(0).standard_normal(16000 * 2)).astype(np.float32)
+
+    probabilities = language_probabilities(model, audio)
+
+    assert "en" in probabilities
+    assert sum(probabilities.values()) == pytest.approx(1, abs=1e-3)
+
+
+# Test that English-only models are not detected
+def test_language_probabilities_with_english_model():
+    model = type("EnglishModel", (), {"is_multilingual": False})()
+
+    assert language_probabilities(model, np.zeros(16000, dtype=np.float32)) == {"en": 1.0}
@@ -0,0 +1,125 @@
+import urllib.request
+
+import pytest
+
+from src.metrics import ChunkTimings, Histogram, MetricsReporter, PipelineMetrics
+
+
+# Test that values fall into the first bucket whose bound they do not exceed
+def test_histogram_observe():
+    histogram = Histogram((1, 5))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value)
+
+    assert histogram.counts == [2, 1, 1]
+    assert histogram.count == 4
+    assert histogram.sum == 14.5
+    assert histogram.quantile(0.5) == 1
+    assert histogram.quantile(0.75) == 5
+    assert histogram.quantile(1) is None
+
+
+# Test that histograms are rendered with cumulative buckets
+def test_histogram_render():
+    histogram = Histogram((1, 5))
+    histogram.observe(0.5)
+    histogram.observe(3)
+
+    lines = histogram.render("latency_seconds", "Latency.")
+
+    assert 'latency_seconds_bucket{le="1"} 1' in lines
+    assert 'latency_seconds_bucket{le="5"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 2' in lines
+    assert "latency_seconds_count 2" in lines
+
+
+# Test that a chunk's timestamps are recorded at each stage and observed once its result is written
+def test_chunk_stages_are_observed(mocker):
+    metrics = PipelineMetrics()
+    timings = ChunkTimings(2.0, 0.0)
+    monotonic_mock = mocker.patch("src.metrics.time.monotonic")
+
+    for now, record in [
+        (0.1, lambda: metrics.chunk_queued(timings)),
+        (0.5, lambda: metrics.chunk_dequeued(timings)),
+        (0.6, lambda: metrics.transcription_started([timings, None])),
+        (1.6, lambda: metrics.transcription_finished([timings, None], 1.0)),
+        (2.0, lambda: metrics.chunk_written(timings)),
+    ]:
+        monotonic_mock.return_value = now
+        record()
+
+    assert (timings.enqueue, timings.dequeue, timings.decode_start, timings.decode_end, timings.write) == (
+        0.1,
+        0.5,
+        0.6,
+        1.6,
+        2.0,
+    )
+    assert metrics.histograms["queue_wait"].sum == pytest.approx(0.4)
+    assert metrics.histograms["decode"].sum == pytest.approx(1.0)
+    assert metrics.histograms["reorder_wait"].sum == pytest.approx(0.4)
+    assert metrics.histograms["end_to_end"].sum == pytest.approx(2.0)
+    assert metrics.counters["chunks_written"] == 1
+    assert metrics.gauges()["real_time_factor"] == pytest.approx(0.5)
+
+
+# Test that the queue depth and the lag follow the chunks waiting for a result
+def test_gauges_track_pending_chunks(mocker):
+    metrics = PipelineMetrics()
+    mocker.patch("src.metrics.time.monotonic", return_value=10.0)
+    first = ChunkTimings(1.0, 4.0)
+    second = ChunkTimings(1.0, 7.0)
+    metrics.chunk_queued(first)
+    metrics.chunk_queued(second)
+    metrics.chunk_dequeued(first)
+
+    gauges = metrics.gauges()
+    assert gauges["queue_depth"] == 1
+    assert gauges["transcription_lag_seconds"] == 6.0
+
+    metrics.chunk_written(first)
+    assert metrics.gauges()["transcription_lag_seconds"] == 3.0
+
+
+# Test that the real-time factor only covers recent transcriptions
+def test_real_time_factor_window(mocker):
+    metrics = PipelineMetrics()
+    monotonic_mock = mocker.patch("src.metrics.time.monotonic", return_value=0.0)
+    metrics.transcription_finished([ChunkTimings(1.0, 0.0)], 3.0)
+    monotonic_mock.return_value = 100.0
+    metrics.transcription_finished([ChunkTimings(4.0, 0.0)], 1.0)
+
+    assert metrics.gauges()["real_time_factor"] == 0.25
+    assert metrics.counters["transcription_seconds"] == 4.0
+
+
+# Test that counters, dropped chunks and gauges are rendered in the Prometheus text format
+def test_render():
+    metrics = PipelineMetrics()
+    metrics.count("transcription_retries", 2)
+    metrics.chunks_dropped("overrun", 3)
+
+    text = metrics.render()
+
+    assert "audio_transcriber_transcription_retries_total 2" in text.splitlines()
+    assert 'audio_transcriber_chunks_dropped_total{reason="overrun"} 3' in text.splitlines()
+    assert "# TYPE audio_transcriber_queue_depth gauge" in text
+    assert 'audio_transcriber_chunk_end_to_end_seconds_bucket{le="+Inf"} 0' in text
+    assert "2 retries" in metrics.summary()
+
+
+# Test that the HTTP endpoint serves the metrics, on an ephemeral port
+def test_metrics_reporter_serves_metrics(mocker):
+    mocker.patch("src.metrics.CliInterface")
+    metrics = PipelineMetrics()
+    metrics.count("transcription_failures")
+    reporter = MetricsReporter(metrics, port=0)
+    reporter.start()
+    try:
+        url = f"http://127.0.0.1:{reporter.server.server_port}/metrics"
+        with urllib.request.urlopen(url) as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "audio_transcriber_transcription_failures_total 1" in response.read().decode()
+    finally:
+        reporter.stop()
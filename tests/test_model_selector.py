@@ -0,0 +1,98 @@
+import pytest
+
+from src.model_selector import RETRY_WINDOWS, ModelSelector, check_model_sizes
+
+
+@pytest.fixture
+def clock(mocker):
+    return mocker.patch("src.model_selector.time.monotonic", return_value=0.0)
+
+
+@pytest.fixture
+def selector(clock):
+    return ModelSelector(["tiny", "base", "small"], "base", window=10, step_down_rtf=0.8, step_up_rtf=0.3, queue_growth=2)
+
+
+def record_window(selector, clock, real_time_factor, queue_depths=(0, 0)):
+    # Record one transcription per second for a whole window, returning the last decision
+    decision = None
+    start = clock.return_value
+    for second in range(1, selector.window + 1):
+        clock.return_value = start + second
+        queue_depth = queue_depths[0] if second < selector.window else queue_depths[1]
+        decision = selector.record(selector.model_size, real_time_factor, 1.0, queue_depth)
+    return decision
+
+
+def test_steps_down_when_falling_behind(selector, clock):
+    assert record_window(selector, clock, 1.2) == "tiny"
+    assert selector.model_size == "tiny"
+
+
+def test_steps_down_when_queue_grows(selector, clock):
+    assert record_window(selector, clock, 0.5, queue_depths=(0, 3)) == "tiny"
+
+
+def test_steps_up_with_headroom(selector, clock):
+    assert record_window(selector, clock, 0.1) == "small"
+
+
+# Test that the real-time factors between the two thresholds keep the current size
+def test_hysteresis_keeps_size(selector, clock):
+    assert record_window(selector, clock, 0.5) is None
+    assert record_window(selector, clock, 0.7) is None
+    assert selector.model_size == "base"
+
+
+# Test that a full window is measured before switching, and after each switch
+def test_no_switch_before_a_full_window(selector, clock):
+    clock.return_value = 5.0
+    assert selector.record("base", 5.0, 1.0, 0) is None
+    clock.return_value = 10.0
+    assert selector.record("base", 5.0, 1.0, 0) == "tiny"
+    clock.return_value = 11.0
+    assert selector.record("tiny", 0.01, 1.0, 0) is None
+
+
+def test_measurements_of_other_sizes_are_ignored(selector, clock):
+    clock.return_value = 20.0
+    assert selector.record("small", 5.0, 1.0, 0) is None
+    assert len(selector.samples) == 0
+
+
+# Test that a size that fell behind is not tried again until RETRY_WINDOWS windows have passed
+def test_size_that_fell_behind_is_retried_later(selector, clock):
+    assert record_window(selector, clock, 1.2) == "tiny"
+    assert record_window(selector, clock, 0.1) is None
+    assert selector.model_size == "tiny"
+
+    clock.return_value += RETRY_WINDOWS * selector.window
+    record_window(selector, clock, 0.1)
+    assert selector.model_size == "base"
+
+
+def test_bounds(clock):
+    selector = ModelSelector(["tiny", "base"], "tiny", window=10)
+    assert record_window(selector, clock, 2.0) is None
+    assert selector.model_size == "tiny"
+
+
+# Test that model sizes that are unknown, out of order or without the initial size are refused, naming the config
+@pytest.mark.parametrize(
+    "model_sizes, error",
+    [
+        (["tiny", "huge"], "unknown Whisper model size: 'huge'"),
+        (["small", "base"], "from the smallest to the largest"),
+        (["base", "base.en"], "one per size"),
+        (["tiny", "small"], "must include MODEL_SIZE 'base'"),
+    ],
+)
+def test_invalid_model_sizes_are_refused(model_sizes, error):
+    with pytest.raises(ValueError, match="ADAPTIVE_MODEL_SIZES") as exc_info:
+        check_model_sizes(model_sizes, "base")
+
+    assert error in str(exc_info.value)
+
+
+def test_valid_model_sizes():
+    check_model_sizes(["base.en", "small", "turbo", "large-v3"], "small")
@@ -0,0 +1,129 @@
+import os
+import stat
+import threading
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from src.model_server import ModelServer, ModelServerClient
+
+
+# Fixture to run a model server with a mocked model on a temporary socket
+@pytest.fixture
+def model_server(mocker, tmp_path):
+    mocker.patch("src.model_server.CliInterface")
+    mocker.patch("src.model_server.TRANSCRIPTION_WORKERS", 1)
+    model = Mock()
+    model.transcribe.side_effect = lambda audio, **_options: {"text": f"{len(audio)} samples", "mean": np.float32(0.5)}
+    load_model_mock = mocker.patch("whisper.load_model", return_value=model)
+    server = ModelServer(str(tmp_path / "server" / "model-server.sock"))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+    client = ModelServerClient(server.socket_path, "base")
+    while not client.ping():
+        pass
+    yield server, load_model_mock
+
+    server.stop()
+    server_thread.join()
+
+
+def test_ping_without_server(tmp_path):
+    assert not ModelServerClient(str(tmp_path / "missing.sock"), "base").ping()
+
+
+# Test that a ping without a model size checks that the server is running without loading a model
+def test_ping_without_model_size(model_server):
+    server, load_model_mock = model_server
+
+    assert ModelServerClient(server.socket_path, None).ping()
+    assert None not in server.models
+    assert None not in [call.args[0] for call in load_model_mock.call_args_list]
+
+
+def test_transcribe_through_server(model_server):
+    server, load_model_mock = model_server
+    client = ModelServerClient(server.socket_path, "base")
+
+    result = client.transcribe(np.zeros(16000, dtype=np.float32), language="en")
+
+    assert result == {"text": "16000 samples", "mean": 0.5}
+    load_model_mock.assert_called_once_with("base")
+    assert load_model_mock.return_value.transcribe.call_args.kwargs == {"language": "en"}
+
+
+def test_transcribe_batch_through_server(model_server, mocker):
+    server, _ = model_server
+    batch_mock = mocker.patch(
+        "src.batch_transcription.transcribe_batch", side_effect=lambda _model, audios, **_options: [
+            {"text": str(audio[0])} for audio in audios
+        ]
+    )
+    client = ModelServerClient(server.socket_path, "base")
+
+    results = client.transcribe_batch([np.ones(100, dtype=np.float32), np.full(50, 2, dtype=np.float32)])
+
+    assert results == [{"text": "1.0"}, {"text": "2.0"}]
+    assert [len(audio) for audio in batch_mock.call_args.args[1]] == [100, 50]
+
+
+def test_detect_language_through_server(model_server, mocker):
+    server, _ = model_server
+    detect_mock = mocker.patch("src.language_detector.language_probabilities", return_value={"en": 0.9, "fr": 0.1})
+    client = ModelServerClient(server.socket_path, "base")
+
+    probabilities = client.language_probabilities(np.ones(100, dtype=np.float32))
+
+    assert probabilities == {"en": 0.9, "fr": 0.1}
+    assert len(detect_mock.call_args.args[1]) == 100
+
+
+def test_models_stay_loaded_between_clients(model_server):
+    server, load_model_mock = model_server
+    for _ in range(3):
+        ModelServerClient(server.socket_path, "base").transcribe(np.zeros(10, dtype=np.float32))
+
+    load_model_mock.assert_called_once_with("base")
+
+
+# Test that loading a model does not hold up requests for a model already loaded
+def test_loading_a_model_does_not_block_loaded_models(model_server):
+    server, load_model_mock = model_server
+    model = load_model_mock.return_value
+    loading_started = threading.Event()
+    loading_released = threading.Event()
+
+    def load_model(model_size):
+        if model_size == "large":
+            loading_started.set()
+            loading_released.wait()
+        return model
+
+    load_model_mock.side_effect = load_model
+    large_client = ModelServerClient(server.socket_path, "large")
+    large_thread = threading.Thread(target=large_client.transcribe, args=(np.zeros(10, dtype=np.float32),))
+    large_thread.start()
+    loading_started.wait()
+
+    result = ModelServerClient(server.socket_path, "base").transcribe(np.zeros(10, dtype=np.float32))
+    loading_released.set()
+    large_thread.join()
+
+    assert result["text"] == "10 samples"
+
+
+def test_server_errors_are_raised_by_the_client(model_server):
+    server, load_model_mock = model_server
+    load_model_mock.return_value.transcribe.side_effect = ValueError("bad audio")
+    client = ModelServerClient(server.socket_path, "base")
+
+    with pytest.raises(RuntimeError, match="ValueError: bad audio"):
+        client.transcribe(np.zeros(10, dtype=np.float32))
+
+
+def test_socket_is_private_and_removed_on_stop(model_server):
+    server, _ = model_server
+    assert stat.S_IMODE(os.stat(server.socket_path).st_mode) & 0o077 == 0
+    server.stop()
+    assert not ModelServerClient(server.socket_path, "base").ping()
@@ -0,0 +1,138 @@
+from unittest.mock import MagicMock, Mock
+
+import numpy as np
+import pyaudio
+import pytest
+
+from src.multi_source_recorder import (
+    AudioSource,
+    MultiSourceRecorder,
+    find_input_device,
+    resolve_audio_sources,
+    source_output_path,
+)
+
+DEVICE_INFOS = [
+    {"name": "Speakers", "maxInputChannels": 0},
+    {"name": "Scarlett 4i4 USB", "maxInputChannels": 4},
+    {"name": "USB Microphone", "maxInputChannels": 1},
+]
+
+
+@pytest.fixture
+def device_cache():
+    cache = Mock()
+    cache.get_sample_rates.side_effect = lambda device_index: {1: [44100, 48000], 2: [16000, 48000]}[device_index]
+    return cache
+
+
+# Test that the output file of a source is named after its label
+def test_source_output_path():
+    assert source_output_path("results/transcription.json", "alice") == "results/transcription.alice.json"
+
+
+# Test that devices are found by index or by a part of their name that matches only one input device
+def test_find_input_device():
+    assert find_input_device(DEVICE_INFOS, 2) == 2
+    assert find_input_device(DEVICE_INFOS, "scarlett") == 1
+    with pytest.raises(ValueError, match="matches 2 input devices"):
+        find_input_device(DEVICE_INFOS, "USB")
+    with pytest.raises(ValueError, match="matches 0 input devices"):
+        find_input_device(DEVICE_INFOS, "Speakers")
+    with pytest.raises(ValueError):
+        find_input_device(DEVICE_INFOS, 0)
+
+
+# Test that each device is captured at one sample rate, Whisper's if the device supports it
+def test_resolve_audio_sources(device_cache):
+    sources = resolve_audio_sources(
+        Mock(),
+        DEVICE_INFOS,
+        device_cache,
+        [
+            {"label": "alice", "device": "Scarlett", "channel": 0},
+            {"label": "bob", "device": "Scarlett", "channel": 3},
+            {"label": "carol", "device": "Microphone"},
+        ],
+    )
+
+    assert [(source.label, source.device_index, source.channel, source.sample_rate) for source in sources] == [
+        ("alice", 1, 0, 48000),
+        ("bob", 1, 3, 48000),
+        ("carol", 2, 0, 16000),
+    ]
+    device_cache.save.assert_called_once()
+
+
+# Test that sources with the same label or a channel the device does not have are refused
+@pytest.mark.parametrize(
+    "source_configs, message",
+    [
+        ([{"label": "alice", "device": 1}, {"label": "alice", "device": 2}], "Several audio sources"),
+        ([{"label": "alice", "device": 2, "channel": 1}], "has no channel 1"),
+    ],
+)
+def test_resolve_audio_sources_refuses_invalid_sources(device_cache, source_configs, message):
+    with pytest.raises(ValueError, match=message):
+        resolve_audio_sources(Mock(), DEVICE_INFOS, device_cache, source_configs)
+
+
+@pytest.fixture
+def recorder(mocker):
+    mocker.patch("src.multi_source_recorder.CliInterface")
+    sources = [AudioSource("alice", 1, 0, 48000), AudioSource("bob", 1, 2, 48000), AudioSource("carol", 2, 0, 16000)]
+    audio_processors = [Mock(), Mock(), Mock()]
+    return MultiSourceRecorder(MagicMock(), sources, audio_processors)
+
+
+# Test that each device is opened once, with enough channels for its sources
+def test_start_recording_opens_one_stream_per_device(recorder):
+    recorder.start_recording()
+
+    opened = [
+        (call.kwargs["input_device_index"], call.kwargs["channels"], call.kwargs["rate"])
+        for call in recorder.pyaudio_instance.open.call_args_list
+    ]
+    assert opened == [(1, 3, 48000), (2, 1, 16000)]
+    assert recorder.recording
+
+
+# Test that the channels of a stream are split between the AudioProcessors of their sources
+def test_callback_splits_channels(recorder):
+    alice, bob, _ = recorder.audio_processors
+    callback = recorder.create_callback(3, recorder.devices[1][1])
+    frames = np.array([[1, 2, 3], [4, 5, 6]], dtype=np.int16)
+
+    assert callback(frames.tobytes(), 2, {}, 0) == (None, pyaudio.paContinue)
+
+    assert alice.audio_callback.call_args.args[0] == np.array([1, 4], dtype=np.int16).tobytes()
+    assert bob.audio_callback.call_args.args[0] == np.array([3, 6], dtype=np.int16).tobytes()
+
+
+# Test that if a device cannot be opened, the streams already opened are closed
+def test_start_recording_closes_streams_on_failure(recorder):
+    first_stream = Mock()
+    recorder.pyaudio_instance.open.side_effect = [first_stream, OSError("Device unavailable")]
+
+    with pytest.raises(OSError):
+        recorder.start_recording()
+
+    first_stream.close.assert_called_once()
+    assert recorder.streams == []
+    assert not recorder.recording
+
+
+# Test that pausing finalizes every source and waits for all of them to be transcribed
+def test_pause_recording(recorder):
+    recorder.pyaudio_instance.open.side_effect = lambda **_kwargs: Mock()
+    recorder.start_recording()
+    streams = list(recorder.streams)
+
+    recorder.pause_recording()
+
+    for stream in streams:
+        stream.close.assert_called_once()
+    for audio_processor in recorder.audio_processors:
+        audio_processor.finalize_recording.assert_called_once()
+        audio_processor.wait_for_processing.assert_called_once()
+    assert not recorder.recording
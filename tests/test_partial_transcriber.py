@@ -0,0 +1,67 @@
+from unittest.mock import Mock
+
+import numpy as np
+import pytest
+
+from src.partial_transcriber import PartialTranscriber
+
+
+@pytest.fixture
+def partial_transcriber(mocker):
+    load_model_mock = mocker.patch("src.partial_transcriber.load_transcription_model")
+    load_model_mock.return_value.transcribe.return_value = {"text": " Hello"}
+    audio_processor = Mock(next_sequence=3)
+    audio_processor.whisper_transcription.transcription_options.return_value = {"language": "en", "word_timestamps": True}
+    audio_processor.open_segment.return_value = (3, np.zeros(16000, dtype=np.float32))
+    transcriber = PartialTranscriber(audio_processor, model_size="tiny", interval=0.01)
+    transcriber.model_future.result()
+    return transcriber
+
+
+def test_open_segment_is_transcribed_as_partial_result(partial_transcriber):
+    partial_transcriber.transcribe_open_segment()
+
+    model = partial_transcriber.model_future.result()
+    assert model.transcribe.call_args.kwargs == {"language": "en", "word_timestamps": False}
+    append_mock = partial_transcriber.whisper_transcription.append_partial_result
+    assert append_mock.call_args.args[:2] == (" Hello", 3)
+    is_open = append_mock.call_args.args[2]
+    assert is_open()
+
+
+# Test that a segment is only transcribed again once it has grown
+def test_unchanged_segment_is_not_transcribed_again(partial_transcriber):
+    partial_transcriber.transcribe_open_segment()
+    partial_transcriber.transcribe_open_segment()
+    partial_transcriber.audio_processor.open_segment.return_value = (3, np.zeros(24000, dtype=np.float32))
+    partial_transcriber.transcribe_open_segment()
+
+    assert partial_transcriber.model_future.result().transcribe.call_count == 2
+
+
+def test_short_or_missing_segments_are_skipped(partial_transcriber):
+    partial_transcriber.audio_processor.open_segment.return_value = None
+    partial_transcriber.transcribe_open_segment()
+    partial_transcriber.audio_processor.open_segment.return_value = (3, np.zeros(4000, dtype=np.float32))
+    partial_transcriber.transcribe_open_segment()
+
+    partial_transcriber.model_future.result().transcribe.assert_not_called()
+
+
+# Test that a partial result is discarded when its segment was queued before it is appended
+def test_partial_result_of_ended_segment_is_discarded(partial_transcriber):
+    partial_transcriber.transcribe_open_segment()
+    is_open = partial_transcriber.whisper_transcription.append_partial_result.call_args.args[2]
+    partial_transcriber.audio_processor.next_sequence = 4
+
+    assert not is_open()
+
+
+def test_start_and_stop(partial_transcriber, mocker):
+    transcribe_mock = mocker.patch.object(partial_transcriber, "transcribe_open_segment")
+    partial_transcriber.start()
+    while transcribe_mock.call_count == 0:
+        partial_transcriber.stopped.wait(0.01)
+    partial_transcriber.stop()
+
+    assert not partial_transcriber.thread.is_alive()
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+import torch
+import whisper
+from whisper.model import ModelDimensions, Whisper
+
+from src.quantization import load_quantized_model, load_whisper_model, quantize_model, quantized_model_path
+
+OPTIONS = {"language": "en", "fp16": False, "sample_len": 3, "temperature": 0.0, "condition_on_previous_text": False}
+
+
+def make_model():
+    torch.manual_seed(0)
+    dimensions = ModelDimensions(
+        n_mels=80,
+        n_audio_ctx=1500,
+        n_audio_state=32,
+        n_audio_head=2,
+        n_audio_layer=1,
+        n_vocab=51865,
+        n_text_ctx=448,
+        n_text_state=32,
+        n_text_head=2,
+        n_text_layer=1,
+    )
+    model = Whisper(dimensions).eval()
+    # Whisper leaves the decoder's positional embedding uninitialized, to be overwritten by the checkpoint
+    torch.nn.init.normal_(model.decoder.positional_embedding, std=0.01)
+    return model
+
+
+@pytest.fixture
+def audio():
+    rng = np.random.default_rng(0)
+    return (0.1 * rng.standard_normal(16000 * 2)).astype(np.float32)
+
+
+# Test that every linear layer is quantized, and that the quantized model still transcribes with word timestamps
+def test_quantize_model_replaces_linear_layers(audio):
+    model = quantize_model(make_model())
+
+    linear_layers = [module for module in model.modules() if isinstance(module, torch.nn.Linear)]
+    quantized_layers = [module for module in model.modules() if isinstance(module, torch.ao.nn.quantized.dynamic.Linear)]
+    assert linear_layers == []
+    assert len(quantized_layers) > 0
+    result = model.transcribe(audio, word_timestamps=True, **OPTIONS)
+    assert isinstance(result["text"], str)
+
+
+# Test that the quantized model's encoder output stays close to the float32 model's
+def test_quantize_model_keeps_encoder_output_close(audio):
+    model = make_model()
+    mel = whisper.log_mel_spectrogram(whisper.pad_or_trim(audio)).unsqueeze(0)
+    with torch.no_grad():
+        expected = model.encoder(mel)
+        actual = quantize_model(model).encoder(mel)
+
+    assert torch.allclose(actual, expected, atol=0.1 * expected.abs().max().item())
+
+
+# Test that the quantized model is saved to the cache at the first load and loaded from it afterwards
+def test_load_quantized_model_uses_cache(mocker, tmp_path):
+    mocker.patch("src.quantization.CliInterface")
+    load_model_mock = mocker.patch("whisper.load_model", side_effect=lambda *_args, **_kwargs: make_model())
+
+    first_model = load_quantized_model("base", str(tmp_path))
+    second_model = load_quantized_model("base", str(tmp_path))
+
+    load_model_mock.assert_called_once_with("base", device="cpu")
+    # Only the cached model is left in the cache directory, without temporary files
+    assert [str(path) for path in tmp_path.iterdir()] == [quantized_model_path(str(tmp_path), "base")]
+    assert type(second_model.encoder.blocks[0].mlp[0]) is type(first_model.encoder.blocks[0].mlp[0])
+    assert torch.equal(second_model.decoder.token_embedding.weight, first_model.decoder.token_embedding.weight)
+
+
+# Test that an unreadable cache file is replaced by quantizing the model again
+def test_load_quantized_model_replaces_corrupt_cache(mocker, tmp_path):
+    cli_mock = mocker.patch("src.quantization.CliInterface")
+    load_model_mock = mocker.patch("whisper.load_model", side_effect=lambda *_args, **_kwargs: make_model())
+    path = quantized_model_path(str(tmp_path), "base")
+    with open(path, "wb") as file:
+        file.write(b"truncated")
+
+    load_quantized_model("base", str(tmp_path))
+
+    cli_mock.print_warning.assert_called_once()
+    load_model_mock.assert_called_once()
+    assert load_quantized_model("base", str(tmp_path)) is not None
+    load_model_mock.assert_called_once()
+
+
+# Test that the model is only quantized when QUANTIZE_INT8 is set
+@pytest.mark.parametrize("quantize", [False, True])
+def test_load_whisper_model_quantizes_when_configured(mocker, quantize):
+    mocker.patch("src.quantization.QUANTIZE_INT8", quantize)
+    mocker.patch("src.quantization.QUANTIZED_MODEL_CACHE_DIR", "cache")
+    load_model_mock = mocker.patch("whisper.load_model")
+    load_quantized_mock = mocker.patch("src.quantization.load_quantized_model")
+
+    model = load_whisper_model("small")
+
+    if quantize:
+        load_quantized_mock.assert_called_once_with("small", "cache")
+        load_model_mock.assert_not_called()
+        assert model is load_quantized_mock.return_value
+    else:
+        load_model_mock.assert_called_once_with("small")
+        load_quantized_mock.assert_not_called()
+        assert model is load_model_mock.return_value
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from src.resampler import PolyphaseResampler
+
+
+def sine(frequency, sample_rate, duration=1.0):
+    t = np.arange(int(sample_rate * duration)) / sample_rate
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+@pytest.mark.parametrize("input_rate", [8000, 32000, 44100, 48000])
+def test_process_converts_to_output_rate(input_rate):
+    resampler = PolyphaseResampler(input_rate, 16000)
+    output = resampler.process(sine(440, input_rate))
+    assert output.dtype == np.float32
+    assert len(output) == 16000
+
+
+def test_process_same_rate_returns_input():
+    resampler = PolyphaseResampler(16000, 16000)
+    samples = sine(440, 16000)
+    assert resampler.process(samples) is samples
+
+
+@pytest.mark.parametrize("input_rate", [44100, 48000])
+def test_process_keeps_state_across_chunks(input_rate):
+    samples = sine(440, input_rate)
+    whole = PolyphaseResampler(input_rate, 16000).process(samples)
+
+    resampler = PolyphaseResampler(input_rate, 16000)
+    chunked = np.concatenate([resampler.process(chunk) for chunk in np.array_split(samples, 37)])
+
+    np.testing.assert_allclose(chunked, whole, atol=1e-6)
+
+
+def test_process_preserves_passband_tone():
+    resampler = PolyphaseResampler(48000, 16000)
+    output = resampler.process(sine(440, 48000))
+    # Skip the filter's warm-up and compare the tone's RMS
+    assert np.sqrt(np.mean(output[1000:] ** 2)) == pytest.approx(0.5 / np.sqrt(2), rel=0.01)
+
+
+def test_process_rejects_tone_above_output_nyquist():
+    resampler = PolyphaseResampler(48000, 16000)
+    output = resampler.process(sine(12000, 48000))
+    assert np.sqrt(np.mean(output[1000:] ** 2)) < 0.01
+
+
+def test_flush_returns_delayed_samples_and_resets():
+    resampler = PolyphaseResampler(48000, 16000)
+    resampler.process(sine(440, 48000))
+    assert len(resampler.flush()) > 0
+    assert resampler.position == 0
+    assert not resampler.history.any()
@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+
+from src.transcript_writer import TranscriptWriter, build_transcription_output, read_records, stream_path_for
+
+
+def test_stream_path_for():
+    assert stream_path_for("transcription_results.json") == "transcription_results.jsonl"
+    assert stream_path_for("/recordings/call.wav.json") == "/recordings/call.wav.jsonl"
+
+
+def test_records_are_written_as_soon_as_appended(tmp_path):
+    writer = TranscriptWriter(str(tmp_path / "results.jsonl"), fsync_interval=None)
+
+    writer.append({"text": "Hello", "volume_db": np.float32(-20.5)})
+
+    # Readable from disk before the writer is closed
+    assert list(read_records(writer.path)) == [{"text": "Hello", "volume_db": -20.5}]
+    writer.close()
+
+
+def test_fsync_schedule(tmp_path, mocker):
+    fsync_mock = mocker.patch("src.transcript_writer.os.fsync")
+    monotonic_mock = mocker.patch("src.transcript_writer.time.monotonic", return_value=0)
+    writer = TranscriptWriter(str(tmp_path / "results.jsonl"), fsync_interval=5)
+
+    writer.append({"text": "one"})
+    monotonic_mock.return_value = 6
+    writer.append({"text": "two"})
+    writer.append({"text": "three"})
+
+    assert fsync_mock.call_count == 1
+    writer.close()
+    assert fsync_mock.call_count == 2
+
+
+def test_no_file_is_created_without_records(tmp_path):
+    writer = TranscriptWriter(str(tmp_path / "results.jsonl"), fsync_interval=0)
+
+    writer.close()
+    writer.remove()
+
+    assert not (tmp_path / "results.jsonl").exists()
+
+
+def test_stream_of_an_interrupted_session_is_kept(tmp_path):
+    (tmp_path / "results.jsonl").write_text(json.dumps({"text": "earlier"}) + "\n")
+    writer = TranscriptWriter(str(tmp_path / "results.jsonl"), fsync_interval=0)
+
+    writer.append({"text": "later"})
+    writer.close()
+
+    assert list(read_records(str(tmp_path / "results.jsonl.interrupted"))) == [{"text": "earlier"}]
+    assert list(read_records(writer.path)) == [{"text": "later"}]
+
+
+def test_truncated_last_line_is_skipped(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text(json.dumps({"text": "complete"}) + "\n" + '{"text": "cut sh')
+
+    assert list(read_records(str(path))) == [{"text": "complete"}]
+
+
+def test_build_transcription_output(tmp_path):
+    writer = TranscriptWriter(str(tmp_path / "results.jsonl"), fsync_interval=None)
+    words = [{"word": " Hello", "volume_db": -20}, {"word": " world", "volume_db": -22}]
+    writer.append({"text": " Hello", "segments": [{"words": words[:1]}]})
+    writer.append({"text": " world", "segments": [{"words": words[1:]}]})
+    writer.close()
+
+    assert build_transcription_output(writer.path, raw=False, include_words=True) == {
+        "full_text": " Hello world",
+        "words": words,
+    }
+    assert build_transcription_output(writer.path, raw=False, include_words=False)["words"] == []
+    assert len(build_transcription_output(writer.path, raw=True, include_words=True)) == 2
+
+
+def test_build_transcription_output_with_overloads(tmp_path):
+    writer = TranscriptWriter(str(tmp_path / "results.jsonl"), fsync_interval=None)
+    writer.append({"text": " Hello"})
+    writer.append({"text": "", "overload": {"reason": "dropped", "duration": 5.0}})
+    writer.append({"text": " world", "overload": {"reason": "downgraded", "model_size": "tiny", "duration": 2.0}})
+    writer.close()
+
+    assert build_transcription_output(writer.path, raw=False, include_words=True)["overloads"] == [
+        {"reason": "dropped", "duration": 5.0, "text_offset": 6},
+        {"reason": "downgraded", "model_size": "tiny", "duration": 2.0, "text_offset": 6},
+    ]
+
+
+def test_build_transcription_output_with_languages(tmp_path):
+    writer = TranscriptWriter(str(tmp_path / "results.jsonl"), fsync_interval=None)
+    writer.append({"text": " Hello", "language": "en", "language_probability": 0.6})
+    writer.append({"text": " world", "language": "en", "language_probability": 0.9})
+    writer.append({"text": " Bonjour", "language": "fr", "language_probability": 0.8})
+    writer.close()
+
+    assert build_transcription_output(writer.path, raw=False, include_words=False)["languages"] == [
+        {"language": "en", "probability": 0.9, "text_offset": 0},
+        {"language": "fr", "probability": 0.8, "text_offset": 12},
+    ]
+
+
+def test_partial_results_are_left_out_of_the_output(tmp_path):
+    writer = TranscriptWriter(str(tmp_path / "results.jsonl"), fsync_interval=None)
+    writer.append({"status": "partial", "sequence": 0, "text": " Hel"})
+    writer.append({"text": " Hello", "status": "final", "sequence": 0})
+    writer.close()
+
+    assert build_transcription_output(writer.path, raw=False, include_words=False)["full_text"] == " Hello"
+    assert build_transcription_output(writer.path, raw=True, include_words=False) == [
+        {"text": " Hello", "status": "final", "sequence": 0}
+    ]
@@ -0,0 +1,54 @@
+from unittest.mock import Mock
+
+import numpy as np
+
+from src import transcription_pool
+from src.transcription_pool import TranscriptionPool, load_worker_model, transcribe_in_worker, wait_for_workers
+
+
+def test_load_worker_model_sets_threads_and_loads_model(mocker):
+    load_model_mock = mocker.patch("whisper.load_model")
+    configure_mock = mocker.patch("src.transcription_pool.configure_torch_threads")
+    pin_mock = mocker.patch("src.transcription_pool.pin_current_thread")
+    mocker.patch.object(transcription_pool, "worker_model", None)
+
+    load_worker_model("tiny", 2, 1, [2, 3])
+
+    pin_mock.assert_called_once_with([2, 3])
+    configure_mock.assert_called_once_with(2, 1)
+    load_model_mock.assert_called_once_with("tiny")
+    assert transcription_pool.worker_model is load_model_mock.return_value
+
+
+def test_transcribe_in_worker_uses_worker_model(mocker):
+    model = Mock()
+    model.transcribe.return_value = {"text": "Hello"}
+    mocker.patch.object(transcription_pool, "worker_model", model)
+    audio = np.zeros(16000, dtype=np.float32)
+
+    assert transcribe_in_worker(audio, {"language": "en"}) == {"text": "Hello"}
+    model.transcribe.assert_called_once_with(audio, language="en")
+
+
+def test_transcription_pool_submits_to_worker_processes(mocker):
+    executor_mock = mocker.patch("src.transcription_pool.ProcessPoolExecutor")
+    mocker.patch("src.cpu_topology.available_cores", return_value=list(range(9)))
+    mocker.patch("src.cpu_topology.CAPTURE_CORES", 1)
+    mocker.patch("src.cpu_topology.CPU_AFFINITY", True)
+    mocker.patch("src.cpu_topology.TORCH_INTRA_OP_THREADS", "auto")
+    mocker.patch("src.cpu_topology.TORCH_INTER_OP_THREADS", "auto")
+    executor_mock.return_value.submit.return_value.result.return_value = {"text": "Hello"}
+
+    pool = TranscriptionPool("base", 4)
+    audio = np.zeros(16000, dtype=np.float32)
+    result = pool.transcribe(audio, language="en")
+    pool.shutdown()
+
+    assert executor_mock.call_args.kwargs["max_workers"] == 4
+    assert executor_mock.call_args.kwargs["initargs"][:4] == ("base", 2, 1, list(range(1, 9)))
+    # Every worker is started and loads its model before the pool is returned
+    submit_calls = executor_mock.return_value.submit.call_args_list
+    assert [call.args for call in submit_calls[:4]] == [(wait_for_workers,)] * 4
+    assert submit_calls[4].args == (transcribe_in_worker, audio, {"language": "en"})
+    assert result == {"text": "Hello"}
+    executor_mock.return_value.shutdown.assert_called_once_with(wait=True)
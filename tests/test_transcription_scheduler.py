@@ -0,0 +1,98 @@
+import threading
+import time
+
+from src.transcription_scheduler import TranscriptionScheduler
+
+
+def wait_until_waiting(scheduler, count):
+    while len(scheduler.waiting) < count:
+        time.sleep(0.001)
+
+
+# Test that a source with a backlog takes turns with another source rather than keeping the model
+def test_backlogged_sources_are_interleaved():
+    scheduler = TranscriptionScheduler()
+    turns = []
+    alice_lock = scheduler.source_lock("alice")
+    bob_lock = scheduler.source_lock("bob")
+
+    def transcribe(lock, source, count):
+        for _ in range(count):
+            with lock:
+                turns.append(source)
+                time.sleep(0.05)
+
+    with alice_lock:
+        threads = [
+            threading.Thread(target=transcribe, args=(alice_lock, "alice", 3)),
+            threading.Thread(target=transcribe, args=(bob_lock, "bob", 3)),
+        ]
+        threads[0].start()
+        wait_until_waiting(scheduler, 1)
+        threads[1].start()
+        wait_until_waiting(scheduler, 2)
+        time.sleep(0.025)  # Half a turn, so that alice's usage stays ahead of bob's by more than the timing jitter
+    for thread in threads:
+        thread.join()
+
+    # bob has not used the model yet, so he goes first, and then they alternate
+    assert turns == ["bob", "alice", "bob", "alice", "bob", "alice"]
+
+
+# Test that the waiting source that used the model the least goes first
+def test_least_used_source_goes_first():
+    scheduler = TranscriptionScheduler()
+    scheduler.acquire("alice")
+    scheduler.release("alice", 5.0)
+    scheduler.acquire("bob")
+    scheduler.release("bob", 1.0)
+    turns = []
+
+    def acquire(source):
+        scheduler.acquire(source)
+        turns.append(source)
+
+    scheduler.acquire("carol")
+    threads = [threading.Thread(target=acquire, args=(source,)) for source in ("alice", "bob")]
+    for thread in threads:
+        thread.start()
+    wait_until_waiting(scheduler, 2)
+
+    scheduler.release("carol", 1.0)
+    threads[1].join()
+    scheduler.release("bob", 1.0)
+    threads[0].join()
+
+    assert turns == ["bob", "alice"]
+
+
+# Test that a source idle while others used the model resumes at their usage, without saved up model time
+def test_idle_source_catches_up():
+    scheduler = TranscriptionScheduler()
+    scheduler.acquire("alice")
+    scheduler.release("alice", 1.0)
+    scheduler.acquire("bob")
+    scheduler.release("bob", 100.0)
+    scheduler.acquire("bob")
+    scheduler.release("bob", 1.0)
+
+    scheduler.acquire("carol")
+
+    assert scheduler.usage["carol"] == scheduler.usage["bob"] - 1.0
+    scheduler.release("carol", 1.0)
+
+
+# Test that up to slots sources use the model at the same time
+def test_slots():
+    scheduler = TranscriptionScheduler(slots=2)
+    scheduler.acquire("alice")
+    scheduler.acquire("bob")
+    acquired = threading.Event()
+    thread = threading.Thread(target=lambda: (scheduler.acquire("carol"), acquired.set()))
+    thread.start()
+    wait_until_waiting(scheduler, 1)
+
+    assert not acquired.is_set()
+    scheduler.release("alice", 1.0)
+    thread.join()
+    assert scheduler.running == 2
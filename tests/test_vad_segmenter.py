@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from src.vad_segmenter import VadSegmenter
+
+SAMPLE_RATE = 16000
+
+
+def tone(duration, amplitude=0.3, frequency=200):
+    t = np.arange(int(duration * SAMPLE_RATE)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def silence(duration):
+    return np.zeros(int(duration * SAMPLE_RATE), dtype=np.float32)
+
+
+@pytest.fixture
+def segmenter():
+    return VadSegmenter(
+        SAMPLE_RATE,
+        min_segment_duration=0.3,
+        max_segment_duration=5,
+        hangover_duration=0.3,
+        preroll_duration=0.09,
+    )
+
+
+def test_silence_produces_no_segments(segmenter):
+    assert segmenter.process(silence(3.0)) == []
+    assert segmenter.flush() == []
+
+
+def test_utterance_becomes_one_segment_with_preroll_and_hangover(segmenter):
+    segments = segmenter.process(np.concatenate((silence(1.0), tone(1.5), silence(1.0))))
+
+    assert len(segments) == 1
+    # 1.5 s of speech, 0.09 s of preroll and 0.3 s of hangover
+    assert len(segments[0]) == pytest.approx(1.89 * SAMPLE_RATE, abs=segmenter.frame_size)
+    assert segments[0].dtype == np.float32
+
+
+def test_segments_are_the_same_for_any_block_size(segmenter):
+    audio = np.concatenate((silence(0.5), tone(1.0), silence(1.0), tone(0.7), silence(1.0)))
+    whole = segmenter.process(audio) + segmenter.flush()
+
+    blocks = []
+    for block in np.array_split(audio, 23):
+        blocks += segmenter.process(block)
+    blocks += segmenter.flush()
+
+    assert len(whole) == len(blocks) == 2
+    for expected, actual in zip(whole, blocks):
+        np.testing.assert_array_equal(expected, actual)
+
+
+def test_short_noise_is_dropped(segmenter):
+    assert segmenter.process(np.concatenate((silence(0.5), tone(0.1), silence(1.0)))) == []
+    assert segmenter.dropped_segments == 1
+
+
+def test_noise_with_high_zero_crossing_rate_is_not_speech(segmenter):
+    noise = np.random.default_rng(0).uniform(-0.3, 0.3, 2 * SAMPLE_RATE).astype(np.float32)
+    assert segmenter.process(noise) + segmenter.flush() == []
+
+
+def test_long_speech_is_cut_at_max_segment_duration(segmenter):
+    segments = segmenter.process(tone(12.0)) + segmenter.flush()
+
+    assert [len(segment) for segment in segments[:2]] == [segmenter.max_segment_frames * segmenter.frame_size] * 2
+    assert sum(len(segment) for segment in segments) == pytest.approx(12.0 * SAMPLE_RATE, abs=segmenter.frame_size)
+
+
+def test_flush_returns_open_segment(segmenter):
+    assert segmenter.process(tone(1.0)) == []
+    assert len(segmenter.flush()) == 1
+    assert segmenter.flush() == []
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from src.volume_envelope import VolumeEnvelope
+
+
+def db(amplitude):
+    return 20 * np.log10(amplitude * 32768)
+
+
+# A second of quiet audio followed by a second of loud audio
+@pytest.fixture
+def envelope():
+    samples = np.concatenate((np.full(16000, 0.01), np.full(16000, 0.5))).astype(np.float32)
+    return VolumeEnvelope(samples, 16000)
+
+
+# Test that the volume of the whole chunk is its RMS volume
+def test_volume_of_whole_chunk(envelope):
+    assert envelope.volume_db == pytest.approx(10 * np.log10((0.01**2 + 0.5**2) / 2) + 20 * np.log10(32768))
+
+
+# Test that each interval gets the volume of its own frames, all at once
+def test_volumes_of_intervals(envelope):
+    volumes = envelope.volumes_db([0.0, 1.2, 0.5], [0.8, 1.9, 1.5])
+
+    assert volumes == pytest.approx([db(0.01), db(0.5), 10 * np.log10((0.01**2 + 0.5**2) / 2) + 20 * np.log10(32768)])
+
+
+# Test that intervals shorter than a frame get their frame's volume, and intervals are clipped to the chunk
+def test_short_and_out_of_range_intervals(envelope):
+    volumes = envelope.volumes_db([0.3, 1.5, 1.99, 2.5], [0.3, 1.505, 3.0, 2.6])
+
+    assert volumes == pytest.approx([db(0.01), db(0.5), db(0.5), db(0.5)])
+
+
+# Test that a partial last frame is weighted by its actual number of samples
+def test_partial_last_frame():
+    samples = np.concatenate((np.zeros(320), np.full(10, 0.5))).astype(np.float32)
+    envelope = VolumeEnvelope(samples, 16000)
+
+    assert envelope.volumes_db([0.02], [0.03]) == pytest.approx([db(0.5)])
+    assert envelope.volume_db == pytest.approx(10 * np.log10(0.25 * 10 / 330) + 20 * np.log10(32768))
+
+
+# Test that silence and empty chunks have a volume of -inf
+def test_silent_and_empty_chunks():
+    assert VolumeEnvelope(np.zeros(1000, dtype=np.float32), 16000).volumes_db([0.0], [0.05]) == [-np.inf]
+    empty = VolumeEnvelope(np.zeros(0, dtype=np.float32), 16000)
+    assert empty.volume_db == -np.inf
+    assert list(empty.volumes_db([0.0], [1.0])) == [-np.inf]
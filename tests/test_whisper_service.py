@@ -1,14 +1,33 @@
 import json
-from unittest.mock import Mock, mock_open, patch
+import subprocess
+import sys
+import threading
+from concurrent.futures import Future
+from unittest.mock import MagicMock, Mock, mock_open, patch
 
+import numpy as np
 import pytest
 
+from src.language_detector import LanguageDetector
+from src.metrics import ChunkTimings
+from src.model_server import ModelServerClient
+from src.transcript_writer import build_transcription_output, read_records
+from src.volume_envelope import VolumeEnvelope
 from src.whisper_service import WhisperService
 
 
+def streamed_results(service):
+    # The results written to the service's stream so far
+    try:
+        return list(read_records(service.transcript_writer.path))
+    except FileNotFoundError:
+        return []
+
+
 @pytest.fixture
-def whisper_service(mocker):
-    mocker.patch("src.whisper_service.whisper.load_model", return_value=Mock())
+def whisper_service(mocker, tmp_path):
+    # Like a Whisper model, the mock has no transcribe_batch method, so batches are transcribed in process
+    mocker.patch("whisper.load_model", return_value=Mock(spec=["transcribe"]))
     mocker.patch("src.whisper_service.PRINT_TO_FILE", True)
     mocker.patch("src.whisper_service.OUTPUT_RAW_TRANSCRIPTION", False)
     mocker.patch("src.whisper_service.OUTPUT_FILE_PATH", "/path/to/output.json")
@@ -17,17 +36,50 @@ def whisper_service(mocker):
     mocker.patch("src.whisper_service.PROMPT", "")
     mocker.patch("src.whisper_service.MAX_RETRIES", 3)
     mocker.patch("src.whisper_service.MODEL_SIZE", "base")
+    mocker.patch("src.whisper_service.TRANSCRIPTION_WORKERS", 1)
+    mocker.patch("src.whisper_service.USE_MODEL_SERVER", False)
 
-    yield WhisperService()
+    service = WhisperService()
+    service.transcript_writer.path = str(tmp_path / "output.jsonl")
+    yield service
 
 
 # Test the initialization of WhisperService
 def test_whisper_service_initialization(whisper_service):
     assert whisper_service.model is not None
-    assert whisper_service.results == []
+    assert whisper_service.transcript_writer.record_count == 0
     assert whisper_service.active_tasks == 0
 
 
+# Test that importing the service does not import whisper or torch, which takes seconds
+def test_import_does_not_load_whisper():
+    code = "import sys, src.whisper_service; sys.exit('torch' in sys.modules or 'whisper' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
+
+
+# Test that the model loads in the background and chunks wait for it to be ready
+def test_transcription_waits_for_background_model_loading(mocker, tmp_path):
+    mocker.patch("src.whisper_service.CliInterface")
+    mocker.patch("src.whisper_service.TRANSCRIPTION_WORKERS", 1)
+    mocker.patch("src.whisper_service.USE_MODEL_SERVER", False)
+    model_ready = threading.Event()
+    model = Mock()
+    model.transcribe.return_value = {"text": "Hello"}
+    mocker.patch("whisper.load_model", side_effect=lambda _size: model_ready.wait() and model)
+
+    service = WhisperService()
+    service.transcript_writer.path = str(tmp_path / "output.jsonl")
+    transcription = threading.Thread(target=service.transcribe_audio_chunk, args=(np.zeros(16000, dtype=np.float32), -20))
+    transcription.start()
+    transcription.join(timeout=0.1)
+
+    assert transcription.is_alive()
+    assert streamed_results(service) == []
+    model_ready.set()
+    transcription.join()
+    assert streamed_results(service) == [{"text": "Hello", "model_size": "base", "status": "final"}]
+
+
 # Test the transcribe_audio_chunk method
 def test_transcribe_audio_chunk(whisper_service):
     temp_file_path = "/path/to/temp_file.wav"
@@ -46,8 +98,181 @@ def test_transcribe_audio_chunk(whisper_service):
             task="transcribe",
         )
         remove_mock.assert_called_once_with(temp_file_path)
-        assert len(whisper_service.results) == 1
-        assert whisper_service.results[0] == {"text": "Hello, world!"}
+        assert len(streamed_results(whisper_service)) == 1
+        assert streamed_results(whisper_service)[0] == {"text": "Hello, world!", "model_size": "base", "status": "final"}
+
+
+# Test that in-memory audio is passed straight to the model
+def test_transcribe_audio_chunk_in_memory(whisper_service):
+    audio = np.zeros(16000, dtype=np.float32)
+
+    with patch("src.whisper_service.os.remove") as remove_mock:
+        whisper_service.model.transcribe.return_value = {"text": "Hello, world!"}
+
+        whisper_service.transcribe_audio_chunk(audio, -20)
+
+        assert whisper_service.model.transcribe.call_args.args[0] is audio
+        remove_mock.assert_not_called()
+        assert streamed_results(whisper_service) == [{"text": "Hello, world!", "model_size": "base", "status": "final"}]
+
+
+# Test that the temporary file is removed even when every attempt fails
+def test_transcribe_audio_chunk_removes_file_after_failures(whisper_service, mocker):
+    mocker.patch("src.whisper_service.time.sleep")
+    mocker.patch("src.whisper_service.CliInterface")
+    whisper_service.model.transcribe.side_effect = RuntimeError("decode failed")
+
+    with patch("src.whisper_service.os.remove") as remove_mock:
+        whisper_service.transcribe_audio_chunk("/path/to/temp_file.wav", -20)
+
+    assert whisper_service.model.transcribe.call_count == 3
+    remove_mock.assert_called_once_with("/path/to/temp_file.wav")
+    assert streamed_results(whisper_service) == []
+    assert whisper_service.active_tasks == 0
+    assert whisper_service.metrics.counters["transcription_retries"] == 3
+    assert whisper_service.metrics.counters["transcription_failures"] == 1
+
+
+# Test that a chunk's timings are recorded up to the write of its result, once earlier results are written
+def test_transcribe_audio_chunk_records_timings(whisper_service):
+    whisper_service.model.transcribe.return_value = {"text": "one"}
+    timings = ChunkTimings(1.0, 0.0)
+    whisper_service.metrics.chunk_queued(timings)
+    whisper_service.metrics.chunk_dequeued(timings)
+
+    whisper_service.transcribe_audio_chunk(np.zeros(16000, dtype=np.float32), -20, sequence=1, timings=timings)
+    assert timings.decode_end is not None and timings.write is None
+
+    whisper_service.append_transcription_result({"text": "zero"}, -20, sequence=0)
+    assert timings.write >= timings.decode_end >= timings.decode_start >= timings.dequeue
+    assert whisper_service.metrics.histograms["end_to_end"].count == 1
+    assert whisper_service.metrics.gauges()["queue_depth"] == 0
+
+
+# Test that without LANGUAGE_CODE, the language is detected on the first chunks only and used for the later ones
+def test_session_language_detection(whisper_service, mocker):
+    mocker.patch("src.whisper_service.LANGUAGE_CODE", "")
+    mocker.patch("src.whisper_service.CliInterface")
+    whisper_service.language_detector = LanguageDetector(detection_duration=3, recheck_interval=None, recheck_logprob=-1)
+    model = Mock(spec=["transcribe", "language_probabilities"])
+    model.language_probabilities.side_effect = [{"de": 0.8, "en": 0.2}, {"de": 0.6, "en": 0.4}]
+    model.transcribe.side_effect = lambda _audio, **options: {"text": "Hallo", "language": options["language"]}
+    whisper_service.model_future = mocker.Mock(result=Mock(return_value=model))
+
+    for sequence in range(3):
+        whisper_service.transcribe_audio_chunk(
+            np.zeros(32000, dtype=np.float32), -20, sequence=sequence, timings=ChunkTimings(2.0, 0.0)
+        )
+
+    assert model.language_probabilities.call_count == 2
+    assert [call.kwargs["language"] for call in model.transcribe.call_args_list] == ["de", "de", "de"]
+    assert [result["language_probability"] for result in streamed_results(whisper_service)] == pytest.approx(
+        [0.8, 0.7, 0.7]
+    )
+
+
+# Test that a failed language detection leaves the chunk to Whisper's own detection
+def test_failed_language_detection_still_transcribes(whisper_service, mocker):
+    mocker.patch("src.whisper_service.LANGUAGE_CODE", "")
+    mocker.patch("src.whisper_service.CliInterface")
+    whisper_service.language_detector = LanguageDetector()
+    model = Mock(spec=["transcribe", "language_probabilities"])
+    model.language_probabilities.side_effect = RuntimeError("detection failed")
+    model.transcribe.return_value = {"text": "Hello", "language": "en"}
+    whisper_service.model_future = mocker.Mock(result=Mock(return_value=model))
+
+    whisper_service.transcribe_audio_chunk(np.zeros(32000, dtype=np.float32), -20, timings=ChunkTimings(2.0, 0.0))
+
+    assert model.transcribe.call_args.kwargs["language"] is None
+    assert streamed_results(whisper_service) == [{"text": "Hello", "language": "en", "model_size": "base", "status": "final"}]
+
+
+# Test that a dropped chunk is recorded as a gap in capture order
+def test_skip_audio_chunk(whisper_service):
+    whisper_service.append_transcription_result({"text": "one"}, -20, sequence=1)
+    whisper_service.skip_audio_chunk(4.0, sequence=0)
+
+    assert streamed_results(whisper_service) == [
+        {"text": "", "segments": [], "overload": {"reason": "dropped", "duration": 4.0}, "status": "final", "sequence": 0},
+        {"text": "one", "status": "final", "sequence": 1},
+    ]
+
+
+# Test that the fallback model transcribes while downgraded, once loaded, and its results are marked
+def test_downgraded_service_uses_fallback_model(whisper_service, mocker):
+    fallback_model = Mock(spec=["transcribe"])
+    fallback_model.transcribe.return_value = {"text": "fast"}
+    whisper_service.model.transcribe.return_value = {"text": "accurate"}
+    whisper_service.fallback_model_size = "tiny"
+    whisper_service.fallback_model_future = mocker.Mock(
+        done=Mock(return_value=True), exception=Mock(return_value=None), result=Mock(return_value=fallback_model)
+    )
+    audio = np.zeros(16000, dtype=np.float32)
+
+    whisper_service.transcribe_audio_chunk(audio, -20)
+    whisper_service.downgraded = True
+    whisper_service.transcribe_audio_chunk(audio, -20, timings=ChunkTimings(1.0, 0.0))
+
+    assert streamed_results(whisper_service) == [
+        {"text": "accurate", "model_size": "base", "status": "final"},
+        {
+            "text": "fast",
+            "model_size": "tiny",
+            "overload": {"reason": "downgraded", "model_size": "tiny", "duration": 1.0},
+            "status": "final",
+        },
+    ]
+    assert whisper_service.metrics.counters["chunks_downgraded"] == 1
+
+
+# Test that partial results are streamed right away and left out of the output
+def test_append_partial_result(whisper_service):
+    whisper_service.append_transcription_result({"text": " zero"}, -20, sequence=0)
+    whisper_service.append_partial_result(" on", 1)
+    whisper_service.append_partial_result(" one two", 1)
+
+    assert streamed_results(whisper_service)[1:] == [
+        {"status": "partial", "sequence": 1, "text": " on"},
+        {"status": "partial", "sequence": 1, "text": " one two"},
+    ]
+    whisper_service.append_transcription_result({"text": " one too"}, -20, sequence=1)
+    whisper_service.transcript_writer.close()
+    output = build_transcription_output(whisper_service.transcript_writer.path, raw=False, include_words=False)
+    assert output["full_text"] == " zero one too"
+
+
+# Test that a partial result is not appended once its chunk is no longer open, checked with the results lock held
+def test_append_partial_result_of_closed_chunk(whisper_service):
+    assert not whisper_service.append_partial_result(" on", 1, lambda: whisper_service.results_lock.locked() and False)
+    assert whisper_service.append_partial_result(" on", 1, whisper_service.results_lock.locked)
+
+    assert streamed_results(whisper_service) == [{"status": "partial", "sequence": 1, "text": " on"}]
+
+
+# Test that every adaptive model size is loaded, and that results record the size that produced them
+def test_adaptive_model_sizes(mocker, tmp_path):
+    mocker.patch("src.whisper_service.CliInterface")
+    mocker.patch("src.whisper_service.MODEL_SIZE", "base")
+    models = {size: Mock(spec=["transcribe"]) for size in ("tiny", "base")}
+    for size, model in models.items():
+        model.transcribe.return_value = {"text": size}
+    mocker.patch("src.whisper_service.load_transcription_model", side_effect=lambda size=None: models[size or "base"])
+
+    service = WhisperService(adaptive_model_sizes=["tiny", "base"])
+    service.transcript_writer.path = str(tmp_path / "output.jsonl")
+    service.adaptive_model_futures["tiny"].result()
+    record_mock = mocker.patch.object(service.model_selector, "record", return_value="tiny")
+    audio = np.zeros(16000, dtype=np.float32)
+    service.transcribe_audio_chunk(audio, -20, timings=ChunkTimings(1.0, 0.0))
+    mocker.patch.object(service.model_selector, "index", 0)
+    service.transcribe_audio_chunk(audio, -20, timings=ChunkTimings(1.0, 0.0))
+
+    assert record_mock.call_args_list[0].args[0] == "base"
+    assert record_mock.call_args_list[0].args[2] == 1.0
+    assert [(result["text"], result["model_size"]) for result in streamed_results(service)] == [
+        ("base", "base"),
+        ("tiny", "tiny"),
+    ]
 
 
 # Test the append_transcription_result method
@@ -66,8 +291,8 @@ def test_append_transcription_result(whisper_service):
 
     whisper_service.append_transcription_result(result, volume_db)
 
-    assert len(whisper_service.results) == 1
-    assert whisper_service.results[0] == {
+    assert len(streamed_results(whisper_service)) == 1
+    assert streamed_results(whisper_service)[0] == {
         "segments": [
             {
                 "words": [
@@ -75,16 +300,184 @@ def test_append_transcription_result(whisper_service):
                     {"text": "world", "start": 1.0, "end": 2.0, "volume_db": -20},
                 ]
             }
+        ],
+        "status": "final",
+    }
+
+
+# Test that each word gets the volume of its own audio from the chunk's volume envelope
+def test_append_transcription_result_with_volume_envelope(whisper_service):
+    samples = np.concatenate((np.full(16000, 0.01), np.full(16000, 0.1))).astype(np.float32)
+    result = {
+        "segments": [
+            {"words": [{"text": "Hello", "start": 0.0, "end": 1.0}]},
+            {"words": [{"text": "world", "start": 1.0, "end": 2.0}]},
         ]
     }
 
+    whisper_service.append_transcription_result(result, VolumeEnvelope(samples, 16000))
+
+    segments = streamed_results(whisper_service)[0]["segments"]
+    volumes = [word["volume_db"] for segment in segments for word in segment["words"]]
+    assert volumes == pytest.approx([20 * np.log10(327.68), 20 * np.log10(3276.8)])
+
+
+# Test that results arriving out of order are appended in sequence order
+def test_append_transcription_result_reorders_by_sequence(whisper_service):
+    whisper_service.append_transcription_result({"text": "two"}, -20, sequence=2)
+    whisper_service.append_transcription_result({"text": "one"}, -20, sequence=1)
+    assert streamed_results(whisper_service) == []
+
+    whisper_service.append_transcription_result({"text": "zero"}, -20, sequence=0)
+    assert [result["text"] for result in streamed_results(whisper_service)] == ["zero", "one", "two"]
+    assert whisper_service.pending_results == {}
+
+
+# Test that a failed chunk does not hold back the results of later chunks
+def test_failed_chunk_does_not_block_later_results(whisper_service, mocker):
+    mocker.patch("src.whisper_service.time.sleep")
+    mocker.patch("src.whisper_service.CliInterface")
+    whisper_service.append_transcription_result({"text": "one"}, -20, sequence=1)
+    whisper_service.model.transcribe.side_effect = RuntimeError("decode failed")
+
+    whisper_service.transcribe_audio_chunk(np.zeros(16000, dtype=np.float32), -20, sequence=0)
+
+    assert streamed_results(whisper_service) == [{"text": "one", "status": "final", "sequence": 1}]
+    assert whisper_service.next_sequence == 2
+
+
+# Test that several workers use a process pool instead of an in-process model
+def test_whisper_service_starts_transcription_pool(mocker):
+    mocker.patch("src.whisper_service.CliInterface")
+    mocker.patch("src.whisper_service.TRANSCRIPTION_WORKERS", 4)
+    mocker.patch("src.whisper_service.USE_MODEL_SERVER", False)
+    load_model_mock = mocker.patch("whisper.load_model")
+    pool_mock = mocker.patch("src.whisper_service.TranscriptionPool")
+
+    service = WhisperService()
+    service.shutdown()
+
+    load_model_mock.assert_not_called()
+    pool_mock.assert_called_once_with("base", 4)
+    assert service.model is pool_mock.return_value
+    pool_mock.return_value.shutdown.assert_called_once()
+
+
+# Test that a batch of chunks is transcribed together and its results are kept in order
+def test_transcribe_audio_batch(whisper_service, mocker):
+    batch_mock = mocker.patch(
+        "src.batch_transcription.transcribe_batch", return_value=[{"text": "one"}, {"text": "two"}]
+    )
+    audios = [np.zeros(16000, dtype=np.float32), np.ones(16000, dtype=np.float32)]
+
+    whisper_service.transcribe_audio_batch([(audios[1], -20, 1, None), (audios[0], -20, 0, None)])
+
+    batch_mock.assert_called_once_with(
+        whisper_service.model,
+        [audios[1], audios[0]],
+        word_timestamps=True,
+        language="en",
+        prompt="",
+        task="transcribe",
+    )
+    assert [result["text"] for result in streamed_results(whisper_service)] == ["two", "one"]
+    assert whisper_service.active_tasks == 0
+
+
+# Test that a model batching on its own, like a TranscriptionPool, is given the whole batch
+def test_transcribe_audio_batch_with_batching_model(whisper_service, mocker):
+    batch_mock = mocker.patch("src.batch_transcription.transcribe_batch")
+    model = Mock()
+    model.transcribe_batch.return_value = [{"text": "one"}, {"text": "two"}]
+    whisper_service.model_future = mocker.Mock(result=Mock(return_value=model))
+
+    whisper_service.transcribe_audio_batch(
+        [(np.zeros(100, dtype=np.float32), -20, 0, None), (np.zeros(100, dtype=np.float32), -20, 1, None)]
+    )
+
+    model.transcribe_batch.assert_called_once()
+    batch_mock.assert_not_called()
+    assert [result["text"] for result in streamed_results(whisper_service)] == ["one", "two"]
+
+
+# Test that a failed batch falls back to transcribing its chunks one by one
+def test_transcribe_audio_batch_falls_back_to_single_chunks(whisper_service, mocker):
+    mocker.patch("src.whisper_service.CliInterface")
+    mocker.patch("src.batch_transcription.transcribe_batch", side_effect=RuntimeError("out of memory"))
+    whisper_service.model.transcribe.side_effect = [{"text": "zero"}, {"text": "one"}]
+
+    whisper_service.transcribe_audio_batch(
+        [(np.zeros(16000, dtype=np.float32), -20, 0, None), (np.zeros(16000, dtype=np.float32), -20, 1, None)]
+    )
+
+    assert whisper_service.model.transcribe.call_count == 2
+    assert [result["text"] for result in streamed_results(whisper_service)] == ["zero", "one"]
+    assert whisper_service.active_tasks == 0
+
+
+# Test that a running model server is used instead of loading the model
+def test_whisper_service_uses_model_server(mocker):
+    mocker.patch("src.whisper_service.CliInterface")
+    mocker.patch("src.whisper_service.USE_MODEL_SERVER", True)
+    mocker.patch("src.whisper_service.ModelServerClient.ping", return_value=True)
+    load_model_mock = mocker.patch("whisper.load_model")
+
+    service = WhisperService()
+
+    assert isinstance(service.model, ModelServerClient)
+    assert service.model.model_size == "base"
+    load_model_mock.assert_not_called()
+
+
+# Test that the model is loaded in process when the model server is not running
+def test_whisper_service_falls_back_without_model_server(mocker):
+    mocker.patch("src.whisper_service.CliInterface")
+    mocker.patch("src.whisper_service.USE_MODEL_SERVER", True)
+    mocker.patch("src.whisper_service.ModelServerClient.ping", return_value=False)
+    load_model_mock = mocker.patch("whisper.load_model")
+
+    service = WhisperService()
+
+    assert service.model is load_model_mock.return_value
+
+
+# Test that a shared model is used as given and left running for the other services
+def test_whisper_service_shares_model(mocker, tmp_path):
+    mocker.patch("src.whisper_service.TRANSCRIPTION_WORKERS", 4)
+    load_model_mock = mocker.patch("src.whisper_service.load_transcription_model")
+    model = Mock()
+    model.transcribe.return_value = {"text": "Hello"}
+    model_lock = MagicMock()
+
+    service = WhisperService(model, model_lock, output_file_path=str(tmp_path / "recording.wav.json"))
+    service.transcribe_audio_chunk(np.zeros(16000, dtype=np.float32), -20)
+    service.shutdown()
+
+    load_model_mock.assert_not_called()
+    model.transcribe.assert_called_once()
+    model_lock.__enter__.assert_called_once()
+    model.shutdown.assert_not_called()
+
+
+# Test that results are written to the output file path given to the service
+def test_output_transcription_results_to_given_path(whisper_service, mocker):
+    mocker.patch("src.whisper_service.CliInterface")
+    whisper_service.output_file_path = "/path/to/recording.wav.json"
+    whisper_service.append_transcription_result({"text": "Hello", "segments": []}, -20)
+
+    with patch("src.whisper_service.open", create=True) as open_mock, patch("src.whisper_service.PRINT_TO_FILE", False):
+        whisper_service.output_transcription_results()
+
+    open_mock.assert_called_once_with("/path/to/recording.wav.json", "w")
+
 
 # Test the output_transcription_results method
 def test_output_transcription_results(whisper_service):
-    whisper_service.results = [
+    for result in [
         {"text": "Hello"},
         {"text": "world"},
-    ]
+    ]:
+        whisper_service.append_transcription_result(result, -20)
 
     m = mock_open()
     with patch("src.whisper_service.open", m, create=True), patch(
@@ -98,10 +491,32 @@ def test_output_transcription_results(whisper_service):
     print_info_mock.assert_called_once_with("Transcription results have been written to: \033[1m/path/to/output.json\033[0m")
 
 
+# Test that results are streamed to disk and not kept in memory, and that the stream is removed once output
+def test_results_are_streamed_until_output(whisper_service, mocker):
+    mocker.patch("src.whisper_service.CliInterface")
+    whisper_service.append_transcription_result({"text": "Hello"}, -20)
+
+    assert streamed_results(whisper_service) == [{"text": "Hello", "status": "final"}]
+    assert not hasattr(whisper_service, "results")
+    with patch("src.whisper_service.open", mock_open(), create=True):
+        whisper_service.output_transcription_results()
+    assert streamed_results(whisper_service) == []
+
+
+# Test that output written before the end of the session keeps the stream, for the results still to come
+def test_output_transcription_results_not_final(whisper_service, mocker):
+    mocker.patch("src.whisper_service.CliInterface")
+    whisper_service.append_transcription_result({"text": "Hello"}, -20)
+
+    with patch("src.whisper_service.open", mock_open(), create=True):
+        whisper_service.output_transcription_results(final=False)
+    whisper_service.append_transcription_result({"text": "world"}, -20)
+
+    assert [result["text"] for result in streamed_results(whisper_service)] == ["Hello", "world"]
+
+
 # Test the output_transcription_results method when there are no results
 def test_output_transcription_results_no_results(whisper_service):
-    whisper_service.results = []
-
     with patch("src.cli_interface.CliInterface.print_warning") as print_warning_mock:
         whisper_service.output_transcription_results()
 
@@ -110,10 +525,11 @@ def test_output_transcription_results_no_results(whisper_service):
 
 # Test the output_transcription_results method when EXPORT_RAW_TRANSCRIPTIONS is True
 def test_output_transcription_results_export_raw_transcriptions(whisper_service):
-    whisper_service.results = [
+    for result in [
         {"text": "Hello"},
         {"text": "world"},
-    ]
+    ]:
+        whisper_service.append_transcription_result(result, -20)
 
     with patch("src.whisper_service.open", create=True) as open_mock, patch(
         "src.cli_interface.CliInterface.print_info"
@@ -127,3 +543,61 @@ def test_output_transcription_results_export_raw_transcriptions(whisper_service)
             open_mock.assert_not_called()
             file_mock.write.assert_not_called()
             print_info_mock.assert_called_once_with("Transcription results:")
+
+
+# Test that the results and the output of a service recording one of several sources are labelled with it
+def test_results_are_labelled_with_source(mocker):
+    mocker.patch("src.whisper_service.CliInterface")
+    mocker.patch("src.whisper_service.OUTPUT_RAW_TRANSCRIPTION", False)
+    service = WhisperService(Mock(), source="alice", output_file_path="/path/to/output.alice.json")
+    service.transcript_writer = Mock()
+    mocker.patch("src.whisper_service.build_transcription_output", return_value={"full_text": "Hello", "words": []})
+
+    service.append_transcription_result({"text": "Hello"}, -20)
+    service.append_partial_result("Hel", 1)
+    with patch("src.whisper_service.open", mock_open(), create=True) as open_mock:
+        service.output_transcription_results()
+
+    assert [call.args[0]["source"] for call in service.transcript_writer.append.call_args_list] == ["alice", "alice"]
+    written = "".join(call.args[0] for call in open_mock().write.call_args_list)
+    assert json.loads(written) == {"source": "alice", "full_text": "Hello", "words": []}
+
+
+# Test that the result callback gets each result in capture order, as it is appended
+def test_result_callback(mocker):
+    callback = Mock()
+    service = WhisperService(Mock(), output_file_path="/path/to/output.json", result_callback=callback)
+    service.transcript_writer = Mock()
+
+    service.append_transcription_result({"text": "two"}, -20, sequence=1)
+    callback.assert_not_called()
+    service.append_transcription_result(None, -20, sequence=0)
+
+    assert [call.args[0]["text"] for call in callback.call_args_list] == ["two"]
+
+
+# Test that chunks are marked as transcribed in the spool once their results are written, and dropped or failed chunks
+# as kept
+def test_written_results_are_marked_in_spool():
+    spool = Mock()
+    service = WhisperService(Mock(), output_file_path="/path/to/output.json", spool=spool)
+    service.transcript_writer = Mock()
+
+    service.append_transcription_result({"text": "two"}, -20, sequence=1)
+    spool.mark_transcribed.assert_not_called()
+    service.append_transcription_result({"text": "one"}, -20, sequence=0)
+    service.skip_audio_chunk(1.0, sequence=2)
+    service.append_transcription_result(None, -20, sequence=3)
+
+    assert [call.args[0] for call in spool.mark_transcribed.call_args_list] == [0, 1]
+    assert [call.args[0] for call in spool.mark_kept.call_args_list] == [2, 3]
+
+
+# Test that a service can share a model that is still loading
+def test_shared_model_future():
+    model_future = Future()
+    service = WhisperService(model_future)
+    model_future.set_result("model")
+
+    assert service.model == "model"
+    assert not service.owns_model